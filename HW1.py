@@ -1,6 +1,11 @@
 import os, json, mimetypes, csv, io, requests
 from flask import Flask, request, Response, render_template, redirect, jsonify, url_for
-import re, operator
+from blob_client import BlobClient
+from metadata_store import metadata_store, set_cell_edit, add_row_edit, delete_row_edit
+from preview import render_preview, stream_preview, table_chunks, row_html, figure_html, gallery_chunks, load_more_html, with_page_headers
+from thumbnails import thumbnail_url, store_thumbnail, delete_thumbnail
+from blob_proxy import proxy_blob
+from direct_upload import upload_ticket
 
 from app import get_session_vals
 
@@ -8,71 +13,26 @@ app = Flask(__name__)
 
 TEXT_FILE_NAME = "_placeholder.log"
 IMAGE_FILE_NAME = "milkyway.jpg"
-CONTAINER_URL = "https://cse6332.blob.core.windows.net/privatecontainer"
 DIRECTORY =  "HW1"
-SAS_TOKEN = os.getenv("SAS_TOKEN")
-
-OPS = {">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le, "==": operator.eq, "!=": operator.ne}
-
-if not SAS_TOKEN:
-    try:
-        with open("secrets.json") as f:
-            secrets = json.load(f)
-        SAS_TOKEN = str(secrets["SAS_TOKEN"])
-    except Exception:
-        SAS_TOKEN = ""
 
 #--- GENERAL HELPERS ---#
-def get_blob_url(blob_name: str) -> str:
-    token = SAS_TOKEN.lstrip("?")
-    sep = "?" if "?" not in CONTAINER_URL else "&"
-    return f"{CONTAINER_URL}/{DIRECTORY}/{blob_name}{sep}{token}" if token else f"{CONTAINER_URL}/{DIRECTORY}/{blob_name}"
-
-def blob_exists(filename: str) -> bool:
-    url = get_blob_url(filename)
-    try:
-        r = requests.head(url, timeout=5)
-        return r.status_code == 200
-    except requests.RequestException:
-        return False
+blob = BlobClient(DIRECTORY)
+get_blob_url = blob.get_blob_url
+blob_exists = blob.blob_exists
 
 def read_text_blob(filename: str = TEXT_FILE_NAME) -> str:
-    url = get_blob_url(filename)
-    try:
-        r = requests.get(url, timeout=10)
-        if r.ok:
-            return r.text
-        return f"Failed to load text from blob. HTTP {r.status_code}"
-    except requests.RequestException as e:
-        return f"Failed to load text from blob. Error: {e}"
+    return blob.read_text_blob(filename)
 
 def write_text_blob(comment: str, filename: str = TEXT_FILE_NAME) -> bool:
-    if comment is None or comment.strip() == "":
-        return False
-    url = get_blob_url(filename)
-    headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "text/plain; charset=utf-8",
-    }
-    try:
-        r = requests.put(url, headers=headers, data=comment.encode("utf-8"), timeout=10)
-        return r.status_code in (201, 202)
-    except requests.RequestException:
-        return False
+    return blob.write_text_blob(comment, filename)
 
 #--- METADATA HELPER ---#
 def read_csv_rows(filename: str = "metadata.csv"):
-    url = get_blob_url(filename)
-    r = requests.get(url, timeout=10)
-    if not r.ok:
-        return None, f"HTTP {r.status_code}"
-    f = io.StringIO(r.text, newline="")
-    reader = csv.reader(f)
-    rows = []
-    for row in reader:
-        rows.append([ (c if c.strip() != "" else None) for c in row ])
-    return rows, None
+    return metadata_store(blob, filename).read()
 
+def read_metadata_table(filename: str = "metadata.csv"):
+    # shared MetadataTable for read-only lookups and filters; edits go through metadata_store().apply
+    return metadata_store(blob, filename).table()
 
 #--- ROUTES ---#
 @app.route("/", methods=["GET"])
@@ -83,20 +43,13 @@ def index():
     name_options, columns = [], []
 
     if meta_exists:
-        metadata_rows, err = read_csv_rows("metadata.csv")
+        table, err = read_metadata_table("metadata.csv")
         if err:
             meta_exists = False
-            metadata_rows = None
         else:
-            columns = metadata_rows[0] if metadata_rows else []
-            idx = columns.index("Name") if (columns and "Name" in columns) else 0
-            seen = set()
-            for row in metadata_rows[1:]:
-                if idx < len(row) and row[idx]:
-                    n = row[idx]
-                    if n not in seen:
-                        seen.add(n)
-                        name_options.append(n)
+            metadata_rows = table.to_rows() if table.header else []
+            columns = list(table.header)
+            name_options = table.names()
 
     img_msg  = request.args.get("img_msg")
     meta_msg = request.args.get("meta_msg")
@@ -121,12 +74,13 @@ def upload_text():
 
 @app.route("/get_image")
 def get_image():
-    url = get_blob_url(IMAGE_FILE_NAME)
+    if request.args.get("thumb"):
+        return redirect(thumbnail_url(blob, IMAGE_FILE_NAME) or get_blob_url(IMAGE_FILE_NAME))
     try:
-        r = requests.get(url, timeout=10)
-        if not r.ok:
+        resp = proxy_blob(blob, IMAGE_FILE_NAME, mimetypes.guess_type(IMAGE_FILE_NAME)[0])
+        if resp is None:
             return "Failed to load image from blob.", 502
-        return Response(r.content, mimetype=mimetypes.guess_type(IMAGE_FILE_NAME)[0])
+        return resp
     except requests.RequestException:
         return "Failed to load image from blob.", 502
 
@@ -143,12 +97,7 @@ def upload_csv(filename:str = None):
     file = request.files.get("file")
     if not file or not file.filename:
         return "No file provided", 400
-    url = get_blob_url(filename) #file.filename
-    headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "text/csv"
-    }
-    r = requests.put(url, headers=headers, data=file.read(), timeout=30)
+    r = blob.put_stream(filename, file.stream, "text/csv") #file.filename
     if r.status_code in (201, 202):
         return redirect("/")
     return f"Failed to upload metadata. HTTP {r.status_code}", 500
@@ -161,20 +110,58 @@ def upload_image():
         return redirect(url_for("index", img_msg="error: no name selected"))
     if not file or not file.filename:
         return redirect(url_for("index", img_msg="error: no file provided"))
-    ctype = (mimetypes.guess_type(file.filename)[0] or file.mimetype or "").lower()
-    if not ctype.startswith("image/"):
-        return redirect(url_for("index", img_msg="error: file is not an image"))
-    ext = os.path.splitext(file.filename)[1] or (mimetypes.guess_extension(ctype) or "")
-    target = f"{name}{ext}"
+    target, ctype, err = image_upload_target(name, file.filename, file.mimetype)
+    if err:
+        return redirect(url_for("index", img_msg=f"error: {err}"))
     existed = blob_exists(target)
-    url = get_blob_url(target)
-    headers = {"x-ms-blob-type": "BlockBlob", "Content-Type": ctype}
-    r = requests.put(url, headers=headers, data=file.read(), timeout=30)
+    r = blob.put_stream(target, file.stream, ctype)
     if r.status_code in (201, 202):
+        file.stream.seek(0)
+        store_thumbnail(blob, target, file.stream)
         msg = f"{'replaced' if existed else 'added'} {target}"
         return redirect(url_for("index", img_msg=msg))
     return redirect(url_for("index", img_msg=f"error: HTTP {r.status_code}"))
 
+def image_upload_target(name: str, filename: str, mimetype: str = None):
+    # (blob name, content type, err) for an image file picked for name
+    ctype = (mimetypes.guess_type(filename)[0] or mimetype or "").lower()
+    if not ctype.startswith("image/"):
+        return None, None, "file is not an image"
+    ext = os.path.splitext(filename)[1] or (mimetypes.guess_extension(ctype) or "")
+    return f"{name}{ext}", ctype, None
+
+@app.route("/upload_url", methods=["POST"])
+def upload_url():
+    # direct-upload ticket: a short-lived URL the browser PUTs the file to itself
+    if request.form.get("kind") == "csv":
+        target, ctype, err = "metadata.csv", "text/csv", None
+    else:
+        name = (request.form.get("name") or "").strip()
+        if not name:
+            return jsonify({"error": "no name selected"}), 400
+        target, ctype, err = image_upload_target(name, request.form.get("filename") or "", request.form.get("content_type"))
+    if err:
+        return jsonify({"error": err}), 400
+    ticket = upload_ticket(blob, target, ctype)
+    if ticket is None:
+        return jsonify({"error": "direct upload is not enabled"}), 404
+    kind = "csv" if ctype == "text/csv" else "image"
+    ticket["complete"] = url_for("upload_complete", kind=kind, blob=target, existed=int(blob_exists(target)))
+    return jsonify(ticket)
+
+@app.route("/upload_complete", methods=["POST"])
+def upload_complete():
+    # called by the browser after its direct PUT; the bytes are already in storage, so only bookkeeping is left
+    target = request.args.get("blob") or ""
+    if not target or "/" in target or not blob.blob_exists(target):
+        return jsonify({"error": "upload not found"}), 404
+    blob.note_written(target)
+    if request.args.get("kind") == "csv":
+        return jsonify({"redirect": "/"})
+    delete_thumbnail(blob, target)  # stale variant; the next gallery view makes a new one
+    msg = f"{'replaced' if request.args.get('existed') == '1' else 'added'} {target}"
+    return jsonify({"redirect": url_for("index", img_msg=msg)})
+
 @app.route("/delete_image", methods=["POST"])
 def delete_image():
     name = (request.form.get("name") or "").strip()
@@ -183,65 +170,54 @@ def delete_image():
     filename = find_image_for_name(name)
     if not filename:
         return redirect(url_for("index", img_msg_del=f"not found for {name}"))
-    url = get_blob_url(filename)
     try:
-        r = requests.delete(url, timeout=15)
+        r = blob.delete(filename)
         if r.status_code in (202, 200, 204):
+            delete_thumbnail(blob, filename)
             return redirect(url_for("index", img_msg_del=f"deleted {filename}"))
         return redirect(url_for("index", img_msg_del=f"error: HTTP {r.status_code}"))
     except requests.RequestException as e:
         return redirect(url_for("index", img_msg_del=f"error: {e}"))
 
+@app.route("/thumb")
+def thumb():
+    # gallery thumbnails: redirect to the stored variant (made on first request), or the original if it can't be resized
+    filename = (request.args.get("file") or "").strip()
+    if not filename:
+        return "No file provided", 400
+    return redirect(thumbnail_url(blob, filename) or get_blob_url(filename))
+
 
 IMAGE_EXTS = [".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff"]
 def find_image_for_name(name: str):
-    for ext in IMAGE_EXTS:
-        fn = f"{name}{ext}"
-        if blob_exists(fn):
-            return fn
-    return None
+    return blob.find_image(name, IMAGE_EXTS)
 
 @app.route("/update_metadata_image", methods=["POST"])
 def update_metadata():
     if not blob_exists("metadata.csv"):
         return redirect(url_for("index", img_msg=None, meta_msg="error: metadata.csv not found"))
-    rows, err = read_csv_rows("metadata.csv")
-    if err or not rows:
-        return redirect(url_for("index", meta_msg=f"error: {err or 'empty metadata'}"))
-    header = rows[0]
-    name_idx = header.index("Name") if ("Name" in header) else 0
-    if "Picture" in header:
-        pic_idx = header.index("Picture")
-    else:
-        header.append("Picture")
-        pic_idx = len(header) - 1
-        for r in rows[1:]:
-            r.append(None)
-    for r in rows[1:]:
-        name = (r[name_idx] or "").strip()
-        if not name:
-            r[pic_idx] = None
-            continue
-        found = find_image_for_name(name)
-        r[pic_idx] = found if found else None
-    buf = io.StringIO(newline="")
-    w = csv.writer(buf)
-    for r in rows:
-        w.writerow([c if c is not None else "" for c in r])
-    data = buf.getvalue().encode("utf-8")
-    url = get_blob_url("metadata.csv")
-    headers = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/csv"}
-    r = requests.put(url, headers=headers, data=data, timeout=30)
-    if r.status_code in (201, 202):
-        return redirect(url_for("index", meta_msg="updated Picture column"))
-    return redirect(url_for("index", meta_msg=f"error: HTTP {r.status_code}"))
+    client = blob.pinned()
+    client.list_blob_names(refresh=True)
+    def edit(table):
+        pic_idx = table.header.index("Picture") if "Picture" in table.header else table.add_column("Picture")
+        for pos, name in enumerate(table.texts(table.key_idx)):
+            found = client.find_image(name, IMAGE_EXTS) if name else None
+            table.set(pos, pic_idx, found if found else None)
+    _, err = metadata_store(blob, "metadata.csv").apply(edit)
+    if err:
+        return redirect(url_for("index", meta_msg=err if err.startswith("error") else f"error: {err}"))
+    return redirect(url_for("index", meta_msg="updated Picture column"))
 
 @app.route("/metadata_json", methods=["GET"])
 def metadata_json():
-    rows, err = read_csv_rows("metadata.csv")
+    table, err = read_metadata_table("metadata.csv")
     if err:
         return f"Failed to load metadata.csv: {err}", 502
-    return jsonify(rows)
+    page, next_cursor, err = table.page(range(len(table)), request.args.get("limit", type=int), request.args.get("cursor"))
+    if err:
+        return err, 400
+    rows = ([list(table.header)] if table.header else []) + [table.row(pos) for pos in page]
+    return with_page_headers(jsonify(rows), len(table), next_cursor)
 
 @app.route("/preview", methods=["GET"])
 def preview_default():
@@ -255,102 +231,44 @@ def simple_query():
     col  = request.form.get("column")
     expr = (request.form.get("expr") or "").strip()
     val  = request.form.get("value") or ""
-    rows, err = read_csv_rows("metadata.csv")
-    if err or not rows:
+    table, err = read_metadata_table("metadata.csv")
+    if err or not table.header:
         return Response(render_preview("Failed to load metadata."), mimetype="text/html")
-    header = rows[0]
+    header = table.header
     if col not in header:
         return Response(render_preview("Invalid column."), mimetype="text/html")
     col_idx  = header.index(col)
-    name_idx = header.index("Name") if "Name" in header else 0
+    name_idx = table.key_idx
     pic_idx  = header.index("Picture") if "Picture" in header else None
 
-    m = re.match(r"^\s*(>=|<=|==|!=|>|<)\s*(-?\d+(?:\.\d+)?)\s*$", expr) if expr else None
-
-    def match(cell):
-        s = "" if cell is None else str(cell).strip()
-        if m:
-            op, num = m.group(1), float(m.group(2))
-            try:
-                x = float(s)
-            except ValueError:
-                return False
-            return OPS[op](x, num)
-        if expr:
-            return s.lower() == expr.lower()
-        if val:
-            return s == val
-        return False
-
-    filtered = [header] + [r for r in rows[1:] if col_idx < len(r) and match(r[col_idx])]
-    if len(filtered) == 1:
+    hits, err = table.query(col_idx, expr, val)
+    if err:
+        return Response(render_preview(err), mimetype="text/html")
+    if not hits:
         return Response(render_preview("<div style='padding:8px;'>No matches.</div>"), mimetype="text/html")
-    table_html  = "<table style='width:100%;border-collapse:collapse;'>"
-    table_html += "<thead><tr>" + "".join(f"<th style='border:1px solid #444;padding:4px;'>{h or ''}</th>" for h in header) + "</tr></thead><tbody>"
-    for r in filtered[1:]:
-        table_html += "<tr>" + "".join(f"<td style='border:1px solid #333;padding:4px;'>{(c or '')}</td>" for c in r) + "</tr>"
-    table_html += "</tbody></table>"
-    images = []
-    seen_files = set()
-    for r in filtered[1:]:
-        pic = None
-        if pic_idx is not None and pic_idx < len(r) and r[pic_idx]:
-            candidate = r[pic_idx]
-            if blob_exists(candidate):
-                pic = candidate
-        if not pic:
-            nm = (r[name_idx] or "").strip()
-            if nm:
-                candidate = find_image_for_name(nm)
-                if candidate:
-                    pic = candidate
-        if pic and pic not in seen_files:
-            seen_files.add(pic)
-            images.append(((r[name_idx] or pic), pic))
-    imgs_html = ""
-    if images:
-        imgs_html += "<div style='margin-top:12px'><h4>Pictures</h4>"
-        imgs_html += "<div style='display:grid;grid-template-columns:repeat(auto-fill,minmax(140px,1fr));gap:8px;'>"
-        for label, fname in images:
-            src = get_blob_url(fname)
-            cap = label or fname
-            imgs_html += (
-                "<figure style='margin:0;padding:0;text-align:center;background:#000'>"
-                f"<img src='{src}' alt='{cap}' style='max-width:100%;height:140px;object-fit:contain;display:block;'>"
-                f"<figcaption style='font-size:12px;padding:4px 0'>{cap}</figcaption>"
-                "</figure>"
-            )
-        imgs_html += "</div></div>"
-    return Response(render_preview(table_html + imgs_html), mimetype="text/html")
-
-
-# this part is to retain preview when updating/ or may be used in other stuff
-def render_preview(inner_html: str, reload_parent: bool = False) -> str:
-    style = (
-        "body,table,th,td,div,span,p,li,code,pre,a{color:#fff;}"
-        "table{width:100%;border-collapse:collapse}"
-        "th,td{border:1px solid #444;padding:4px}"
-        "body{background:#111;font-family:Arial,sans-serif;padding:8px}"
-    )
-    base = f"<!doctype html><html><head><meta charset='utf-8'><style>{style}</style></head><body>"
-    html = f"{base}<div id='payload'>{inner_html}</div>"
-    if reload_parent:
-        html += """
-<script>
-try{
-  var payload = document.getElementById('payload').innerHTML;
-  var clean = "<!doctype html><html><head><meta charset='utf-8'><style>""" + \
-              style + \
-              """</style></head><body>" + payload + "</body></html>";
-  window.parent.sessionStorage.setItem("previewHTML", clean);
-}catch(e){}
-if (window.parent && window.parent !== window) {
-  window.parent.location.reload();
-}
-</script>
-"""
-    html += "</body></html>"
-    return html
+    page, next_cursor, err = table.page(hits, request.form.get("limit", type=int), request.form.get("cursor"))
+    if err:
+        return Response(render_preview(err), mimetype="text/html")
+
+    def pictures(positions):
+        # resolved after the table rows are on the wire, so lookups never hold back the first byte
+        names, pics = table.column(name_idx), (table.column(pic_idx) if pic_idx is not None else None)
+        wanted = [((pics[pos] if pics is not None else None) or None, (names[pos] or "").strip()) for pos in positions]
+        seen_files = set()
+        for pos, pic in zip(positions, blob.resolve_pictures(wanted, IMAGE_EXTS)):
+            if pic and pic not in seen_files:
+                seen_files.add(pic)
+                yield figure_html(url_for("thumb", file=pic), names[pos] or pic)
+
+    if request.form.get("fragment"):
+        resp = jsonify({"rows": "".join(row_html(table.row(pos)) for pos in page),
+                        "figures": "".join(pictures(page)), "next_cursor": next_cursor})
+    else:
+        params = {k: v for k, v in request.form.items() if k not in ("cursor", "fragment")}
+        resp = stream_preview(table_chunks(header, (table.row(pos) for pos in page)), gallery_chunks(pictures(page)),
+                              load_more_html(request.path, params, next_cursor))
+    return with_page_headers(resp, len(hits), next_cursor)
+
 
 @app.route("/update_cell", methods=["POST"])
 def update_cell():
@@ -359,37 +277,10 @@ def update_cell():
     column   = request.form.get("column")
     row_key  = (request.form.get("row_key") or "").strip()
     new_val  = request.form.get("new_value", "")
-    rows, err = read_csv_rows("metadata.csv")
-    if err or not rows: return Response("Failed to load metadata.", mimetype="text/html")
-    header = rows[0]
-    if column not in header: return Response("Invalid column.", mimetype="text/html")
-    key_idx = header.index("Name") if "Name" in header else 0
-    col_idx = header.index(column)
-    updated_row = None
-    for r in rows[1:]:
-        key = (r[key_idx] or "").strip()
-        if key == row_key:
-            while len(r) <= col_idx: r.append(None)
-            r[col_idx] = (new_val if new_val != "" else None)
-            updated_row = list(r)
-            break
-    if not updated_row:
-        return Response("Row not found.", mimetype="text/html")
-    buf = io.StringIO(newline="")
-    w = csv.writer(buf)
-    for r in rows:
-        w.writerow([c if c is not None else "" for c in r])
-    data = buf.getvalue().encode("utf-8")
-    url = get_blob_url("metadata.csv")
-    hdrs = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/csv"}
-    rr = requests.put(url, headers=hdrs, data=data, timeout=30)
-    if rr.status_code not in (201, 202):
-        return Response(f"error: HTTP {rr.status_code}", mimetype="text/html")
-    html = "<div style='padding:8px;'>Updated row:</div>"
-    html += "<table style='width:100%;border-collapse:collapse;'>"
-    html += "<thead><tr>" + "".join(f"<th style='border:1px solid #444;padding:4px;'>{h or ''}</th>" for h in header) + "</tr></thead>"
-    html += "<tbody><tr>" + "".join(f"<td style='border:1px solid #333;padding:4px;'>{(c or '')}</td>" for c in updated_row) + "</tr></tbody></table>"
-    return Response(render_preview(html, reload_parent=True), mimetype="text/html")
+    result, err = metadata_store(blob, "metadata.csv").apply(set_cell_edit(column, row_key, new_val))
+    if err: return Response(err, mimetype="text/html")
+    header, updated_row = result
+    return stream_preview("<div style='padding:8px;'>Updated row:</div>", table_chunks(header, [updated_row]), reload_parent=True)
 
 @app.route("/delete_row", methods=["POST"])
 def delete_row():
@@ -398,36 +289,11 @@ def delete_row():
     row_key = (request.form.get("row_key") or "").strip()
     if not row_key:
         return Response(render_preview("no row key provided"), mimetype="text/html")
-    rows, err = read_csv_rows("metadata.csv")
-    if err or not rows:
-        return Response(render_preview("Failed to load metadata."), mimetype="text/html")
-    header = rows[0]
-    key_idx = header.index("Name") if "Name" in header else 0
-    deleted_row = None
-    kept = [header]
-    for r in rows[1:]:
-        key = (r[key_idx] or "").strip()
-        if deleted_row is None and key == row_key:
-            deleted_row = list(r)
-            continue
-        kept.append(r)
-    if not deleted_row:
-        return Response(render_preview("Row not found."), mimetype="text/html")
-    buf = io.StringIO(newline="")
-    w = csv.writer(buf)
-    for r in kept:
-        w.writerow([c if c is not None else "" for c in r])
-    data = buf.getvalue().encode("utf-8")
-    url = get_blob_url("metadata.csv")
-    hdrs = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/csv"}
-    rr = requests.put(url, headers=hdrs, data=data, timeout=30)
-    if rr.status_code not in (201, 202):
-        return Response(render_preview(f"error: HTTP {rr.status_code}"), mimetype="text/html")
-    html = "<div style='padding:8px;'>Deleted row:</div>"
-    html += "<table style='width:100%;border-collapse:collapse;'>"
-    html += "<thead><tr>" + "".join(f"<th style='border:1px solid #444;padding:4px;'>{h or ''}</th>" for h in header) + "</tr></thead>"
-    html += "<tbody><tr>" + "".join(f"<td style='border:1px solid #333;padding:4px;'>{(c or '')}</td>" for c in deleted_row) + "</tr></tbody></table>"
-    return Response(render_preview(html, reload_parent=True), mimetype="text/html")
+    result, err = metadata_store(blob, "metadata.csv").apply(delete_row_edit(row_key))
+    if err:
+        return Response(render_preview(err), mimetype="text/html")
+    header, deleted_row = result
+    return stream_preview("<div style='padding:8px;'>Deleted row:</div>", table_chunks(header, [deleted_row]), reload_parent=True)
 
 @app.route("/add_row", methods=["POST"])
 def add_row():
@@ -436,37 +302,11 @@ def add_row():
     name = (request.form.get("name") or "").strip()
     if not name:
         return Response(render_preview("no name provided"), mimetype="text/html")
-    rows, err = read_csv_rows("metadata.csv")
-    if err or not rows:
-        return Response(render_preview("Failed to load metadata."), mimetype="text/html")
-    header = rows[0]
-    name_idx = header.index("Name") if "Name" in header else 0
-    for r in rows[1:]:
-        key = (r[name_idx] or "").strip()
-        if key == name:
-            return Response(render_preview(f"error: '{name}' already exists"), mimetype="text/html")
-    new_row = [None] * max(len(header), name_idx + 1)
-    new_row[name_idx] = name
-    rows.append(new_row)
-    buf = io.StringIO(newline="")
-    w = csv.writer(buf)
-    for r in rows:
-        w.writerow([c if c is not None else "" for c in r])
-    data = buf.getvalue().encode("utf-8")
-    url = get_blob_url("metadata.csv")
-    hdrs = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/csv"}
-    rr = requests.put(url, headers=hdrs, data=data, timeout=30)
-    if rr.status_code not in (201, 202):
-        return Response(render_preview(f"error: HTTP {rr.status_code}"), mimetype="text/html")
-    html = "<div style='padding:8px;'>Added row:</div>"
-    html += "<table style='width:100%;border-collapse:collapse;'>"
-    html += "<thead><tr>" + "".join(
-        f"<th style='border:1px solid #444;padding:4px;'>{h or ''}</th>" for h in header
-    ) + "</tr></thead>"
-    html += "<tbody><tr>" + "".join(
-        f"<td style='border:1px solid #333;padding:4px;'>{(c or '')}</td>" for c in new_row
-    ) + "</tr></tbody></table>"
-    return Response(render_preview(html, reload_parent=True), mimetype="text/html")
+    result, err = metadata_store(blob, "metadata.csv").apply(add_row_edit(name))
+    if err:
+        return Response(render_preview(err), mimetype="text/html")
+    header, new_row = result
+    return stream_preview("<div style='padding:8px;'>Added row:</div>", table_chunks(header, [new_row]), reload_parent=True)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=False)
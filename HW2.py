@@ -1,73 +1,61 @@
-import os, json, mimetypes, csv, io, requests, sqlite3, tempfile
-from flask import Flask, request, Response, render_template, redirect, jsonify, url_for
+import os, json, mimetypes, csv, io, requests, sqlite3
+from flask import Flask, request, Response, render_template, stream_template, redirect, jsonify, url_for
 import re, operator
+from blob_client import BlobClient, get_http_session
+from sqlite_ingest import bulk_load, upsert_csv
+from sqlite_spatial import build_rtree, rtree_name, within_km
+from sqlite_replica import sqlite_replica, database_image, SQLITE_STREAM_RESULTS
+from sqlite_session import write_session, WriteError, MISSING_BLOB
 from datetime import datetime
 app = Flask(__name__)
 
 TEXT_FILE_NAME = "_placeholder.log"
 IMAGE_FILE_NAME = "milkyway.jpg"
-CONTAINER_URL = "https://cse6332.blob.core.windows.net/privatecontainer"
 DIRECTORY =  "HW2"
-SAS_TOKEN = os.getenv("SAS_TOKEN")
-
-if not SAS_TOKEN:
-    try:
-        with open("secrets.json") as f:
-            secrets = json.load(f)
-        SAS_TOKEN = str(secrets["SAS_TOKEN"])
-    except Exception:
-        SAS_TOKEN = ""
+EARTHQUAKES_SCHEMA = """
+    CREATE TABLE Earthquakes (
+        time TEXT,
+        latitude REAL,
+        longitude REAL,
+        depth REAL,
+        mag REAL,
+        magType TEXT,
+        nst INTEGER,
+        gap REAL,
+        dmin REAL,
+        rms REAL,
+        net TEXT,
+        id TEXT PRIMARY KEY,
+        updated TEXT,
+        place TEXT,
+        type TEXT,
+        horizontalError REAL,
+        depthError REAL,
+        magError REAL,
+        magNst INTEGER,
+        status TEXT,
+        locationSource TEXT,
+        magSource TEXT
+    )
+"""
+FEED_URLS = {window: f"https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_{window}.csv"
+             for window in ("hour", "day", "week", "month")}
+EARTHQUAKE_INDEXES = (("idx_earthquakes_time", "time"), ("idx_earthquakes_mag", "mag"))
 
 #--- GENERAL HELPERS ---#
-def get_blob_url(blob_name: str) -> str:
-    token = SAS_TOKEN.lstrip("?")
-    sep = "?" if "?" not in CONTAINER_URL else "&"
-    return f"{CONTAINER_URL}/{DIRECTORY}/{blob_name}{sep}{token}" if token else f"{CONTAINER_URL}/{DIRECTORY}/{blob_name}"
-
-def blob_exists(filename: str) -> bool:
-    url = get_blob_url(filename)
-    try:
-        r = requests.head(url, timeout=5)
-        return r.status_code == 200
-    except requests.RequestException:
-        return False
+blob = BlobClient(DIRECTORY)
+get_blob_url = blob.get_blob_url
+blob_exists = blob.blob_exists
 
 def read_text_blob(filename: str = TEXT_FILE_NAME) -> str:
-    url = get_blob_url(filename)
-    try:
-        r = requests.get(url, timeout=10)
-        if r.ok:
-            return r.text
-        return f"Failed to load text from blob. HTTP {r.status_code}"
-    except requests.RequestException as e:
-        return f"Failed to load text from blob. Error: {e}"
+    return blob.read_text_blob(filename)
 
 def write_text_blob(comment: str, filename: str = TEXT_FILE_NAME) -> bool:
-    if comment is None or comment.strip() == "":
-        return False
-    url = get_blob_url(filename)
-    headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "text/plain; charset=utf-8",
-    }
-    try:
-        r = requests.put(url, headers=headers, data=comment.encode("utf-8"), timeout=10)
-        return r.status_code in (201, 202)
-    except requests.RequestException:
-        return False
+    return blob.write_text_blob(comment, filename)
 
 #--- METADATA HELPER ---#
 def read_csv_rows(filename: str = "data.csv"):
-    url = get_blob_url(filename)
-    r = requests.get(url, timeout=10)
-    if not r.ok:
-        return None, f"HTTP {r.status_code}"
-    f = io.StringIO(r.text, newline="")
-    reader = csv.reader(f)
-    rows = []
-    for row in reader:
-        rows.append([ (c if c.strip() != "" else None) for c in row ])
-    return rows, None
+    return blob.read_csv_rows(filename)
 
 #--- ROUTES ---#
 @app.route("/", methods=["GET"])
@@ -86,16 +74,13 @@ def hw2():
         last_download_time= last_download_time
     )
 
-def get_url_csv_to_blob(url: str = "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_month.csv",force: bool = False) -> bool:
+def get_url_csv_to_blob(url: str = FEED_URLS["month"],force: bool = False) -> bool:
     csv_blob_name = "data.csv"
     db_blob_name = "data.db"
     if not force and blob_exists(csv_blob_name) and blob_exists(db_blob_name):
         return True
     try:
-        response = requests.get(
-            url=url,
-            timeout=15
-        )
+        response = get_http_session().get(url, timeout=15)
         if not response.ok:
             print(f"Failed to download CSV: HTTP {response.status_code}")
             return False
@@ -103,13 +88,8 @@ def get_url_csv_to_blob(url: str = "https://earthquake.usgs.gov/earthquakes/feed
     except requests.RequestException as e:
         print(f"Download error: {e}")
         return False
-    csv_url = get_blob_url(csv_blob_name)
-    headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "text/csv; charset=utf-8",
-    }
     try:
-        r = requests.put(csv_url, headers=headers, data=csv_data, timeout=10)
+        r = blob.put(csv_blob_name, csv_data, "text/csv; charset=utf-8", timeout=10)
         if r.status_code not in (201, 202):
             print(f"CSV upload failed: HTTP {r.status_code}")
             return False
@@ -119,73 +99,29 @@ def get_url_csv_to_blob(url: str = "https://earthquake.usgs.gov/earthquakes/feed
 
     conn = sqlite3.connect(":memory:")
     cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE Earthquakes (
-            time TEXT,
-            latitude REAL,
-            longitude REAL,
-            depth REAL,
-            mag REAL,
-            magType TEXT,
-            nst INTEGER,
-            gap REAL,
-            dmin REAL,
-            rms REAL,
-            net TEXT,
-            id TEXT PRIMARY KEY,
-            updated TEXT,
-            place TEXT,
-            type TEXT,
-            horizontalError REAL,
-            depthError REAL,
-            magError REAL,
-            magNst INTEGER,
-            status TEXT,
-            locationSource TEXT,
-            magSource TEXT
-        )
-    """)
-    csv_text = csv_data.decode("utf-8")
-    reader = csv.DictReader(io.StringIO(csv_text))
-    for row in reader:
-        values = [row.get(col) for col in reader.fieldnames]
-        placeholders = ",".join("?" * len(values))
-        cursor.execute(f"INSERT OR IGNORE INTO Earthquakes VALUES ({placeholders})", values)
-    conn.commit()
-    with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-        temp_db_path = tmpfile.name
+    cursor.execute(EARTHQUAKES_SCHEMA)
+    try:
+        csv_text = csv_data.decode("utf-8")
+        bulk_load(conn, "Earthquakes", csv_text, EARTHQUAKE_INDEXES)
+        build_rtree(conn, "Earthquakes", "latitude", "longitude")
+    except (ValueError, sqlite3.Error) as e:
+        print(f"CSV parsing or DB insert error: {e}")
+        conn.close()
+        return False
     try:
-        disk_conn = sqlite3.connect(temp_db_path)
-        conn.backup(disk_conn) #bckp in tempfile->memory just incase
-        disk_conn.close()
-        with open(temp_db_path, "rb") as f:
-            db_bytes = f.read()
+        db_bytes = database_image(conn)
     finally:
-        os.remove(temp_db_path)
         conn.close()
 
-    db_url = get_blob_url(db_blob_name)
-    db_headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "application/octet-stream",
-    }
-    try:
-        r = requests.put(db_url, headers=db_headers, data=db_bytes, timeout=10)
-        if r.status_code not in (201, 202):
-            print(f"DB upload failed: HTTP {r.status_code}")
-            return False
-    except requests.RequestException as e:
-        print(f"DB upload error: {e}")
+    # goes through the write session so it waits for, rather than collides with, the lease a sync holds
+    err = write_session(blob, db_blob_name).replace(db_bytes)
+    if err:
+        print(err)
         return False
 
     date_str = datetime.now().strftime("%m-%d-%Y")
-    date_blob_url = get_blob_url("date.txt")
-    date_headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "text/plain; charset=utf-8",
-    }
     try:
-        r = requests.put(date_blob_url, headers=date_headers, data=date_str.encode("utf-8"), timeout=10)
+        r = blob.put("date.txt", date_str.encode("utf-8"), "text/plain; charset=utf-8", timeout=10)
         if r.status_code in (201, 202):
             return True
         else:
@@ -200,31 +136,55 @@ def download_data():
     success = get_url_csv_to_blob(force=True)
     return redirect(url_for("hw2"))
 
-def query_data_sqlite_blob(sql_query: str):
-    blob_name = "data.db"
-    blob_url = get_blob_url(blob_name)
+def sync_feed(window: str = "day") -> bool:
+    # upserts the small hour/day feed into data.db by id/updated instead of rebuilding from the month feed. It runs
+    # as a write session mutation: nothing is uploaded when nothing changed, otherwise only the changed pages are
+    url = FEED_URLS.get(window, FEED_URLS["day"])
     try:
-        r = requests.get(blob_url, timeout=10)
-        if not r.ok:
-            return None, f"Failed to download DB blob. HTTP {r.status_code}"
-        db_bytes = r.content
+        response = get_http_session().get(url, timeout=15)
+        if not response.ok:
+            print(f"Failed to download feed: HTTP {response.status_code}")
+            return False
+        csv_text = response.content.decode("utf-8")
     except requests.RequestException as e:
-        return None, f"Download error: {e}"
-    with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-        temp_db_path = tmpfile.name
-        tmpfile.write(db_bytes)
-    try:
-        conn = sqlite3.connect(temp_db_path)
-        cursor = conn.cursor()
-        cursor.execute(sql_query)
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
-    except sqlite3.Error as e:
-        return None, f"SQLite error: {e}"
-    finally:
-        os.remove(temp_db_path)
-    return results, None
+        print(f"Download error: {e}")
+        return False
+    def upsert(conn):
+        try:
+            return upsert_csv(conn, "Earthquakes", csv_text)
+        except ValueError as e:
+            raise WriteError(f"Feed parsing error: {e}")
+    changed, err = write_session(blob, "data.db").apply(upsert)
+    if err == MISSING_BLOB:
+        print(f"No database to sync into ({err}); rebuilding from the month feed")
+        return get_url_csv_to_blob(force=True)
+    if err:
+        print(err)
+        return False
+    date_str = datetime.now().strftime("%m-%d-%Y")
+    return write_text_blob(date_str, "date.txt")
+
+@app.route("/HW2/sync", methods=["POST"])
+def sync_data():
+    success = sync_feed(request.form.get("window", "day"))
+    return redirect(url_for("hw2"))
+
+def query_data_sqlite_blob(sql_query: str, params=(), stream: bool = SQLITE_STREAM_RESULTS):
+    # (rows, column names, err) from one execution on this worker's local replica of data.db; only a changed blob is
+    # downloaded again. With stream, rows is an iterator fed by fetchmany while the template renders
+    replica = sqlite_replica(blob, "data.db")
+    return replica.stream(sql_query, params) if stream else replica.select(sql_query, params)
+
+def spatially_indexed(table: str) -> bool:
+    # data.db files built before the R*Tree existed fall back to a plain (scanning) box filter
+    rows, _, _ = query_data_sqlite_blob("SELECT 1 FROM sqlite_master WHERE name = ?", (rtree_name(table),), stream=False)
+    return bool(rows)
+
+def render_results(template: str, **context):
+    # rows that are still an iterator need the template streamed as they are fetched
+    if isinstance(context.get("query_results"), list) or not context.get("query_results"):
+        return render_template(template, **context)
+    return Response(stream_template(template, **context))
 
 @app.route("/HW2/query", methods=["POST"])
 def run_query():
@@ -235,29 +195,12 @@ def run_query():
     if not sql_query:
         query_error = "Query is empty."
     else:
-        results, error = query_data_sqlite_blob(sql_query)
+        results, columns, error = query_data_sqlite_blob(sql_query)
         if error:
             query_error = error
         else:
             query_results = results
-            try:
-                blob_name = "data.db"
-                blob_url = get_blob_url(blob_name)
-                r = requests.get(blob_url, timeout=10)
-                if r.ok:
-                    db_bytes = r.content
-                    with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-                        tmpfile.write(db_bytes)
-                        temp_db_path = tmpfile.name
-                    conn = sqlite3.connect(temp_db_path)
-                    cursor = conn.cursor()
-                    cursor.execute(sql_query)
-                    column_names = [desc[0] for desc in cursor.description]
-                    cursor.close()
-                    conn.close()
-                    os.remove(temp_db_path)
-            except Exception:
-                column_names = []
+            column_names = columns
 
     last_download_time = None
     if blob_exists("date.txt"):
@@ -266,7 +209,7 @@ def run_query():
             last_download_time = date_content.strip()
     # had to repeat this
 
-    return render_template(
+    return render_results(
         "HW2.html",
         last_download_time=last_download_time,
         query_results=query_results,
@@ -283,6 +226,7 @@ def run_prepared_query():
     p3 = request.form.get("param3")
     p4 = request.form.get("param4")
     p5 = request.form.get("param5")
+    params = ()
 
     if qtype == "largest_n":
         sql = f"""
@@ -294,11 +238,10 @@ def run_prepared_query():
         # account for blank values
     elif qtype == "buffer_quakes":
         lat, lon, km = float(p1), float(p2), float(p3)
-        deg = km / 111
+        where, params = within_km("Earthquakes", "latitude", "longitude", lat, lon, km, spatially_indexed("Earthquakes"))
         sql = f"""
             SELECT place, mag, time FROM Earthquakes
-            WHERE latitude BETWEEN {lat - deg} AND {lat + deg}
-              AND longitude BETWEEN {lon - deg} AND {lon + deg}
+            WHERE {where}
         """
     elif qtype == "date_range":
         sql = f"""
@@ -320,56 +263,31 @@ def run_prepared_query():
             WHERE time >= datetime('now', '-3 days')
         """
     elif qtype == "compare_regions":
-        x1, y1, b1 = float(p1), float(p2), float(p3)
-        x2, y2, b2 = float(p4), float(p5), float(p3)
-        d1 = b1 / 111
-        d2 = b2 / 111
-        # approx (within bounding box of buffer not eucledian distn)
+        # form order: Region A lat/lon, Region B lat/lon, buffer in km
+        x1, y1, x2, y2, km = float(p1), float(p2), float(p3), float(p4), float(p5)
+        indexed = spatially_indexed("Earthquakes")
+        where1, params1 = within_km("Earthquakes", "latitude", "longitude", x1, y1, km, indexed)
+        where2, params2 = within_km("Earthquakes", "latitude", "longitude", x2, y2, km, indexed)
+        params = params1 + params2
         sql = f"""
             SELECT 'Region A' AS region, COUNT(*) FROM Earthquakes
-            WHERE latitude BETWEEN {x1 - d1} AND {x1 + d1}
-              AND longitude BETWEEN {y1 - d1} AND {y1 + d1}
+            WHERE {where1}
             UNION
             SELECT 'Region B', COUNT(*) FROM Earthquakes
-            WHERE latitude BETWEEN {x2 - d2} AND {x2 + d2}
-              AND longitude BETWEEN {y2 - d2} AND {y2 + d2}
+            WHERE {where2}
         """
     elif qtype == "largest_near":
         x, y, km = float(p1), float(p2), float(p3)
-        deg = km / 111
+        where, params = within_km("Earthquakes", "latitude", "longitude", x, y, km, spatially_indexed("Earthquakes"))
         sql = f"""
             SELECT place, mag, time FROM Earthquakes
-            WHERE latitude BETWEEN {x - deg} AND {x + deg}
-              AND longitude BETWEEN {y - deg} AND {y + deg}
+            WHERE {where}
             ORDER BY mag DESC LIMIT 1
         """
     else:
         sql = "SELECT 'Invalid query type'"
 
-    results, error = query_data_sqlite_blob(sql)
-
-    # Get column names if query successful
-    colnames = []
-    if results and not error:
-        blob_url = get_blob_url("data.db")
-        r = requests.get(blob_url, timeout=10)
-        with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-            tmpfile.write(r.content)
-            db_path = tmpfile.name
-        try:
-            conn = sqlite3.connect(db_path)
-            c = conn.cursor()
-            c.execute(sql)
-            colnames = [desc[0] for desc in c.description]
-            c.close()
-            conn.close()
-        except Exception as e:
-            error = f"Error extracting column names: {e}"
-        finally:
-            try:
-                os.remove(db_path)
-            except Exception as e:
-                print(f"Temp file removal error: {e}")
+    results, colnames, error = query_data_sqlite_blob(sql, params)
 
     # Load last download time
     last_download_time = None
@@ -378,7 +296,7 @@ def run_prepared_query():
         if date_content and not date_content.startswith("Failed"):
             last_download_time = date_content.strip()
 
-    return render_template("HW2.html",
+    return render_results("HW2.html",
                            last_download_time=last_download_time,
                            query_results=results,
                            column_names=colnames,
@@ -1,84 +1,44 @@
-import os, json, mimetypes, csv, io, requests, sqlite3, tempfile
-from flask import Flask, request, Response, render_template, redirect, jsonify, url_for
+import os, json, mimetypes, csv, io, requests, sqlite3
+from flask import Flask, request, Response, render_template, stream_template, redirect, jsonify, url_for
 import re, operator
+from blob_client import BlobClient
+from blob_proxy import proxy_blob
+from sqlite_ingest import bulk_load
+from sqlite_spatial import build_rtree, rtree_name, box_filter
+from sqlite_replica import sqlite_replica, database_image, SQLITE_STREAM_RESULTS
+from sqlite_session import write_session
 from datetime import datetime
 app = Flask(__name__)
 
 TEXT_FILE_NAME = "_placeholder.log"
 IMAGE_FILE_NAME = "mypic.jpg"
-CONTAINER_URL = "https://cse6332.blob.core.windows.net/privatecontainer"
 DIRECTORY =  "Qz2"
-SAS_TOKEN = os.getenv("SAS_TOKEN")
-
-if not SAS_TOKEN:
-    try:
-        with open("secrets.json") as f:
-            secrets = json.load(f)
-        SAS_TOKEN = str(secrets["SAS_TOKEN"])
-    except Exception:
-        SAS_TOKEN = ""
+DATA_TAB_INDEXES = (("idx_data_tab_mag", "mag"), ("idx_data_tab_net", "net"), ("idx_data_tab_time", "time"))
 
 #--- GENERAL HELPERS ---#
-def get_blob_url(blob_name: str) -> str:
-    token = SAS_TOKEN.lstrip("?")
-    sep = "?" if "?" not in CONTAINER_URL else "&"
-    return f"{CONTAINER_URL}/{DIRECTORY}/{blob_name}{sep}{token}" if token else f"{CONTAINER_URL}/{DIRECTORY}/{blob_name}"
-
-def blob_exists(filename: str) -> bool:
-    url = get_blob_url(filename)
-    try:
-        r = requests.head(url, timeout=5)
-        return r.status_code == 200
-    except requests.RequestException:
-        return False
+blob = BlobClient(DIRECTORY)
+get_blob_url = blob.get_blob_url
+blob_exists = blob.blob_exists
 
 def read_text_blob(filename: str = TEXT_FILE_NAME) -> str:
-    url = get_blob_url(filename)
-    try:
-        r = requests.get(url, timeout=10)
-        if r.ok:
-            return r.text
-        return f"Failed to load text from blob. HTTP {r.status_code}"
-    except requests.RequestException as e:
-        return f"Failed to load text from blob. Error: {e}"
+    return blob.read_text_blob(filename)
 
 def write_text_blob(comment: str, filename: str = TEXT_FILE_NAME) -> bool:
-    if comment is None or comment.strip() == "":
-        return False
-    url = get_blob_url(filename)
-    headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "text/plain; charset=utf-8",
-    }
-    try:
-        r = requests.put(url, headers=headers, data=comment.encode("utf-8"), timeout=10)
-        return r.status_code in (201, 202)
-    except requests.RequestException:
-        return False
+    return blob.write_text_blob(comment, filename)
 
 @app.route("/get_image")
 def get_image():
-    url = get_blob_url(IMAGE_FILE_NAME)
     try:
-        r = requests.get(url, timeout=10)
-        if not r.ok:
+        resp = proxy_blob(blob, IMAGE_FILE_NAME, mimetypes.guess_type(IMAGE_FILE_NAME)[0])
+        if resp is None:
             return "Failed to load image from blob.", 502
-        return Response(r.content, mimetype=mimetypes.guess_type(IMAGE_FILE_NAME)[0])
+        return resp
     except requests.RequestException:
         return "Failed to load image from blob.", 502
 
 #--- METADATA HELPER ---#
 def read_csv_rows(filename: str = "data.csv"):
-    url = get_blob_url(filename)
-    r = requests.get(url, timeout=10)
-    if not r.ok:
-        return None, f"HTTP {r.status_code}"
-    f = io.StringIO(r.text, newline="")
-    reader = csv.reader(f)
-    rows = []
-    for row in reader:
-        rows.append([ (c if c.strip() != "" else None) for c in row ])
-    return rows, None
+    return blob.read_csv_rows(filename)
 
 #--- ROUTES ---#
 @app.route("/", methods=["GET"])
@@ -105,8 +65,7 @@ def get_url_csv_to_blob(force: bool = False) -> bool:
         return True
 
     try:
-        csv_url = get_blob_url(source_blob_name)
-        response = requests.get(csv_url, timeout=15)
+        response = blob.get(source_blob_name, timeout=15)
         if not response.ok:
             print(f"Failed to download CSV blob: HTTP {response.status_code}")
             return False
@@ -130,53 +89,29 @@ def get_url_csv_to_blob(force: bool = False) -> bool:
     """)
     try:
         csv_text = csv_data.decode("utf-8")
-        reader = csv.DictReader(io.StringIO(csv_text))
-        for row in reader:
-            values = [row.get(col) for col in reader.fieldnames]
-            placeholders = ",".join("?" * len(values))
-            cursor.execute(f"INSERT OR IGNORE INTO data_tab VALUES ({placeholders})", values)
-        conn.commit()
+        bulk_load(conn, "data_tab", csv_text, DATA_TAB_INDEXES)
+        build_rtree(conn, "data_tab", "lat", "long")
     except Exception as e:
         print(f"CSV parsing or DB insert error: {e}")
         conn.close()
         return False
 
-    # --- Step 4: Save SQLite DB to file and upload it ---
-    with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-        temp_db_path = tmpfile.name
+    # --- Step 4: Serialize the SQLite DB and upload it ---
     try:
-        disk_conn = sqlite3.connect(temp_db_path)
-        conn.backup(disk_conn)
-        disk_conn.close()
-        with open(temp_db_path, "rb") as f:
-            db_bytes = f.read()
+        db_bytes = database_image(conn)
     finally:
-        os.remove(temp_db_path)
         conn.close()
 
-    db_url = get_blob_url(db_blob_name)
-    db_headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "application/octet-stream",
-    }
-    try:
-        r = requests.put(db_url, headers=db_headers, data=db_bytes, timeout=10)
-        if r.status_code not in (201, 202):
-            print(f"DB upload failed: HTTP {r.status_code}")
-            return False
-    except requests.RequestException as e:
-        print(f"DB upload error: {e}")
+    # goes through the write session so it waits for, rather than collides with, the session's lease
+    err = write_session(blob, db_blob_name).replace(db_bytes)
+    if err:
+        print(err)
         return False
 
     # --- Step 5: Upload current date as date.txt ---
     date_str = datetime.now().strftime("%m-%d-%Y")
-    date_blob_url = get_blob_url("date.txt")
-    date_headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "text/plain; charset=utf-8",
-    }
     try:
-        r = requests.put(date_blob_url, headers=date_headers, data=date_str.encode("utf-8"), timeout=10)
+        r = blob.put("date.txt", date_str.encode("utf-8"), "text/plain; charset=utf-8", timeout=10)
         if r.status_code in (201, 202):
             return True
         else:
@@ -192,36 +127,22 @@ def download_data():
     return redirect(url_for("qz2"))
 
 
-def query_data_sqlite_blob(sql_query: str):
-    blob_name = "data.db"
-    blob_url = get_blob_url(blob_name)
-    try:
-        r = requests.get(blob_url, timeout=10)
-        if not r.ok:
-            return None, f"Failed to download DB blob. HTTP {r.status_code}"
-        db_bytes = r.content
-    except requests.RequestException as e:
-        return None, f"Download error: {e}"
-    try:
-        with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-            temp_db_path = tmpfile.name
-            tmpfile.write(db_bytes)
-        # Make sure file is closed before SQLite tries to use it
-    except Exception as e:
-        return None, f"Temp file write error: {e}"
-    try:
-        with sqlite3.connect(temp_db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql_query)
-            results = cursor.fetchall()
-    except sqlite3.Error as e:
-        return None, f"SQLite error: {e}"
-    finally:
-        try:
-            os.remove(temp_db_path)
-        except Exception as e:
-            print(f"Warning: Failed to delete temp file: {e}")
-    return results, None
+def query_data_sqlite_blob(sql_query: str, params=(), stream: bool = SQLITE_STREAM_RESULTS):
+    # (rows, column names, err) from one execution on this worker's local replica of data.db; only a changed blob is
+    # downloaded again. With stream, rows is an iterator fed by fetchmany while the template renders
+    replica = sqlite_replica(blob, "data.db")
+    return replica.stream(sql_query, params) if stream else replica.select(sql_query, params)
+
+def spatially_indexed(table: str) -> bool:
+    # data.db files built before the R*Tree existed fall back to a plain (scanning) box filter
+    rows, _, _ = query_data_sqlite_blob("SELECT 1 FROM sqlite_master WHERE name = ?", (rtree_name(table),), stream=False)
+    return bool(rows)
+
+def render_results(template: str, **context):
+    # rows that are still an iterator need the template streamed as they are fetched
+    if isinstance(context.get("query_results"), list) or not context.get("query_results"):
+        return render_template(template, **context)
+    return Response(stream_template(template, **context))
 
 
 @app.route("/Qz2/query", methods=["POST"])
@@ -233,29 +154,12 @@ def run_query():
     if not sql_query:
         query_error = "Query is empty."
     else:
-        results, error = query_data_sqlite_blob(sql_query)
+        results, columns, error = query_data_sqlite_blob(sql_query)
         if error:
             query_error = error
         else:
             query_results = results
-            try:
-                blob_name = "data.db"
-                blob_url = get_blob_url(blob_name)
-                r = requests.get(blob_url, timeout=10)
-                if r.ok:
-                    db_bytes = r.content
-                    with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-                        tmpfile.write(db_bytes)
-                        temp_db_path = tmpfile.name
-                    conn = sqlite3.connect(temp_db_path)
-                    cursor = conn.cursor()
-                    cursor.execute(sql_query)
-                    column_names = [desc[0] for desc in cursor.description]
-                    cursor.close()
-                    conn.close()
-                    os.remove(temp_db_path)
-            except Exception:
-                column_names = []
+            column_names = columns
 
     last_download_time = None
     if blob_exists("date.txt"):
@@ -264,7 +168,7 @@ def run_query():
             last_download_time = date_content.strip()
     # had to repeat this
 
-    return render_template(
+    return render_results(
         "Qz2.html",
         last_download_time=last_download_time,
         query_results=query_results,
@@ -283,6 +187,7 @@ def run_prepared_query():
     p5 = request.form.get("param5")
 
     sql = ""
+    params = ()
     error = None
 
     try:
@@ -300,11 +205,13 @@ def run_prepared_query():
             lat = float(p3)
             lon = float(p4)
             n = float(p5)
+            # the buffer here is a box of +/- n degrees, so the R*Tree candidates only need the exact box check
+            where, params = box_filter("data_tab", "lat", "long", [(lat - n, lat + n, lon - n, lon + n)],
+                                       spatially_indexed("data_tab"))
             sql = f"""
                 SELECT time, lat, long, id, mag FROM data_tab
                 WHERE mag BETWEEN {mlow} AND {mhigh}
-                  AND lat BETWEEN {lat - n} AND {lat + n}
-                  AND long BETWEEN {lon - n} AND {lon + n}
+                  AND {where}
             """
         else:
             error = "Invalid query type selected."
@@ -316,25 +223,7 @@ def run_prepared_query():
     colnames = []
 
     if not error:
-        results, error = query_data_sqlite_blob(sql)
-
-        # Fetch column names
-        if results and not error:
-            try:
-                blob_url = get_blob_url("data.db")
-                r = requests.get(blob_url, timeout=10)
-                with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-                    tmpfile.write(r.content)
-                    db_path = tmpfile.name
-                conn = sqlite3.connect(db_path)
-                c = conn.cursor()
-                c.execute(sql)
-                colnames = [desc[0] for desc in c.description]
-                c.close()
-                conn.close()
-                os.remove(db_path)
-            except Exception as e:
-                error = f"Error fetching column names: {e}"
+        results, colnames, error = query_data_sqlite_blob(sql, params)
 
     last_download_time = None
     if blob_exists("date.txt"):
@@ -342,7 +231,7 @@ def run_prepared_query():
         if date_content and not date_content.startswith("Failed"):
             last_download_time = date_content.strip()
 
-    return render_template("Qz2.html",
+    return render_results("Qz2.html",
                            last_download_time=last_download_time,
                            query_results=results,
                            column_names=colnames,
@@ -357,47 +246,18 @@ def run_prepared_query():
                                "param5": p5
                            })
 
-def get_temp_db_connection():
-    blob_url = get_blob_url("data.db")
-    try:
-        r = requests.get(blob_url, timeout=10)
-        if not r.ok:
-            return None, None, f"Failed to download DB blob. HTTP {r.status_code}"
-        with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-            tmpfile.write(r.content)
-            temp_db_path = tmpfile.name
-        conn = sqlite3.connect(temp_db_path)
-        return conn, temp_db_path, None
-    except Exception as e:
-        return None, None, f"Error accessing DB: {e}"
-
 @app.route("/Qz2/delete_by_net", methods=["POST"])
 def delete_by_net():
     net_value = request.form.get("net_value", "").strip()
     if not net_value:
         return "Net value is required", 400
-    conn, temp_db_path, error = get_temp_db_connection()
+    def delete(conn):
+        cur = conn.execute("DELETE FROM data_tab WHERE net = ?", (net_value,))
+        return cur.rowcount, conn.execute("SELECT COUNT(*) FROM data_tab").fetchone()[0]
+    result, error = write_session(blob, "data.db").apply(delete)
     if error:
         return error, 500
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM data_tab WHERE net = ?", (net_value,))
-        count_to_delete = cur.fetchone()[0]
-        cur.execute("DELETE FROM data_tab WHERE net = ?", (net_value,))
-        conn.commit()
-        cur.execute("SELECT COUNT(*) FROM data_tab")
-        remaining = cur.fetchone()[0]
-        conn.close()
-        with open(temp_db_path, "rb") as f:
-            db_bytes = f.read()
-        upload_url = get_blob_url("data.db")
-        headers = {
-            "x-ms-blob-type": "BlockBlob",
-            "Content-Type": "application/octet-stream",
-        }
-        requests.put(upload_url, headers=headers, data=db_bytes, timeout=10)
-    finally:
-        os.remove(temp_db_path)
+    count_to_delete, remaining = result
     return f"Deleted {count_to_delete} entries with net='{net_value}'. Remaining: {remaining}"
 
 @app.route("/Qz2/insert_row", methods=["POST"])
@@ -414,30 +274,19 @@ def insert_row():
         }
     except (ValueError, TypeError):
         return "Invalid input. Please enter proper types.", 400
-    conn, temp_db_path, error = get_temp_db_connection()
-    if error:
-        return error, 500
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM data_tab WHERE id = ?", (data["id"],))
-        if cur.fetchone()[0] > 0:
-            return f"Row with ID {data['id']} already exists.", 400
-        cur.execute("""
+    def insert(conn):
+        if conn.execute("SELECT COUNT(*) FROM data_tab WHERE id = ?", (data["id"],)).fetchone()[0] > 0:
+            return False
+        conn.execute("""
             INSERT INTO data_tab (time, lat, long, mag, nst, net, id)
             VALUES (:time, :lat, :long, :mag, :nst, :net, :id)
         """, data)
-        conn.commit()
-        conn.close()
-        with open(temp_db_path, "rb") as f:
-            db_bytes = f.read()
-        upload_url = get_blob_url("data.db")
-        headers = {
-            "x-ms-blob-type": "BlockBlob",
-            "Content-Type": "application/octet-stream",
-        }
-        requests.put(upload_url, headers=headers, data=db_bytes, timeout=10)
-    finally:
-        os.remove(temp_db_path)
+        return True
+    inserted, error = write_session(blob, "data.db").apply(insert)
+    if error:
+        return error, 500
+    if not inserted:
+        return f"Row with ID {data['id']} already exists.", 400
     return f"Row with ID {data['id']} inserted successfully."
 
 @app.route("/Qz2/update_row", methods=["POST"])
@@ -466,25 +315,11 @@ def update_row():
         return "Provide either ID or time to update.", 400
     set_clause = ", ".join([f"{k} = ?" for k in updates])
     params = list(updates.values()) + [where_value]
-    conn, temp_db_path, error = get_temp_db_connection()
+    def update(conn):
+        return conn.execute(f"UPDATE data_tab SET {set_clause} WHERE {where_clause}", params).rowcount
+    updated, error = write_session(blob, "data.db").apply(update)
     if error:
         return error, 500
-    try:
-        cur = conn.cursor()
-        cur.execute(f"UPDATE data_tab SET {set_clause} WHERE {where_clause}", params)
-        updated = cur.rowcount
-        conn.commit()
-        conn.close()
-        with open(temp_db_path, "rb") as f:
-            db_bytes = f.read()
-        upload_url = get_blob_url("data.db")
-        headers = {
-            "x-ms-blob-type": "BlockBlob",
-            "Content-Type": "application/octet-stream",
-        }
-        requests.put(upload_url, headers=headers, data=db_bytes, timeout=10)
-    finally:
-        os.remove(temp_db_path)
     return f"Updated {updated} row(s)."
 
 
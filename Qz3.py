@@ -10,65 +10,32 @@ import redis
 import time
 from datetime import datetime
 from flask import Flask, request, Response, render_template, redirect, jsonify, url_for
+from blob_client import BlobClient
+from blob_proxy import proxy_blob
 
 app = Flask(__name__)
 
 TEXT_FILE_NAME = "_placeholder.log"
 IMAGE_FILE_NAME = "mypic.jpg"
-CONTAINER_URL = "https://cse6332.blob.core.windows.net/privatecontainer"
 DIRECTORY = "Qz3"
-SAS_TOKEN = os.getenv("SAS_TOKEN")
 
-if not SAS_TOKEN:
-    try:
-        with open("secrets.json") as f:
-            secrets = json.load(f)
-        SAS_TOKEN = str(secrets["SAS_TOKEN"])
-    except Exception:
-        SAS_TOKEN = ""
-
-def get_blob_url(blob_name: str) -> str:
-    token = SAS_TOKEN.lstrip("?")
-    sep = "?" if "?" not in CONTAINER_URL else "&"
-    return f"{CONTAINER_URL}/{DIRECTORY}/{blob_name}{sep}{token}" if token else f"{CONTAINER_URL}/{DIRECTORY}/{blob_name}"
-
-def blob_exists(filename: str) -> bool:
-    url = get_blob_url(filename)
-    try:
-        r = requests.head(url, timeout=5)
-        return r.status_code == 200
-    except requests.RequestException:
-        return False
+blob = BlobClient(DIRECTORY)
+get_blob_url = blob.get_blob_url
+blob_exists = blob.blob_exists
 
 def read_text_blob(filename: str = TEXT_FILE_NAME) -> str:
-    url = get_blob_url(filename)
-    try:
-        r = requests.get(url, timeout=10)
-        if r.ok:
-            return r.text
-        return f"Failed to load text from blob. HTTP {r.status_code}"
-    except requests.RequestException as e:
-        return f"Failed to load text from blob. Error: {e}"
+    return blob.read_text_blob(filename)
 
 def write_text_blob(comment: str, filename: str = TEXT_FILE_NAME) -> bool:
-    if comment is None or comment.strip() == "":
-        return False
-    url = get_blob_url(filename)
-    headers = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/plain; charset=utf-8"}
-    try:
-        r = requests.put(url, headers=headers, data=comment.encode("utf-8"), timeout=10)
-        return r.status_code in (201, 202)
-    except requests.RequestException:
-        return False
+    return blob.write_text_blob(comment, filename)
 
 @app.route("/get_image")
 def get_image():
-    url = get_blob_url(IMAGE_FILE_NAME)
     try:
-        r = requests.get(url, timeout=10)
-        if not r.ok:
+        resp = proxy_blob(blob, IMAGE_FILE_NAME, mimetypes.guess_type(IMAGE_FILE_NAME)[0])
+        if resp is None:
             return "Failed to load image from blob.", 502
-        return Response(r.content, mimetype=mimetypes.guess_type(IMAGE_FILE_NAME)[0])
+        return resp
     except requests.RequestException:
         return "Failed to load image from blob.", 502
 
@@ -126,7 +93,7 @@ DDL_INDEXES = [
 
 def reset_and_load_csv_from_blob(blob_name: str = "dataset.csv") -> dict:
     t0 = time.perf_counter()
-    r = requests.get(get_blob_url(blob_name), timeout=60)
+    r = blob.get(blob_name, timeout=60)
     if not r.ok:
         return {"ok": False, "msg": f"CSV download failed: HTTP {r.status_code}"}
     try:
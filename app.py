@@ -8,17 +8,22 @@ import pandas as pd
 import pyodbc
 import redis
 import time
+from contextlib import nullcontext
 from datetime import datetime
 from flask import Flask, request, Response, render_template, redirect, jsonify, url_for, g, session
-import re, operator
+from blob_client import BlobClient, blob_stats, blob_cache_stats
+from metadata_store import metadata_store, metadata_store_stats, set_cell_edit, add_row_edit, delete_row_edit
+from preview import render_preview, stream_preview, table_chunks, row_html, figure_html, gallery_chunks, load_more_html, with_page_headers
+from thumbnails import thumbnail_url, store_thumbnail, delete_thumbnail
+from blob_proxy import proxy_blob
+from direct_upload import upload_ticket
+from sql_pool import ConnectionPool
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY","dev-key")
 
 TEXT_FILE_NAME = "_placeholder.log"
 IMAGE_FILE_NAME = "mypic.jpg"
 TABLE="dbo.quakes"
-CONTAINER_URL = "https://cse6332.blob.core.windows.net/privatecontainer"
-SAS_TOKEN = os.getenv("SAS_TOKEN")
 AZURE_SQL_SERVER = os.getenv("AZURE_SQL_SERVER", "querytest-server.database.windows.net")
 AZURE_SQL_DATABASE = os.getenv("AZURE_SQL_DATABASE", "querytest-database")
 AZURE_SQL_USER = os.getenv("AZURE_SQL_USER", "querytest-server-admin@querytest-server")
@@ -33,14 +38,10 @@ REDIS_SSL = os.getenv("REDIS_SSL", "false").lower() == "true"
 REDIS_TTL = int(os.getenv("REDIS_TTL_SECONDS", "120"))
 AZURE_SQL_LOGIN_TIMEOUT = int(os.getenv("AZURE_SQL_LOGIN_TIMEOUT", "60"))
 AZURE_SQL_QUERY_TIMEOUT = int(os.getenv("AZURE_SQL_QUERY_TIMEOUT", "60"))
-
-if not SAS_TOKEN:
-    try:
-        with open("secrets.json") as f:
-            secrets = json.load(f)
-        SAS_TOKEN = str(secrets["SAS_TOKEN"])
-    except Exception:
-        SAS_TOKEN = ""
+SQL_FETCH_BATCH = int(os.getenv("SQL_FETCH_BATCH", "1000"))
+Q10A_STREAM_CACHE_ROWS = int(os.getenv("Q10A_STREAM_CACHE_ROWS", "0"))  # streamed q10a results up to this size are also cached; 0 = never
+Q10A_BUCKET_SECONDS = int(os.getenv("Q10A_BUCKET_SECONDS", "3600"))  # width of a cached q10a time bucket; 0 = cache exact ranges
+Q10A_MAX_BUCKETS = int(os.getenv("Q10A_MAX_BUCKETS", "512"))  # wider ranges are cached as exact ranges
 
 DIRECTORY_DEFAULT = "Qz3"
 
@@ -66,45 +67,19 @@ def set_csv_file_name(s: str):
 def set_dataset_path(s: str):
     session["dataset_path"] = s
 
-def get_blob_url(blob_name: str) -> str:
-    token = (SAS_TOKEN or "").lstrip("?")
-    sep = "?" if "?" not in CONTAINER_URL else "&"
-    d = get_session_vals()["blob_dir"]
-    base = f"{CONTAINER_URL}/{d}/{blob_name}"
-    return f"{base}{sep}{token}" if token else base
-
-def blob_exists(filename: str) -> bool:
-    url = get_blob_url(filename)
-    try:
-        r = requests.head(url, timeout=5)
-        return r.status_code == 200
-    except requests.RequestException:
-        return False
+blob = BlobClient(lambda: get_session_vals()["blob_dir"])
+get_blob_url = blob.get_blob_url
+blob_exists = blob.blob_exists
 
 def read_text_blob(filename: str = None) -> str:
     if filename is None:
         filename = get_session_vals()["text_file_name"]
-    url = get_blob_url(filename)
-    try:
-        r = requests.get(url, timeout=10)
-        if r.ok:
-            return r.text
-        return f"Failed to load text from blob. HTTP {r.status_code}"
-    except requests.RequestException as e:
-        return f"Failed to load text from blob. Error: {e}"
+    return blob.read_text_blob(filename)
 
 def write_text_blob(comment: str, filename: str = None) -> bool:
     if filename is None:
         filename = get_session_vals()["text_file_name"]
-    if comment is None or comment.strip() == "":
-        return False
-    url = get_blob_url(filename)
-    headers = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/plain; charset=utf-8"}
-    try:
-        r = requests.put(url, headers=headers, data=comment.encode("utf-8"), timeout=10)
-        return r.status_code in (201, 202)
-    except requests.RequestException:
-        return False
+    return blob.write_text_blob(comment, filename)
 
 @app.route("/get_text")
 def get_text(filename:str =None):
@@ -118,12 +93,13 @@ def get_text(filename:str =None):
 def get_image(filename:str =None):
     if filename is None:
         filename = get_session_vals()["image_file_name"]
-    url = get_blob_url(filename)
+    if request.args.get("thumb"):
+        return redirect(thumbnail_url(blob, filename) or get_blob_url(filename))
     try:
-        r = requests.get(url, timeout=10)
-        if not r.ok:
+        resp = proxy_blob(blob, filename, mimetypes.guess_type(filename)[0])
+        if resp is None:
             return "Failed to load image from blob.", 502
-        return Response(r.content, mimetype=mimetypes.guess_type(filename)[0])
+        return resp
     except requests.RequestException:
         return "Failed to load image from blob.", 502
 
@@ -134,12 +110,7 @@ def upload_csv(filename:str =None):
     file = request.files.get("file")
     if not file or not file.filename:
         return "No file provided", 400
-    url = get_blob_url(filename)
-    headers = {
-        "x-ms-blob-type": "BlockBlob",
-        "Content-Type": "text/csv"
-    }
-    r = requests.put(url, headers=headers, data=file.read(), timeout=30)
+    r = blob.put_stream(filename, file.stream, "text/csv")
     if r.status_code in (201, 202):
         return redirect("/")
     return f"Failed to upload metadata. HTTP {r.status_code}", 500
@@ -147,16 +118,13 @@ def upload_csv(filename:str =None):
 def read_csv_rows(filename: str = None):
     if filename is None:
         filename = get_session_vals()["csv_file_name"]
-    url = get_blob_url(filename)
-    r = requests.get(url, timeout=10)
-    if not r.ok:
-        return None, f"HTTP {r.status_code}"
-    f = io.StringIO(r.text, newline="")
-    reader = csv.reader(f)
-    rows = []
-    for row in reader:
-        rows.append([ (c if c.strip() != "" else None) for c in row ])
-    return rows, None
+    return metadata_store(blob, filename).read()
+
+def read_metadata_table(filename: str = None):
+    # shared MetadataTable for read-only lookups and filters; edits go through metadata_store().apply
+    if filename is None:
+        filename = get_session_vals()["csv_file_name"]
+    return metadata_store(blob, filename).table()
 
 #HOME#
 @app.route("/", methods=["GET"])
@@ -183,8 +151,6 @@ def upload_text(filename:str =None):
     return "Failed to upload comment.", 400
 
 #HW1#
-OPS = {">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le, "==": operator.eq,
-           "!=": operator.ne}
 @app.route("/Hw1", methods=["GET"])
 def hw1():
     set_blob_dir("HW1")
@@ -196,20 +162,13 @@ def hw1():
     name_options, columns = [], []
 
     if meta_exists:
-        metadata_rows, err = read_csv_rows(get_session_vals()["csv_file_name"])
+        table, err = read_metadata_table(get_session_vals()["csv_file_name"])
         if err:
             meta_exists = False
-            metadata_rows = None
         else:
-            columns = metadata_rows[0] if metadata_rows else []
-            idx = columns.index("Name") if (columns and "Name" in columns) else 0
-            seen = set()
-            for row in metadata_rows[1:]:
-                if idx < len(row) and row[idx]:
-                    n = row[idx]
-                    if n not in seen:
-                        seen.add(n)
-                        name_options.append(n)
+            metadata_rows = table.to_rows() if table.header else []
+            columns = list(table.header)
+            name_options = table.names()
 
     img_msg  = request.args.get("img_msg")
     meta_msg = request.args.get("meta_msg")
@@ -232,20 +191,58 @@ def upload_image():
         return redirect(url_for("index", img_msg="error: no name selected"))
     if not file or not file.filename:
         return redirect(url_for("index", img_msg="error: no file provided"))
-    ctype = (mimetypes.guess_type(file.filename)[0] or file.mimetype or "").lower()
-    if not ctype.startswith("image/"):
-        return redirect(url_for("index", img_msg="error: file is not an image"))
-    ext = os.path.splitext(file.filename)[1] or (mimetypes.guess_extension(ctype) or "")
-    target = f"{name}{ext}"
+    target, ctype, err = image_upload_target(name, file.filename, file.mimetype)
+    if err:
+        return redirect(url_for("index", img_msg=f"error: {err}"))
     existed = blob_exists(target)
-    url = get_blob_url(target)
-    headers = {"x-ms-blob-type": "BlockBlob", "Content-Type": ctype}
-    r = requests.put(url, headers=headers, data=file.read(), timeout=30)
+    r = blob.put_stream(target, file.stream, ctype)
     if r.status_code in (201, 202):
+        file.stream.seek(0)
+        store_thumbnail(blob, target, file.stream)
         msg = f"{'replaced' if existed else 'added'} {target}"
         return redirect(url_for("index", img_msg=msg))
     return redirect(url_for("index", img_msg=f"error: HTTP {r.status_code}"))
 
+def image_upload_target(name: str, filename: str, mimetype: str = None):
+    # (blob name, content type, err) for an image file picked for name
+    ctype = (mimetypes.guess_type(filename)[0] or mimetype or "").lower()
+    if not ctype.startswith("image/"):
+        return None, None, "file is not an image"
+    ext = os.path.splitext(filename)[1] or (mimetypes.guess_extension(ctype) or "")
+    return f"{name}{ext}", ctype, None
+
+@app.route("/upload_url", methods=["POST"])
+def upload_url():
+    # direct-upload ticket: a short-lived URL the browser PUTs the file to itself
+    if request.form.get("kind") == "csv":
+        target, ctype, err = get_session_vals()["csv_file_name"], "text/csv", None
+    else:
+        name = (request.form.get("name") or "").strip()
+        if not name:
+            return jsonify({"error": "no name selected"}), 400
+        target, ctype, err = image_upload_target(name, request.form.get("filename") or "", request.form.get("content_type"))
+    if err:
+        return jsonify({"error": err}), 400
+    ticket = upload_ticket(blob, target, ctype)
+    if ticket is None:
+        return jsonify({"error": "direct upload is not enabled"}), 404
+    kind = "csv" if ctype == "text/csv" else "image"
+    ticket["complete"] = url_for("upload_complete", kind=kind, blob=target, existed=int(blob_exists(target)))
+    return jsonify(ticket)
+
+@app.route("/upload_complete", methods=["POST"])
+def upload_complete():
+    # called by the browser after its direct PUT; the bytes are already in storage, so only bookkeeping is left
+    target = request.args.get("blob") or ""
+    if not target or "/" in target or not blob.blob_exists(target):
+        return jsonify({"error": "upload not found"}), 404
+    blob.note_written(target)
+    if request.args.get("kind") == "csv":
+        return jsonify({"redirect": "/"})
+    delete_thumbnail(blob, target)  # stale variant; the next gallery view makes a new one
+    msg = f"{'replaced' if request.args.get('existed') == '1' else 'added'} {target}"
+    return jsonify({"redirect": url_for("index", img_msg=msg)})
+
 @app.route("/delete_image", methods=["POST"])
 def delete_image():
     name = (request.form.get("name") or "").strip()
@@ -254,64 +251,53 @@ def delete_image():
     filename = find_image_for_name(name)
     if not filename:
         return redirect(url_for("index", img_msg_del=f"not found for {name}"))
-    url = get_blob_url(filename)
     try:
-        r = requests.delete(url, timeout=15)
+        r = blob.delete(filename)
         if r.status_code in (202, 200, 204):
+            delete_thumbnail(blob, filename)
             return redirect(url_for("index", img_msg_del=f"deleted {filename}"))
         return redirect(url_for("index", img_msg_del=f"error: HTTP {r.status_code}"))
     except requests.RequestException as e:
         return redirect(url_for("index", img_msg_del=f"error: {e}"))
 
+@app.route("/thumb")
+def thumb():
+    # gallery thumbnails: redirect to the stored variant (made on first request), or the original if it can't be resized
+    filename = (request.args.get("file") or "").strip()
+    if not filename:
+        return "No file provided", 400
+    return redirect(thumbnail_url(blob, filename) or get_blob_url(filename))
+
 IMAGE_EXTS = [".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff"]
 def find_image_for_name(name: str):
-    for ext in IMAGE_EXTS:
-        fn = f"{name}{ext}"
-        if blob_exists(fn):
-            return fn
-    return None
+    return blob.find_image(name, IMAGE_EXTS)
 
 @app.route("/update_metadata_image", methods=["POST"])
 def update_metadata():
     if not blob_exists(get_session_vals()["csv_file_name"]):
         return redirect(url_for("index", img_msg=None, meta_msg="error: metadata.csv not found"))
-    rows, err = read_csv_rows(get_session_vals()["csv_file_name"])
-    if err or not rows:
-        return redirect(url_for("index", meta_msg=f"error: {err or 'empty metadata'}"))
-    header = rows[0]
-    name_idx = header.index("Name") if ("Name" in header) else 0
-    if "Picture" in header:
-        pic_idx = header.index("Picture")
-    else:
-        header.append("Picture")
-        pic_idx = len(header) - 1
-        for r in rows[1:]:
-            r.append(None)
-    for r in rows[1:]:
-        name = (r[name_idx] or "").strip()
-        if not name:
-            r[pic_idx] = None
-            continue
-        found = find_image_for_name(name)
-        r[pic_idx] = found if found else None
-    buf = io.StringIO(newline="")
-    w = csv.writer(buf)
-    for r in rows:
-        w.writerow([c if c is not None else "" for c in r])
-    data = buf.getvalue().encode("utf-8")
-    url = get_blob_url(get_session_vals()["csv_file_name"])
-    headers = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/csv"}
-    r = requests.put(url, headers=headers, data=data, timeout=30)
-    if r.status_code in (201, 202):
-        return redirect(url_for("index", meta_msg="updated Picture column"))
-    return redirect(url_for("index", meta_msg=f"error: HTTP {r.status_code}"))
+    client = blob.pinned()
+    client.list_blob_names(refresh=True)
+    def edit(table):
+        pic_idx = table.header.index("Picture") if "Picture" in table.header else table.add_column("Picture")
+        for pos, name in enumerate(table.texts(table.key_idx)):
+            found = client.find_image(name, IMAGE_EXTS) if name else None
+            table.set(pos, pic_idx, found if found else None)
+    _, err = metadata_store(blob, get_session_vals()["csv_file_name"]).apply(edit)
+    if err:
+        return redirect(url_for("index", meta_msg=err if err.startswith("error") else f"error: {err}"))
+    return redirect(url_for("index", meta_msg="updated Picture column"))
 
 @app.route("/metadata_json", methods=["GET"])
 def metadata_json():
-    rows, err = read_csv_rows(get_session_vals()["csv_file_name"])
+    table, err = read_metadata_table(get_session_vals()["csv_file_name"])
     if err:
         return f"Failed to load metadata.csv: {err}", 502
-    return jsonify(rows)
+    page, next_cursor, err = table.page(range(len(table)), request.args.get("limit", type=int), request.args.get("cursor"))
+    if err:
+        return err, 400
+    rows = ([list(table.header)] if table.header else []) + [table.row(pos) for pos in page]
+    return with_page_headers(jsonify(rows), len(table), next_cursor)
 
 @app.route("/preview", methods=["GET"])
 def preview_default():
@@ -325,102 +311,45 @@ def simple_query():
     col  = request.form.get("column")
     expr = (request.form.get("expr") or "").strip()
     val  = request.form.get("value") or ""
-    rows, err = read_csv_rows(get_session_vals()["csv_file_name"])
-    if err or not rows:
+    table, err = read_metadata_table(get_session_vals()["csv_file_name"])
+    if err or not table.header:
         return Response(render_preview("Failed to load metadata."), mimetype="text/html")
-    header = rows[0]
+    header = table.header
     if col not in header:
         return Response(render_preview("Invalid column."), mimetype="text/html")
     col_idx  = header.index(col)
-    name_idx = header.index("Name") if "Name" in header else 0
+    name_idx = table.key_idx
     pic_idx  = header.index("Picture") if "Picture" in header else None
 
-    m = re.match(r"^\s*(>=|<=|==|!=|>|<)\s*(-?\d+(?:\.\d+)?)\s*$", expr) if expr else None
-
-    def match(cell):
-        s = "" if cell is None else str(cell).strip()
-        if m:
-            op, num = m.group(1), float(m.group(2))
-            try:
-                x = float(s)
-            except ValueError:
-                return False
-            return OPS[op](x, num)
-        if expr:
-            return s.lower() == expr.lower()
-        if val:
-            return s == val
-        return False
-
-    filtered = [header] + [r for r in rows[1:] if col_idx < len(r) and match(r[col_idx])]
-    if len(filtered) == 1:
+    hits, err = table.query(col_idx, expr, val)
+    if err:
+        return Response(render_preview(err), mimetype="text/html")
+    if not hits:
         return Response(render_preview("<div style='padding:8px;'>No matches.</div>"), mimetype="text/html")
-    table_html  = "<table style='width:100%;border-collapse:collapse;'>"
-    table_html += "<thead><tr>" + "".join(f"<th style='border:1px solid #444;padding:4px;'>{h or ''}</th>" for h in header) + "</tr></thead><tbody>"
-    for r in filtered[1:]:
-        table_html += "<tr>" + "".join(f"<td style='border:1px solid #333;padding:4px;'>{(c or '')}</td>" for c in r) + "</tr>"
-    table_html += "</tbody></table>"
-    images = []
-    seen_files = set()
-    for r in filtered[1:]:
-        pic = None
-        if pic_idx is not None and pic_idx < len(r) and r[pic_idx]:
-            candidate = r[pic_idx]
-            if blob_exists(candidate):
-                pic = candidate
-        if not pic:
-            nm = (r[name_idx] or "").strip()
-            if nm:
-                candidate = find_image_for_name(nm)
-                if candidate:
-                    pic = candidate
-        if pic and pic not in seen_files:
-            seen_files.add(pic)
-            images.append(((r[name_idx] or pic), pic))
-    imgs_html = ""
-    if images:
-        imgs_html += "<div style='margin-top:12px'><h4>Pictures</h4>"
-        imgs_html += "<div style='display:grid;grid-template-columns:repeat(auto-fill,minmax(140px,1fr));gap:8px;'>"
-        for label, fname in images:
-            src = get_blob_url(fname)
-            cap = label or fname
-            imgs_html += (
-                "<figure style='margin:0;padding:0;text-align:center;background:#000'>"
-                f"<img src='{src}' alt='{cap}' style='max-width:100%;height:140px;object-fit:contain;display:block;'>"
-                f"<figcaption style='font-size:12px;padding:4px 0'>{cap}</figcaption>"
-                "</figure>"
-            )
-        imgs_html += "</div></div>"
-    return Response(render_preview(table_html + imgs_html), mimetype="text/html")
-
-
-# this part is to retain preview when updating/ or may be used in other stuff
-def render_preview(inner_html: str, reload_parent: bool = False) -> str:
-    style = (
-        "body,table,th,td,div,span,p,li,code,pre,a{color:#fff;}"
-        "table{width:100%;border-collapse:collapse}"
-        "th,td{border:1px solid #444;padding:4px}"
-        "body{background:#111;font-family:Arial,sans-serif;padding:8px}"
-    )
-    base = f"<!doctype html><html><head><meta charset='utf-8'><style>{style}</style></head><body>"
-    html = f"{base}<div id='payload'>{inner_html}</div>"
-    if reload_parent:
-        html += """
-<script>
-try{
-  var payload = document.getElementById('payload').innerHTML;
-  var clean = "<!doctype html><html><head><meta charset='utf-8'><style>""" + \
-              style + \
-              """</style></head><body>" + payload + "</body></html>";
-  window.parent.sessionStorage.setItem("previewHTML", clean);
-}catch(e){}
-if (window.parent && window.parent !== window) {
-  window.parent.location.reload();
-}
-</script>
-"""
-    html += "</body></html>"
-    return html
+    page, next_cursor, err = table.page(hits, request.form.get("limit", type=int), request.form.get("cursor"))
+    if err:
+        return Response(render_preview(err), mimetype="text/html")
+    client = blob.pinned()
+
+    def pictures(positions):
+        # resolved after the table rows are on the wire, so lookups never hold back the first byte
+        names, pics = table.column(name_idx), (table.column(pic_idx) if pic_idx is not None else None)
+        wanted = [((pics[pos] if pics is not None else None) or None, (names[pos] or "").strip()) for pos in positions]
+        seen_files = set()
+        for pos, pic in zip(positions, client.resolve_pictures(wanted, IMAGE_EXTS)):
+            if pic and pic not in seen_files:
+                seen_files.add(pic)
+                yield figure_html(url_for("thumb", file=pic), names[pos] or pic)
+
+    if request.form.get("fragment"):
+        resp = jsonify({"rows": "".join(row_html(table.row(pos)) for pos in page),
+                        "figures": "".join(pictures(page)), "next_cursor": next_cursor})
+    else:
+        params = {k: v for k, v in request.form.items() if k not in ("cursor", "fragment")}
+        resp = stream_preview(table_chunks(header, (table.row(pos) for pos in page)), gallery_chunks(pictures(page)),
+                              load_more_html(request.path, params, next_cursor))
+    return with_page_headers(resp, len(hits), next_cursor)
+
 
 @app.route("/update_cell", methods=["POST"])
 def update_cell():
@@ -429,37 +358,10 @@ def update_cell():
     column   = request.form.get("column")
     row_key  = (request.form.get("row_key") or "").strip()
     new_val  = request.form.get("new_value", "")
-    rows, err = read_csv_rows(get_session_vals()["csv_file_name"])
-    if err or not rows: return Response("Failed to load metadata.", mimetype="text/html")
-    header = rows[0]
-    if column not in header: return Response("Invalid column.", mimetype="text/html")
-    key_idx = header.index("Name") if "Name" in header else 0
-    col_idx = header.index(column)
-    updated_row = None
-    for r in rows[1:]:
-        key = (r[key_idx] or "").strip()
-        if key == row_key:
-            while len(r) <= col_idx: r.append(None)
-            r[col_idx] = (new_val if new_val != "" else None)
-            updated_row = list(r)
-            break
-    if not updated_row:
-        return Response("Row not found.", mimetype="text/html")
-    buf = io.StringIO(newline="")
-    w = csv.writer(buf)
-    for r in rows:
-        w.writerow([c if c is not None else "" for c in r])
-    data = buf.getvalue().encode("utf-8")
-    url = get_blob_url(get_session_vals()["csv_file_name"])
-    hdrs = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/csv"}
-    rr = requests.put(url, headers=hdrs, data=data, timeout=30)
-    if rr.status_code not in (201, 202):
-        return Response(f"error: HTTP {rr.status_code}", mimetype="text/html")
-    html = "<div style='padding:8px;'>Updated row:</div>"
-    html += "<table style='width:100%;border-collapse:collapse;'>"
-    html += "<thead><tr>" + "".join(f"<th style='border:1px solid #444;padding:4px;'>{h or ''}</th>" for h in header) + "</tr></thead>"
-    html += "<tbody><tr>" + "".join(f"<td style='border:1px solid #333;padding:4px;'>{(c or '')}</td>" for c in updated_row) + "</tr></tbody></table>"
-    return Response(render_preview(html, reload_parent=True), mimetype="text/html")
+    result, err = metadata_store(blob, get_session_vals()["csv_file_name"]).apply(set_cell_edit(column, row_key, new_val))
+    if err: return Response(err, mimetype="text/html")
+    header, updated_row = result
+    return stream_preview("<div style='padding:8px;'>Updated row:</div>", table_chunks(header, [updated_row]), reload_parent=True)
 
 @app.route("/delete_row", methods=["POST"])
 def delete_row():
@@ -468,36 +370,11 @@ def delete_row():
     row_key = (request.form.get("row_key") or "").strip()
     if not row_key:
         return Response(render_preview("no row key provided"), mimetype="text/html")
-    rows, err = read_csv_rows(get_session_vals()["csv_file_name"])
-    if err or not rows:
-        return Response(render_preview("Failed to load metadata."), mimetype="text/html")
-    header = rows[0]
-    key_idx = header.index("Name") if "Name" in header else 0
-    deleted_row = None
-    kept = [header]
-    for r in rows[1:]:
-        key = (r[key_idx] or "").strip()
-        if deleted_row is None and key == row_key:
-            deleted_row = list(r)
-            continue
-        kept.append(r)
-    if not deleted_row:
-        return Response(render_preview("Row not found."), mimetype="text/html")
-    buf = io.StringIO(newline="")
-    w = csv.writer(buf)
-    for r in kept:
-        w.writerow([c if c is not None else "" for c in r])
-    data = buf.getvalue().encode("utf-8")
-    url = get_blob_url(get_session_vals()["csv_file_name"])
-    hdrs = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/csv"}
-    rr = requests.put(url, headers=hdrs, data=data, timeout=30)
-    if rr.status_code not in (201, 202):
-        return Response(render_preview(f"error: HTTP {rr.status_code}"), mimetype="text/html")
-    html = "<div style='padding:8px;'>Deleted row:</div>"
-    html += "<table style='width:100%;border-collapse:collapse;'>"
-    html += "<thead><tr>" + "".join(f"<th style='border:1px solid #444;padding:4px;'>{h or ''}</th>" for h in header) + "</tr></thead>"
-    html += "<tbody><tr>" + "".join(f"<td style='border:1px solid #333;padding:4px;'>{(c or '')}</td>" for c in deleted_row) + "</tr></tbody></table>"
-    return Response(render_preview(html, reload_parent=True), mimetype="text/html")
+    result, err = metadata_store(blob, get_session_vals()["csv_file_name"]).apply(delete_row_edit(row_key))
+    if err:
+        return Response(render_preview(err), mimetype="text/html")
+    header, deleted_row = result
+    return stream_preview("<div style='padding:8px;'>Deleted row:</div>", table_chunks(header, [deleted_row]), reload_parent=True)
 
 @app.route("/add_row", methods=["POST"])
 def add_row():
@@ -506,37 +383,11 @@ def add_row():
     name = (request.form.get("name") or "").strip()
     if not name:
         return Response(render_preview("no name provided"), mimetype="text/html")
-    rows, err = read_csv_rows(get_session_vals()["csv_file_name"])
-    if err or not rows:
-        return Response(render_preview("Failed to load metadata."), mimetype="text/html")
-    header = rows[0]
-    name_idx = header.index("Name") if "Name" in header else 0
-    for r in rows[1:]:
-        key = (r[name_idx] or "").strip()
-        if key == name:
-            return Response(render_preview(f"error: '{name}' already exists"), mimetype="text/html")
-    new_row = [None] * max(len(header), name_idx + 1)
-    new_row[name_idx] = name
-    rows.append(new_row)
-    buf = io.StringIO(newline="")
-    w = csv.writer(buf)
-    for r in rows:
-        w.writerow([c if c is not None else "" for c in r])
-    data = buf.getvalue().encode("utf-8")
-    url = get_blob_url(get_session_vals()["csv_file_name"])
-    hdrs = {"x-ms-blob-type": "BlockBlob", "Content-Type": "text/csv"}
-    rr = requests.put(url, headers=hdrs, data=data, timeout=30)
-    if rr.status_code not in (201, 202):
-        return Response(render_preview(f"error: HTTP {rr.status_code}"), mimetype="text/html")
-    html = "<div style='padding:8px;'>Added row:</div>"
-    html += "<table style='width:100%;border-collapse:collapse;'>"
-    html += "<thead><tr>" + "".join(
-        f"<th style='border:1px solid #444;padding:4px;'>{h or ''}</th>" for h in header
-    ) + "</tr></thead>"
-    html += "<tbody><tr>" + "".join(
-        f"<td style='border:1px solid #333;padding:4px;'>{(c or '')}</td>" for c in new_row
-    ) + "</tr></tbody></table>"
-    return Response(render_preview(html, reload_parent=True), mimetype="text/html")
+    result, err = metadata_store(blob, get_session_vals()["csv_file_name"]).apply(add_row_edit(name))
+    if err:
+        return Response(render_preview(err), mimetype="text/html")
+    header, new_row = result
+    return stream_preview("<div style='padding:8px;'>Added row:</div>", table_chunks(header, [new_row]), reload_parent=True)
 
 #Qz3
 @app.route("/debug/odbc")
@@ -547,7 +398,7 @@ def debug_odbc():
     # had to do this in windows
     return jsonify({"drivers": pyodbc.drivers()})
 
-def get_conn():
+def odbc_conn_str(read_only: bool) -> str:
     def pick_odbc_driver():
         preferred = [
             "ODBC Driver 18 for SQL Server",
@@ -559,7 +410,7 @@ def get_conn():
                 return name
         raise RuntimeError(f"No modern SQL Server ODBC driver found. Installed: {sorted(available)}")
     # driver = pick_odbc_driver() # not required, allow your local ip: 64.189.4.178/52.142.30.27
-    ODBC_CONN_STR = (
+    return (
         "DRIVER={ODBC Driver 18 for SQL Server};"
         f"SERVER=tcp:{AZURE_SQL_SERVER},1433;"
         f"DATABASE={AZURE_SQL_DATABASE};"
@@ -567,20 +418,35 @@ def get_conn():
         f"Encrypt={AZURE_SQL_ENCRYPT};TrustServerCertificate={AZURE_SQL_TRUST_CERT};"
         f"Connection Timeout={AZURE_SQL_LOGIN_TIMEOUT};"
         "MARS_Connection=Yes;"
-        "ApplicationIntent=ReadOnly;"
+        + ("ApplicationIntent=ReadOnly;" if read_only else "")
     )
-    return pyodbc.connect(ODBC_CONN_STR, autocommit=False)
+
+# pooled connections: queries borrow from read_pool (routed to a readable secondary when there is one), anything that
+# writes borrows from write_pool; `with pool.connection() as conn:` hands it back rolled back
+read_pool = ConnectionPool("read", lambda: pyodbc.connect(odbc_conn_str(read_only=True), autocommit=False))
+write_pool = ConnectionPool("write", lambda: pyodbc.connect(odbc_conn_str(read_only=False), autocommit=False))
+
+def sql_pool_stats() -> list:
+    return [read_pool.stats(), write_pool.stats()]
 
 def select_with_retry(conn, sql, params=(), query_timeout=AZURE_SQL_QUERY_TIMEOUT, retries=1):
+    cur = execute_with_retry(conn, sql, params, query_timeout, retries)
+    try:
+        cols = [d[0] for d in cur.description]
+        rows = [list(r) for r in cur.fetchall()]
+        return {"columns": cols, "rows": rows}
+    finally:
+        cur.close()
+
+def execute_with_retry(conn, sql, params=(), query_timeout=AZURE_SQL_QUERY_TIMEOUT, retries=1):
+    # cursor positioned on the result set; timeouts are retried before any row has been read
     attempt = 0
     while True:
         try:
             cur = conn.cursor()
             cur.timeout = query_timeout
             cur.execute(sql, params)
-            cols = [d[0] for d in cur.description]
-            rows = [list(r) for r in cur.fetchall()]
-            return {"columns": cols, "rows": rows}
+            return cur
         except pyodbc.Error as e:
             code = getattr(e, "args", [None])[0]
             if attempt < retries and any(s in str(e) for s in ("HYT00", "HYT01", "timeout")):
@@ -591,7 +457,7 @@ def select_with_retry(conn, sql, params=(), query_timeout=AZURE_SQL_QUERY_TIMEOU
 
 def csv_to_db_reset(blob_name: str = "dataset.csv") -> dict:
     t0 = time.perf_counter()
-    r = requests.get(get_blob_url(blob_name), timeout=60)
+    r = blob.get(blob_name, timeout=60)
     if not r.ok:
         return {"ok": False, "msg": f"CSV download failed: HTTP {r.status_code}"}
     try:
@@ -621,7 +487,7 @@ def csv_to_db_reset(blob_name: str = "dataset.csv") -> dict:
         f"CREATE INDEX IX_quakes_time ON {TABLE}([time]);",
         f"CREATE INDEX IX_quakes_net_time ON {TABLE}([net],[time]);"
     ]
-    with get_conn() as conn:
+    with write_pool.connection() as conn:
         cur = conn.cursor()
         cur.execute(f"IF OBJECT_ID(N'{TABLE}', N'U') IS NOT NULL DROP TABLE {TABLE};")
         cur.execute(DDL_CREATE)
@@ -687,62 +553,143 @@ def load_dataset_reset():
         pass
     return jsonify(result), (200 if result.get("ok") else 400)
 
+# dirty reads come from a table hint: SET TRANSACTION ISOLATION LEVEL would outlive the query on a pooled connection
+Q10A_SQL = f"""
+    SELECT [id],[net],[time],[latitude],[longitude]
+    FROM {TABLE} WITH (NOLOCK)
+    WHERE [time] BETWEEN ? AND ?
+    ORDER BY [time],[id]
+    """
+
+#--- BUCKETED q10a CACHE ---#
+# q10a results are cached per fixed [time] bucket of Q10A_BUCKET_SECONDS (bucket b holds every row with
+# b*W <= time < (b+1)*W), so overlapping and sliding ranges share entries. A query reads all of its buckets in one
+# MGET, fetches the missing ones in a single SELECT over their runs, stores them, and clips the edge buckets to the
+# requested range. Buckets are flushed with the rest of the query cache on any write.
+def q10a_bucket_ids(min_time: int, max_time: int):
+    # bucket numbers covering the range, or None when it should be cached as an exact range instead
+    if Q10A_BUCKET_SECONDS <= 0 or max_time < min_time:
+        return None
+    lo, hi = min_time // Q10A_BUCKET_SECONDS, max_time // Q10A_BUCKET_SECONDS
+    return list(range(lo, hi + 1)) if hi - lo < Q10A_MAX_BUCKETS else None
+
+def _bucket_key(bucket: int) -> str:
+    return f"qcache:q10a:bucket:{Q10A_BUCKET_SECONDS}:{bucket}"
+
+def q10a_buckets_get(buckets) -> dict:
+    # {bucket: {"columns", "rows"}} for the cached ones
+    values = redis_client.mget([_bucket_key(b) for b in buckets])
+    found = {b: json.loads(v) for b, v in zip(buckets, values) if v is not None}
+    if found:
+        redis_client.hincrby(HITS_KEY, "q10a_bucket", len(found))
+    if len(found) < len(buckets):
+        redis_client.hincrby(MISSES_KEY, "q10a_bucket", len(buckets) - len(found))
+    return found
+
+def q10a_buckets_put(columns, rows, buckets) -> dict:
+    # splits rows (ordered by time) into the given complete buckets and caches each one, empty ones included
+    ti = columns.index("time")
+    parts = {b: {"columns": columns, "rows": []} for b in buckets}
+    for r in rows:
+        part = parts.get(r[ti] // Q10A_BUCKET_SECONDS)
+        if part is not None:
+            part["rows"].append(r)
+    pipe = redis_client.pipeline(transaction=False)
+    for b, part in parts.items():
+        pipe.set(_bucket_key(b), json.dumps(part, default=str), ex=REDIS_TTL)
+    pipe.execute()
+    return parts
+
+def q10a_assemble(parts: dict, buckets, min_time: int, max_time: int) -> dict:
+    columns = parts[buckets[0]]["columns"]
+    ti = columns.index("time")
+    rows = []
+    for b in buckets:
+        part = parts[b]["rows"]
+        if b in (buckets[0], buckets[-1]):
+            part = [r for r in part if min_time <= r[ti] <= max_time]
+        rows.extend(part)
+    return {"columns": columns, "rows": rows}
+
+def q10a_runs_sql(buckets):
+    # (sql, params) selecting whole buckets, one BETWEEN per run of consecutive bucket numbers
+    runs = []
+    for b in buckets:
+        if runs and runs[-1][1] == b - 1:
+            runs[-1][1] = b
+        else:
+            runs.append([b, b])
+    where = " OR ".join("[time] BETWEEN ? AND ?" for _ in runs)
+    params = [v for lo, hi in runs for v in (lo * Q10A_BUCKET_SECONDS, (hi + 1) * Q10A_BUCKET_SECONDS - 1)]
+    return Q10A_SQL.replace("[time] BETWEEN ? AND ?", f"({where})"), params
+
+def q10a_cached(min_time: int, max_time: int):
+    # the cached result when every piece of it is cached, else None
+    buckets = q10a_bucket_ids(min_time, max_time)
+    if buckets is None:
+        return redis_get("q10a", {"min_time": min_time, "max_time": max_time})
+    parts = q10a_buckets_get(buckets)
+    if len(parts) < len(buckets):
+        redis_client.hincrby(MISSES_KEY, "q10a", 1)
+        return None
+    redis_client.hincrby(HITS_KEY, "q10a", 1)
+    return q10a_assemble(parts, buckets, min_time, max_time)
+
+def q10a_cache(result: dict, min_time: int, max_time: int):
+    # caches a fetched range: whole buckets inside it, or the exact range when not bucketing
+    buckets = q10a_bucket_ids(min_time, max_time)
+    if buckets is None:
+        redis_set("q10a", {"min_time": min_time, "max_time": max_time}, result)
+        return
+    inside = [b for b in buckets if b * Q10A_BUCKET_SECONDS >= min_time and (b + 1) * Q10A_BUCKET_SECONDS - 1 <= max_time]
+    if inside:
+        q10a_buckets_put(result["columns"], result["rows"], inside)
+
 # only using a single connection
 def q10a_core(min_time: int, max_time: int, conn: pyodbc.Connection | None = None):
-    payload = {"min_time": min_time, "max_time": max_time}
-    cached = redis_get("q10a", payload)
-    if cached is not None:
-        return cached, 0.0
-    owns = False
-    if conn is None:
-        conn = get_conn()
-        owns = True
-    t0 = time.perf_counter()
-    try:
-        result = select_with_retry(
-            conn,
-            f"""
-            SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;
-            SELECT [id],[net],[time],[latitude],[longitude]
-            FROM {TABLE}
-            WHERE [time] BETWEEN ? AND ?
-            ORDER BY [time],[id]
-            """,
-            (min_time, max_time),
-        )
-    finally:
-        if owns:
-            conn.close()
-    dt_ms = (time.perf_counter() - t0) * 1000.0
-    redis_set("q10a", payload, result)
-    return result, dt_ms
+    buckets = q10a_bucket_ids(min_time, max_time)
+    if buckets is None:
+        payload = {"min_time": min_time, "max_time": max_time}
+        cached = redis_get("q10a", payload)
+        if cached is not None:
+            return cached, 0.0
+        with read_pool.connection() if conn is None else nullcontext(conn) as conn:
+            t0 = time.perf_counter()
+            result = select_with_retry(conn, Q10A_SQL, (min_time, max_time))
+        dt_ms = (time.perf_counter() - t0) * 1000.0
+        redis_set("q10a", payload, result)
+        return result, dt_ms
+    parts = q10a_buckets_get(buckets)
+    missing = [b for b in buckets if b not in parts]
+    redis_client.hincrby(MISSES_KEY if missing else HITS_KEY, "q10a", 1)
+    dt_ms = 0.0
+    if missing:
+        sql, params = q10a_runs_sql(missing)
+        with read_pool.connection() if conn is None else nullcontext(conn) as conn:
+            t0 = time.perf_counter()
+            fetched = select_with_retry(conn, sql, params)
+        dt_ms = (time.perf_counter() - t0) * 1000.0
+        parts.update(q10a_buckets_put(fetched["columns"], fetched["rows"], missing))
+    return q10a_assemble(parts, buckets, min_time, max_time), dt_ms
 
 def q10b_core(start_time: int, net: str, count_c: int, conn: pyodbc.Connection | None = None):
     payload = {"start_time": start_time, "net": net, "count": count_c}
     cached = redis_get("q10b", payload)
     if cached is not None:
         return cached, 0.0
-    owns = False
-    if conn is None:
-        conn = get_conn()
-        owns = True
-    t0 = time.perf_counter()
-    try:
+    with read_pool.connection() if conn is None else nullcontext(conn) as conn:
+        t0 = time.perf_counter()
         result = select_with_retry(
             conn,
             f"""
-            SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;
             SELECT TOP (?)
               [id],[net],[time],[latitude],[longitude]
-            FROM {TABLE}
+            FROM {TABLE} WITH (NOLOCK)
             WHERE [time] >= ? AND [net] = ?
             ORDER BY [time],[id]
             """,
             (count_c, start_time, net),
         )
-    finally:
-        if owns:
-            conn.close()
     dt_ms = (time.perf_counter() - t0) * 1000.0
     redis_set("q10b", payload, result)
     return result, dt_ms
@@ -762,7 +709,7 @@ def run_prepared_query():
             min_time = int(p1)
             max_time = int(p2)
             t0 = time.perf_counter()
-            with get_conn() as conn:
+            with read_pool.connection() as conn:
                 cur = conn.cursor()
                 cur.execute(f"""
                     SELECT [id], [net], [time], [latitude], [longitude]
@@ -778,7 +725,7 @@ def run_prepared_query():
             net = p2
             count_c = int(p3)
             t0 = time.perf_counter()
-            with get_conn() as conn:
+            with read_pool.connection() as conn:
                 cur = conn.cursor()
                 cur.execute(f"""
                     SELECT TOP (?)
@@ -803,11 +750,84 @@ def run_prepared_query():
             last_download_time = date_content.strip()
     return render_template("Qz3.html", last_download_time=last_download_time, query_results=query_results, column_names=column_names, query_error=query_error, last_query="", last_query_type=qtype, last_params={"param1": p1, "param2": p2, "param3": p3}, timing_ms=timing_ms)
 
+#--- STREAMED RESULTS ---#
+# q10a with "stream": "ndjson" | "json" writes rows to the response as fetchmany pulls them instead of building the
+# result (and its JSON) in memory. ndjson sends a {"columns"} line, one JSON array per row and a closing
+# {"row_count", "timing_ms"} line; json sends the same document as the buffered route, piece by piece. The
+# connection stays borrowed until the response is closed. Results of at most Q10A_STREAM_CACHE_ROWS rows are also
+# written to the cache; larger ones are not kept.
+def q10a_stream(min_time: int, max_time: int, fmt: str) -> Response:
+    t0 = time.perf_counter()
+    cached = q10a_cached(min_time, max_time)
+    if cached is not None:
+        return Response(encode_stream(fmt, cached["columns"], iter([cached["rows"]]), t0, None), mimetype=STREAM_MIMETYPES[fmt])
+    conn, opened = read_pool.acquire()
+    try:
+        db_t0 = time.perf_counter()
+        cur = execute_with_retry(conn, Q10A_SQL, (min_time, max_time))
+        columns = [d[0] for d in cur.description]
+        first = cur.fetchmany(SQL_FETCH_BATCH)
+    except BaseException:
+        read_pool.release(conn, opened)
+        raise
+    def batches():
+        kept = [] if Q10A_STREAM_CACHE_ROWS > 0 else None
+        chunk = first
+        while chunk:
+            if kept is not None:
+                kept.extend(list(r) for r in chunk)
+                if len(kept) > Q10A_STREAM_CACHE_ROWS:
+                    kept = None
+            yield chunk
+            chunk = cur.fetchmany(SQL_FETCH_BATCH)
+        if kept is not None:
+            try:
+                q10a_cache({"columns": columns, "rows": kept}, min_time, max_time)
+            except Exception:
+                pass  # the response is already out; the next request simply misses
+    def close():
+        try:
+            cur.close()
+        except Exception:
+            pass
+        read_pool.release(conn, opened)
+    response = Response(encode_stream(fmt, columns, batches(), t0, db_t0), mimetype=STREAM_MIMETYPES[fmt])
+    response.call_on_close(close)
+    return response
+
+STREAM_MIMETYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+def encode_stream(fmt: str, columns, batches, t0: float, db_t0: float | None):
+    # text chunks, one per fetched batch; db time runs until the last batch is read (None: answered from cache)
+    n = 0
+    if fmt == "ndjson":
+        yield json.dumps({"columns": columns}) + "\n"
+    else:
+        yield '{"result": {"columns": ' + json.dumps(columns) + ', "rows": ['
+    for batch in batches:
+        rows = [json.dumps(list(r), default=str) for r in batch]
+        if not rows:
+            continue
+        if fmt == "ndjson":
+            yield "\n".join(rows) + "\n"
+        else:
+            yield ("," if n else "") + ",".join(rows)
+        n += len(rows)
+    now = time.perf_counter()
+    timing = {"db_or_cache_ms": round((now - db_t0) * 1000.0, 3) if db_t0 is not None else 0.0, "total_ms": round((now - t0) * 1000.0, 3)}
+    if fmt == "ndjson":
+        yield json.dumps({"row_count": n, "timing_ms": timing}) + "\n"
+    else:
+        yield ']}, "timing_ms": ' + json.dumps(timing) + "}"
+
 @app.route("/Qz3/q10a", methods=["POST"])
 def r10a():
     j = request.get_json(force=True, silent=True) or {}
     tmin = int(j.get("min_time"))
     tmax = int(j.get("max_time"))
+    fmt = str(j.get("stream") or request.args.get("stream") or "").lower()
+    if fmt in STREAM_MIMETYPES:
+        return q10a_stream(tmin, tmax, fmt)
     t0 = time.perf_counter()
     result, db_or_cache_ms = q10a_core(tmin, tmax)
     total_ms = (time.perf_counter() - t0) * 1000.0
@@ -853,30 +873,22 @@ def r11():
 
         a_times, b_times, a_results, b_results = [], [], [], []
         total_t0 = time.perf_counter()
-        conn = get_conn()
         try:
-            cur = conn.cursor()
-            cur.execute("SELECT 1")
-            cur.fetchall()
-            for i in range(T):
-                # 10(a)
-                t0 = time.perf_counter()
-                res_a, _ = q10a_core(a_min, a_max, conn=conn)
-                a_times.append(round((time.perf_counter() - t0) * 1000.0, 3))
-                a_results.append(res_a)
-
-                # 10(b)
-                t0 = time.perf_counter()
-                res_b, _ = q10b_core(b_start, b_net, b_count, conn=conn)
-                b_times.append(round((time.perf_counter() - t0) * 1000.0, 3))
-                b_results.append(res_b)
+            with read_pool.connection() as conn:
+                for i in range(T):
+                    # 10(a)
+                    t0 = time.perf_counter()
+                    res_a, _ = q10a_core(a_min, a_max, conn=conn)
+                    a_times.append(round((time.perf_counter() - t0) * 1000.0, 3))
+                    a_results.append(res_a)
+
+                    # 10(b)
+                    t0 = time.perf_counter()
+                    res_b, _ = q10b_core(b_start, b_net, b_count, conn=conn)
+                    b_times.append(round((time.perf_counter() - t0) * 1000.0, 3))
+                    b_results.append(res_b)
         except pyodbc.Error as e:
             return jsonify({"error": f"ODBC error during /q11 loop: {e}"}), 500
-        finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
         total_ms = (time.perf_counter() - total_t0) * 1000.0
         return jsonify({
             "q10a_times_ms": a_times,
@@ -925,7 +937,7 @@ def r12_update():
             return jsonify({"updated_rows": 0, "error": "no valid fields to update"}), 400
 
         params.append(time_value)
-        with get_conn() as conn:
+        with write_pool.connection() as conn:
             cur = conn.cursor()
             cur.execute(f"UPDATE {TABLE} SET {', '.join(sets)} WHERE [time] = ?", params)
             changed = cur.rowcount
@@ -943,6 +955,14 @@ def r12_update():
         return jsonify({"updated_rows": 0, "error": str(e)}), 500
 
 
+@app.route("/blob_stats", methods=["GET"])
+def r_blob_stats():
+    return jsonify({"requests": blob_stats(), "cache": blob_cache_stats(), "metadata": metadata_store_stats()})
+
+@app.route("/Qz3/pool_stats", methods=["GET"])
+def r_pool_stats():
+    return jsonify(sql_pool_stats())
+
 @app.route("/Qz3/q13_stats", methods=["GET"])
 def r13_stats():
     try:
@@ -0,0 +1,50 @@
+import io, csv, sys, time, sqlite3
+from blob_client import get_http_session
+from sqlite_ingest import bulk_load
+from HW2 import EARTHQUAKES_SCHEMA, EARTHQUAKE_INDEXES
+
+# CSV -> SQLite ingest rate for the USGS feed: python bench_ingest.py [csv path or URL ...]
+FEED_URL = "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_month.csv"
+
+def load_text(src: str) -> str:
+    if src.startswith(("http://", "https://")):
+        r = get_http_session().get(src, timeout=60)
+        r.raise_for_status()
+        return r.content.decode("utf-8")
+    with open(src, encoding="utf-8") as f:
+        return f.read()
+
+def row_insert(conn, csv_text: str):
+    # the DictReader + per-row execute loop get_url_csv_to_blob used before bulk_load
+    cursor = conn.cursor()
+    reader = csv.DictReader(io.StringIO(csv_text))
+    for row in reader:
+        values = [row.get(col) for col in reader.fieldnames]
+        placeholders = ",".join("?" * len(values))
+        cursor.execute(f"INSERT OR IGNORE INTO Earthquakes VALUES ({placeholders})", values)
+    conn.commit()
+    for name, cols in EARTHQUAKE_INDEXES:
+        conn.execute(f"CREATE INDEX {name} ON Earthquakes ({cols})")
+
+def timed(fn, csv_text: str, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        conn = sqlite3.connect(":memory:")
+        conn.execute(EARTHQUAKES_SCHEMA)
+        t0 = time.perf_counter()
+        fn(conn, csv_text)
+        best = min(best, time.perf_counter() - t0)
+        conn.close()
+    return best
+
+def bench(src: str):
+    text = load_text(src)
+    n = max(text.count("\n") - 1, 1)
+    print(f"--- {src} ({n} rows, {len(text) / 1e6:.1f} MB) ---")
+    for label, fn in (("row insert", row_insert), ("bulk_load", lambda c, t: bulk_load(c, "Earthquakes", t, EARTHQUAKE_INDEXES))):
+        secs = timed(fn, text)
+        print(f"{label:<11} {secs * 1000:9.1f} ms  {n / secs:12,.0f} rows/s")
+
+if __name__ == "__main__":
+    for src in sys.argv[1:] or [FEED_URL]:
+        bench(src)
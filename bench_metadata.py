@@ -0,0 +1,71 @@
+import re, sys, time, random
+from blob_client import parse_csv_rows, rows_to_csv_bytes
+from metadata_table import MetadataTable, OPS
+
+# Per-request simple_query cost on synthetic metadata: python bench_metadata.py [rows ...]
+QUERIES = [("Age", ">= 40", ""), ("Name", "name_500", ""), ("Age", ">= 18 AND < 65", ""),
+           ("Age", "Age > 60 OR Room == 7", "")]
+
+def make_csv(n: int) -> str:
+    rnd = random.Random(n)
+    rows = [["Name", "Age", "Room", "Picture"]]
+    for i in range(n):
+        age = str(rnd.randint(1, 90)) if rnd.random() > 0.05 else ""
+        rows.append([f"name_{i}", age, str(rnd.randint(1, 20)), f"name_{i}.jpg" if i % 3 else ""])
+    return rows_to_csv_bytes(rows).decode("utf-8")
+
+def row_scan(rows, col_idx, expr):
+    # the per-row closure simple_query used before the columnar engine (single clause only)
+    m = re.match(r"^\s*(>=|<=|==|!=|>|<)\s*(-?\d+(?:\.\d+)?)\s*$", expr) if expr else None
+    def match(cell):
+        s = "" if cell is None else str(cell).strip()
+        if m:
+            try:
+                x = float(s)
+            except ValueError:
+                return False
+            return OPS[m.group(1)](x, float(m.group(2)))
+        return s.lower() == expr.lower()
+    return [r for r in rows[1:] if col_idx < len(r) and match(r[col_idx])]
+
+def range_scan(rows, col_idx, lo, hi):
+    # the per-row loop age_range_query used before the sorted index
+    kept = []
+    for r in rows[1:]:
+        x = float(r[col_idx]) if col_idx < len(r) and r[col_idx] not in (None, "") else None
+        if x is not None and lo <= x <= hi:
+            kept.append(r)
+    return kept
+
+def timed(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+def bench(n: int):
+    text = make_csv(n)
+    rows = parse_csv_rows(text)
+    print(f"--- {n} rows ---")
+    print(f"parse csv + build table: {timed(lambda: MetadataTable.from_rows(parse_csv_rows(text)), 3):8.2f} ms (once per ETag)")
+    for col, expr, val in QUERIES:
+        idx = rows[0].index(col)
+        cold = timed(lambda: MetadataTable.from_rows(rows).query(idx, expr, val), 3)
+        table = MetadataTable.from_rows(rows)
+        table.query(idx, expr, val)
+        warm = timed(lambda: table.query(idx, expr, val))
+        scan = timed(lambda: row_scan(rows, idx, expr)) if " AND " not in expr and " OR " not in expr else None
+        scan_s = f"{scan:8.2f} ms" if scan is not None else "       n/a"
+        print(f"{col:>5} {expr!r:<26} row scan {scan_s} | table cold {cold:8.2f} ms | warm {warm:7.3f} ms")
+    idx = rows[0].index("Age")
+    table = MetadataTable.from_rows(rows)
+    build = timed(lambda: MetadataTable.from_rows(rows).range(idx, 30, 35), 3)
+    warm = timed(lambda: table.range(idx, 30, 35))
+    scan = timed(lambda: range_scan(rows, idx, 30, 35))
+    print(f"  Age {'range [30, 35]':<26} row scan {scan:8.2f} ms | index cold {build:8.2f} ms | warm {warm:7.3f} ms")
+
+if __name__ == "__main__":
+    for n in [int(a) for a in sys.argv[1:]] or [10_000, 100_000]:
+        bench(n)
@@ -0,0 +1,518 @@
+import os, json, csv, io, time, uuid, base64, hashlib, threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError as FuturesTimeout
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONTAINER_URL = "https://cse6332.blob.core.windows.net/privatecontainer"
+SAS_TOKEN = os.getenv("SAS_TOKEN")
+BLOB_POOL_SIZE = int(os.getenv("BLOB_POOL_SIZE", "16"))
+BLOB_RETRIES = int(os.getenv("BLOB_RETRIES", "3"))
+BLOB_BACKOFF = float(os.getenv("BLOB_BACKOFF", "0.3"))
+BLOB_CACHE_BYTES = int(os.getenv("BLOB_CACHE_BYTES", str(32 * 1024 * 1024)))
+BLOB_LIST_TTL = float(os.getenv("BLOB_LIST_TTL", "30"))
+BLOB_FANOUT_WORKERS = int(os.getenv("BLOB_FANOUT_WORKERS", "8"))
+BLOB_FANOUT_DEADLINE = float(os.getenv("BLOB_FANOUT_DEADLINE", "3.0"))
+BLOB_BLOCK_SIZE = int(os.getenv("BLOB_BLOCK_SIZE", str(4 * 1024 * 1024)))
+BLOB_UPLOAD_WORKERS = int(os.getenv("BLOB_UPLOAD_WORKERS", "4"))
+BLOB_BLOCK_ATTEMPTS = int(os.getenv("BLOB_BLOCK_ATTEMPTS", "4"))
+AZURE_API_VERSION = "2021-08-06"
+
+if not SAS_TOKEN:
+    try:
+        with open("secrets.json") as f:
+            secrets = json.load(f)
+        SAS_TOKEN = str(secrets["SAS_TOKEN"])
+    except Exception:
+        SAS_TOKEN = ""
+
+#--- POOLED SESSION ---#
+# one keep-alive session per worker process; rebuilt after a fork so gunicorn workers never share sockets
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    global _session, _session_pid
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(total=BLOB_RETRIES, backoff_factor=BLOB_BACKOFF,
+                          status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=BLOB_POOL_SIZE, pool_maxsize=BLOB_POOL_SIZE, max_retries=retry)
+            s = requests.Session()
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session, _session_pid = s, os.getpid()
+    return _session
+
+#--- TIMING COUNTERS ---#
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _record(method: str, elapsed_ms: float, failed: bool):
+    with _stats_lock:
+        s = _stats.setdefault(method, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        s["calls"] += 1
+        s["total_ms"] += elapsed_ms
+        s["max_ms"] = max(s["max_ms"], elapsed_ms)
+        if failed:
+            s["errors"] += 1
+
+def blob_stats() -> dict:
+    with _stats_lock:
+        out = {}
+        for m, s in _stats.items():
+            avg = s["total_ms"] / s["calls"] if s["calls"] else 0.0
+            out[m] = {"calls": s["calls"], "errors": s["errors"], "total_ms": round(s["total_ms"], 3),
+                      "avg_ms": round(avg, 3), "max_ms": round(s["max_ms"], 3)}
+        return out
+
+def reset_blob_stats():
+    with _stats_lock:
+        _stats.clear()
+
+#--- ETAG CACHE ---#
+# LRU of parsed blob contents, bounded by the downloaded byte size; every read revalidates with If-None-Match
+class BlobCache:
+    def __init__(self, max_bytes: int = BLOB_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "revalidations": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, value, etag: str, last_modified: str, size: int):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old["size"]
+            self.entries[key] = {"value": value, "etag": etag, "last_modified": last_modified, "size": size}
+            self.size += size
+            while self.size > self.max_bytes and self.entries:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= dropped["size"]
+                self.counters["evictions"] += 1
+
+    def invalidate(self, path: str):
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == path]:
+                self.size -= self.entries.pop(key)["size"]
+                self.counters["invalidations"] += 1
+
+    def count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.size, max_bytes=self.max_bytes)
+
+blob_cache = BlobCache()
+
+def blob_cache_stats() -> dict:
+    return blob_cache.stats()
+
+#--- FAN-OUT ---#
+# runs fn over items on a bounded pool; anything not finished by the deadline (or that raised) comes back as None
+def fan_out(fn, items, max_workers: int = BLOB_FANOUT_WORKERS, deadline: float = BLOB_FANOUT_DEADLINE) -> list:
+    items = list(items)
+    results = [None] * len(items)
+    if not items:
+        return results
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    futures = {pool.submit(fn, it): i for i, it in enumerate(items)}
+    try:
+        for f in as_completed(futures, timeout=deadline):
+            try:
+                results[futures[f]] = f.result()
+            except Exception:
+                pass
+    except FuturesTimeout:
+        pass
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return results
+
+#--- LISTING INDEX ---#
+# (container_url, directory) -> {"expires", "names", "images"}; one List Blobs call answers every existence probe in a folder
+_listings = {}
+_listings_lock = threading.Lock()
+
+#--- CLIENT ---#
+class BlobClient:
+    # directory is either a fixed folder name or a callable (app.py resolves it from the flask session)
+    def __init__(self, directory, container_url: str = CONTAINER_URL, sas_token: str = SAS_TOKEN):
+        self.directory = directory
+        self.container_url = container_url
+        self.sas_token = (sas_token or "").lstrip("?")
+
+    def get_dir(self) -> str:
+        return self.directory() if callable(self.directory) else self.directory
+
+    def pinned(self):
+        # fixed-directory copy for worker threads, which cannot see the flask session
+        return BlobClient(self.get_dir(), self.container_url, self.sas_token)
+
+    def get_blob_url(self, blob_name: str) -> str:
+        sep = "?" if "?" not in self.container_url else "&"
+        base = self.blob_path(blob_name)
+        return f"{base}{sep}{self.sas_token}" if self.sas_token else base
+
+    def blob_path(self, blob_name: str) -> str:
+        return f"{self.container_url}/{self.get_dir()}/{blob_name}"
+
+    def request(self, method: str, blob_name: str, timeout: float = 10, **kwargs) -> requests.Response:
+        url = self.get_blob_url(blob_name)
+        if method in ("PUT", "DELETE"):
+            blob_cache.invalidate(self.blob_path(blob_name))
+        t0 = time.perf_counter()
+        failed = True
+        try:
+            r = get_http_session().request(method, url, timeout=timeout, **kwargs)
+            failed = r.status_code >= 500
+        finally:
+            _record(method, (time.perf_counter() - t0) * 1000.0, failed)
+        comp = (kwargs.get("params") or {}).get("comp")
+        if method == "PUT" and r.status_code == 201 and comp in (None, "blocklist"):
+            self._note_listing(blob_name, True)
+        elif method == "DELETE" and r.status_code in (200, 202, 204):
+            self._note_listing(blob_name, False)
+        return r
+
+    def get_cached(self, blob_name: str, kind: str, parse):
+        # returns (parsed value or None, response, etag); a 304 serves the cached value without download or parse
+        key = (self.blob_path(blob_name), kind)
+        entry = blob_cache.get(key)
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+            blob_cache.count("revalidations")
+        r = self.get(blob_name, headers=headers)
+        if r.status_code == 304 and entry is not None:
+            blob_cache.count("hits")
+            return entry["value"], r, r.headers.get("ETag") or entry["etag"]
+        blob_cache.count("misses")
+        if not r.ok:
+            return None, r, None
+        value = parse(r)
+        blob_cache.put(key, value, r.headers.get("ETag"), r.headers.get("Last-Modified"), len(r.content))
+        return value, r, r.headers.get("ETag")
+
+    def seed_cache(self, blob_name: str, kind: str, value, r: requests.Response, size: int):
+        # after our own successful PUT the written value is current, so the next read is a 304 instead of a download
+        etag = r.headers.get("ETag")
+        if etag:
+            blob_cache.put((self.blob_path(blob_name), kind), value, etag, r.headers.get("Last-Modified"), size)
+
+    def head(self, blob_name: str, timeout: float = 5, **kwargs) -> requests.Response:
+        return self.request("HEAD", blob_name, timeout=timeout, **kwargs)
+
+    def get(self, blob_name: str, timeout: float = 10, **kwargs) -> requests.Response:
+        return self.request("GET", blob_name, timeout=timeout, **kwargs)
+
+    def put(self, blob_name: str, data, content_type: str, timeout: float = 30, headers: dict = None) -> requests.Response:
+        hdrs = {"x-ms-blob-type": "BlockBlob", "Content-Type": content_type}
+        if headers:
+            hdrs.update(headers)
+        return self.request("PUT", blob_name, timeout=timeout, headers=hdrs, data=data)
+
+    def put_stream(self, blob_name: str, stream, content_type: str, headers: dict = None,
+                   block_size: int = BLOB_BLOCK_SIZE, max_workers: int = BLOB_UPLOAD_WORKERS) -> requests.Response:
+        # uploads a file-like object holding at most max_workers + 1 blocks in memory: a plain Put Blob when it fits in
+        # one block, otherwise Put Block on a bounded pool (each block retried on its own) and one Put Block List
+        first = _read_block(stream, block_size)
+        second = _read_block(stream, block_size) if len(first) == block_size else b""
+        if not second:
+            return self.put(blob_name, first, content_type, headers=headers)
+        def blocks():
+            yield first
+            yield second
+            while True:
+                chunk = _read_block(stream, block_size)
+                if not chunk:
+                    return
+                yield chunk
+        # ids must share one length per blob; the random prefix keeps a concurrent upload of the same name apart
+        prefix = uuid.uuid4().hex[:16]
+        ids, pending = [], set()
+        pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            for chunk in blocks():
+                block_id = base64.b64encode(f"{prefix}-{len(ids):06d}".encode("ascii")).decode("ascii")
+                ids.append(block_id)
+                pending.add(pool.submit(self._put_block, blob_name, block_id, chunk, headers))
+                if len(pending) > max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    failed = _first_failure(done)
+                    if failed is not None:
+                        return failed
+            failed = _first_failure(wait(pending).done)
+            if failed is not None:
+                return failed
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return self._put_block_list(blob_name, [("Latest", i) for i in ids], content_type, headers)
+
+    def put_delta(self, blob_name: str, data: bytes, content_type: str, block_size: int, committed=(),
+                  headers: dict = None, max_workers: int = BLOB_UPLOAD_WORKERS):
+        # (response, block ids, bytes sent): data is cut into block_size blocks named by position and content hash, so a
+        # block whose id is already in committed (the blob's current block list) is reused and only changed ones are sent
+        committed, ids, dirty = set(committed or ()), [], []
+        for n, start in enumerate(range(0, max(len(data), 1), block_size)):
+            chunk = data[start:start + block_size]
+            block_id = base64.b64encode(f"{n:06d}-{hashlib.sha256(chunk).hexdigest()[:32]}".encode("ascii")).decode("ascii")
+            ids.append(block_id)
+            if block_id not in committed:
+                dirty.append((block_id, chunk))
+        if dirty:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(dirty)))) as pool:
+                failed = _first_failure([pool.submit(self._put_block, blob_name, i, c, headers) for i, c in dirty])
+            if failed is not None:
+                return failed, ids, sum(len(c) for _, c in dirty)
+        sent = {i for i, _ in dirty}
+        r = self._put_block_list(blob_name, [("Latest" if i in sent else "Committed", i) for i in ids], content_type, headers)
+        return r, ids, sum(len(c) for _, c in dirty)
+
+    def committed_blocks(self, blob_name: str, headers: dict = None):
+        # [block ids] the blob is made of ([] for one written by a single Put Blob or missing), or None when unreadable
+        hdrs = dict(headers or {}, **{"x-ms-version": AZURE_API_VERSION})
+        try:
+            r = self.request("GET", blob_name, params={"comp": "blocklist", "blocklisttype": "committed"}, headers=hdrs)
+            if r.status_code == 404:
+                return []
+            if not r.ok:
+                return None
+            return [el.text for el in ET.fromstring(r.content).iter("Name")]
+        except (requests.RequestException, ET.ParseError):
+            return None
+
+    def _put_block_list(self, blob_name: str, entries, content_type: str, headers: dict = None) -> requests.Response:
+        # entries are (Latest | Committed, block id) in blob order
+        body = "<?xml version=\"1.0\" encoding=\"utf-8\"?><BlockList>" + "".join(f"<{k}>{i}</{k}>" for k, i in entries) + "</BlockList>"
+        hdrs = {"x-ms-version": AZURE_API_VERSION, "x-ms-blob-content-type": content_type, "Content-Type": "application/xml"}
+        if headers:
+            hdrs.update(headers)
+        # <Latest> also matches blocks an earlier, unacknowledged commit already took, so the commit is safe to repeat
+        return self._with_attempts(lambda: self.request("PUT", blob_name, timeout=30, params={"comp": "blocklist"},
+                                                        headers=hdrs, data=body.encode("utf-8")))
+
+    def _put_block(self, blob_name: str, block_id: str, chunk: bytes, headers: dict = None) -> requests.Response:
+        # Put Block takes no content headers, only the lease (if any) of the blob being written
+        hdrs = {"x-ms-version": AZURE_API_VERSION}
+        if headers and "x-ms-lease-id" in headers:
+            hdrs["x-ms-lease-id"] = headers["x-ms-lease-id"]
+        return self._with_attempts(lambda: self.request("PUT", blob_name, timeout=30, params={"comp": "block", "blockid": block_id},
+                                                        headers=hdrs, data=chunk))
+
+    def _with_attempts(self, send) -> requests.Response:
+        # the pooled session already retries 5xx/429; this also rides out timeouts and dropped connections mid-body
+        for attempt in range(BLOB_BLOCK_ATTEMPTS):
+            try:
+                r = send()
+            except requests.RequestException:
+                if attempt == BLOB_BLOCK_ATTEMPTS - 1:
+                    raise
+                r = None
+            if r is not None and (r.status_code < 500 or attempt == BLOB_BLOCK_ATTEMPTS - 1):
+                return r
+            time.sleep(BLOB_BACKOFF * (2 ** attempt))
+
+    def note_written(self, blob_name: str):
+        # for writes that bypassed this client (direct browser uploads): drop cached copies, mark it listed
+        blob_cache.invalidate(self.blob_path(blob_name))
+        self._note_listing(blob_name, True)
+
+    def delete(self, blob_name: str, timeout: float = 15, **kwargs) -> requests.Response:
+        return self.request("DELETE", blob_name, timeout=timeout, **kwargs)
+
+    def list_blob_names(self, refresh: bool = False):
+        # set of blob names directly under this directory, or None when listing is not permitted/failed; a failure is
+        # remembered for BLOB_LIST_TTL as well, so callers go straight to HEAD instead of listing again first
+        key = (self.container_url, self.get_dir())
+        with _listings_lock:
+            entry = _listings.get(key)
+            if entry is not None and not refresh and entry["expires"] > time.monotonic():
+                return entry["names"]
+        prefix = f"{self.get_dir()}/"
+        names, marker = set(), None
+        t0 = time.perf_counter()
+        try:
+            while True:
+                params = {"restype": "container", "comp": "list", "prefix": prefix}
+                if marker:
+                    params["marker"] = marker
+                sep = "?" if "?" not in self.container_url else "&"
+                url = f"{self.container_url}{sep}{self.sas_token}" if self.sas_token else self.container_url
+                r = get_http_session().get(url, params=params, timeout=10)
+                if not r.ok:
+                    names = None
+                    break
+                root = ET.fromstring(r.content)
+                for el in root.iter("Name"):
+                    rel = (el.text or "")[len(prefix):]
+                    if rel and "/" not in rel:
+                        names.add(rel)
+                marker = root.findtext("NextMarker")
+                if not marker:
+                    break
+        except (requests.RequestException, ET.ParseError):
+            names = None
+        finally:
+            _record("LIST", (time.perf_counter() - t0) * 1000.0, names is None)
+        with _listings_lock:
+            _listings[key] = {"expires": time.monotonic() + BLOB_LIST_TTL, "names": names, "images": {}}
+        return names
+
+    def image_index(self, exts) -> dict:
+        # base name -> image blob name, earlier entries in exts win like the old per-extension HEAD loop
+        names = self.list_blob_names()
+        if names is None:
+            return None
+        key = (self.container_url, self.get_dir())
+        exts = tuple(exts)
+        with _listings_lock:
+            entry = _listings.get(key)
+            cached = entry["images"].get(exts) if entry is not None and entry["names"] is names else None
+        if cached is not None:
+            return cached
+        rank = {e: i for i, e in enumerate(exts)}
+        index = {}
+        for n in names:
+            base, ext = os.path.splitext(n)
+            if ext in rank and (base not in index or rank[ext] < rank[os.path.splitext(index[base])[1]]):
+                index[base] = n
+        with _listings_lock:
+            entry = _listings.get(key)
+            if entry is not None and entry["names"] is names:
+                entry["images"][exts] = index
+        return index
+
+    def _note_listing(self, blob_name: str, present: bool):
+        key = (self.container_url, self.get_dir())
+        with _listings_lock:
+            entry = _listings.get(key)
+            if entry is None or entry["names"] is None or "/" in blob_name:
+                return
+            names = set(entry["names"])
+            if present:
+                names.add(blob_name)
+            else:
+                names.discard(blob_name)
+            _listings[key] = {"expires": entry["expires"], "names": names, "images": {}}
+
+    def find_image(self, name: str, exts):
+        index = self.image_index(exts)
+        if index is not None:
+            return index.get(name)
+        for ext in exts:
+            fn = f"{name}{ext}"
+            if self.blob_exists(fn):
+                return fn
+        return None
+
+    def resolve_pictures(self, wanted, exts, max_workers: int = BLOB_FANOUT_WORKERS, deadline: float = BLOB_FANOUT_DEADLINE) -> list:
+        # wanted is a list of (Picture cell, Name); returns the image blob per entry or None
+        client = self.pinned()
+        def one(item):
+            candidate, name = item
+            if candidate and client.listed_exists(candidate):
+                return candidate
+            if name and exts:
+                return client.find_image(name, exts)
+            return None
+        unique = list(dict.fromkeys(wanted))
+        if client.list_blob_names() is not None:
+            found = [one(w) for w in unique]
+        else:
+            found = fan_out(one, unique, max_workers, deadline)
+        by_item = dict(zip(unique, found))
+        return [by_item[w] for w in wanted]
+
+    def listed_exists(self, filename: str) -> bool:
+        names = self.list_blob_names()
+        if names is not None and "/" not in filename:
+            return filename in names
+        return self.blob_exists(filename)
+
+    def blob_exists(self, filename: str) -> bool:
+        try:
+            return self.head(filename).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def read_text_blob(self, filename: str) -> str:
+        try:
+            text, r, _ = self.get_cached(filename, "text", lambda resp: resp.text)
+            if text is not None:
+                return text
+            return f"Failed to load text from blob. HTTP {r.status_code}"
+        except requests.RequestException as e:
+            return f"Failed to load text from blob. Error: {e}"
+
+    def write_text_blob(self, comment: str, filename: str) -> bool:
+        if comment is None or comment.strip() == "":
+            return False
+        try:
+            r = self.put(filename, comment.encode("utf-8"), "text/plain; charset=utf-8", timeout=10)
+            return r.status_code in (201, 202)
+        except requests.RequestException:
+            return False
+
+    def read_csv_rows(self, filename: str):
+        rows, _, err = self.read_csv_rows_versioned(filename)
+        return rows, err
+
+    def read_csv_rows_versioned(self, filename: str):
+        # (rows, etag, err); callers edit rows in place before writing back, so never hand out the cached lists
+        rows, r, etag = self.get_cached(filename, "csv", lambda resp: parse_csv_rows(resp.text))
+        if rows is None:
+            return None, None, f"HTTP {r.status_code}"
+        return [list(row) for row in rows], etag, None
+
+    def write_csv_rows(self, filename: str, rows, timeout: float = 30) -> requests.Response:
+        return self.put(filename, rows_to_csv_bytes(rows), "text/csv", timeout=timeout)
+
+def _read_block(stream, size: int) -> bytes:
+    # read() may return short before EOF on socket-backed streams
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = stream.read(size - len(buf))
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
+def _first_failure(futures):
+    # the first block response that is not 201 Created, or None; exceptions propagate
+    for f in futures:
+        r = f.result()
+        if r.status_code != 201:
+            return r
+    return None
+
+def parse_csv_rows(text: str):
+    reader = csv.reader(io.StringIO(text, newline=""))
+    return [[(c if c.strip() != "" else None) for c in row] for row in reader]
+
+def rows_to_csv_bytes(rows) -> bytes:
+    buf = io.StringIO(newline="")
+    w = csv.writer(buf)
+    for r in rows:
+        w.writerow([c if c is not None else "" for c in r])
+    return buf.getvalue().encode("utf-8")
@@ -0,0 +1,31 @@
+import os
+from flask import Response, request
+from blob_client import BlobClient
+
+BLOB_PROXY_CHUNK = int(os.getenv("BLOB_PROXY_CHUNK", str(64 * 1024)))
+BLOB_PROXY_CACHE_CONTROL = os.getenv("BLOB_PROXY_CACHE_CONTROL", "private, no-cache")  # used when the blob sets none
+
+PASS_REQUEST = ("Range", "If-None-Match", "If-Modified-Since")
+PASS_RESPONSE = ("Content-Length", "Content-Range", "Content-Encoding", "Accept-Ranges", "ETag", "Last-Modified",
+                 "Cache-Control")
+
+#--- STREAMING PROXY ---#
+# Forwards Range and conditional headers to storage and relays the body BLOB_PROXY_CHUNK bytes at a time,
+# so a worker never holds more than one chunk of an image and repeat views come back as 304s.
+def proxy_blob(client: BlobClient, blob_name: str, mimetype: str = None):
+    # streamed Response (200/206/304/416), or None when storage answered anything else
+    headers = {h: request.headers[h] for h in PASS_REQUEST if h in request.headers}
+    r = client.get(blob_name, headers=headers, stream=True)
+    if r.status_code not in (200, 206, 304, 416):
+        r.close()
+        return None
+    out = {h: r.headers[h] for h in PASS_RESPONSE if h in r.headers}
+    out.setdefault("Accept-Ranges", "bytes")
+    out.setdefault("Cache-Control", BLOB_PROXY_CACHE_CONTROL)
+    if r.status_code in (304, 416):
+        r.close()
+        return Response(status=r.status_code, headers=out)
+    resp = Response(r.raw.stream(BLOB_PROXY_CHUNK, decode_content=False), status=r.status_code, headers=out,
+                    mimetype=mimetype or r.headers.get("Content-Type"))
+    resp.call_on_close(r.close)
+    return resp
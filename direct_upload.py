@@ -0,0 +1,45 @@
+import os, json, hmac, base64, hashlib
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, urlencode, quote
+from blob_client import BlobClient, AZURE_API_VERSION
+
+DIRECT_UPLOAD = os.getenv("DIRECT_UPLOAD", "false").lower() == "true"
+DIRECT_UPLOAD_TTL = int(os.getenv("DIRECT_UPLOAD_TTL", "300"))  # seconds a handed-out upload URL stays valid
+STORAGE_ACCOUNT_KEY = os.getenv("STORAGE_ACCOUNT_KEY")
+
+if not STORAGE_ACCOUNT_KEY:
+    try:
+        with open("secrets.json") as f:
+            STORAGE_ACCOUNT_KEY = str(json.load(f).get("STORAGE_ACCOUNT_KEY") or "")
+    except Exception:
+        STORAGE_ACCOUNT_KEY = ""
+
+#--- DIRECT UPLOADS ---#
+# With DIRECT_UPLOAD=true the browser asks for a ticket, PUTs the file straight to storage with it and then tells the
+# app it is done, so upload bytes never pass through a worker. Tickets carry a service SAS for that one blob
+# (create/write only, DIRECT_UPLOAD_TTL seconds), signed with the account key; the container needs a CORS rule
+# allowing PUT from the app's origin. Without a key, or with the mode off, the forms post through the app as before.
+def direct_upload_enabled() -> bool:
+    return DIRECT_UPLOAD and bool(STORAGE_ACCOUNT_KEY)
+
+def upload_sas_url(client: BlobClient, blob_name: str, ttl: int = DIRECT_UPLOAD_TTL):
+    # (blob URL with a short-lived write-only SAS, expiry as ISO string)
+    parts = urlsplit(client.container_url)
+    account = parts.netloc.split(".")[0]
+    path = f"{parts.path.strip('/')}/{client.get_dir()}/{blob_name}"
+    expiry = (datetime.now(timezone.utc) + timedelta(seconds=ttl)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    fields = {"sv": AZURE_API_VERSION, "sr": "b", "sp": "cw", "se": expiry, "spr": "https"}
+    # service SAS string-to-sign (2020-12-06+): sp, st, se, resource, si, sip, spr, sv, sr, snapshot, ses, rscc..rsct
+    to_sign = "\n".join([fields["sp"], "", expiry, f"/blob/{account}/{path}", "", "", fields["spr"], fields["sv"],
+                         fields["sr"], "", "", "", "", "", "", ""])
+    sig = hmac.new(base64.b64decode(STORAGE_ACCOUNT_KEY), to_sign.encode("utf-8"), hashlib.sha256).digest()
+    fields["sig"] = base64.b64encode(sig).decode("ascii")
+    return f"{parts.scheme}://{parts.netloc}/{quote(path)}?{urlencode(fields)}", expiry
+
+def upload_ticket(client: BlobClient, blob_name: str, content_type: str):
+    # what the browser needs to PUT one file itself, or None when direct uploads are off
+    if not direct_upload_enabled():
+        return None
+    url, expiry = upload_sas_url(client, blob_name)
+    return {"blob": blob_name, "url": url, "expires": expiry, "method": "PUT",
+            "headers": {"x-ms-blob-type": "BlockBlob", "Content-Type": content_type}}
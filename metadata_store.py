@@ -0,0 +1,329 @@
+import os, json, time, uuid, threading
+from blob_client import BlobClient, rows_to_csv_bytes, parse_csv_rows, AZURE_API_VERSION
+from metadata_table import MetadataTable
+
+METADATA_MODE = os.getenv("METADATA_MODE", "snapshot")  # "snapshot" or "journal"
+METADATA_PUT_RETRIES = int(os.getenv("METADATA_PUT_RETRIES", "5"))
+METADATA_BATCH_WINDOW = float(os.getenv("METADATA_BATCH_WINDOW", "0"))
+METADATA_JOURNAL_MAX_BYTES = int(os.getenv("METADATA_JOURNAL_MAX_BYTES", str(256 * 1024)))
+METADATA_COMPACT_INTERVAL = float(os.getenv("METADATA_COMPACT_INTERVAL", "30"))
+JOURNAL_META = "x-ms-meta-journal"
+
+class MetadataError(Exception):
+    pass
+
+#--- ROW EDITS ---#
+# Each builder returns edit(table) -> result that changes a MetadataTable in place or raises
+# MetadataError without touching it. edit.record is the journal entry that replays the same change.
+def set_cell_edit(column: str, row_key: str, value: str):
+    def edit(table):
+        if column not in table.header:
+            raise MetadataError("Invalid column.")
+        pos = table.find(row_key)
+        if pos is None:
+            raise MetadataError("Row not found.")
+        table.set(pos, table.header.index(column), (value if value != "" else None))
+        return list(table.header), table.row(pos)
+    edit.record = {"op": "set", "key": row_key, "column": column, "value": value}
+    return edit
+
+def add_row_edit(name: str):
+    def edit(table):
+        if table.find(name) is not None:
+            raise MetadataError(f"error: '{name}' already exists")
+        new_row = [None] * max(len(table.header), table.key_idx + 1)
+        new_row[table.key_idx] = name
+        table.append(new_row)
+        return list(table.header), list(new_row)
+    edit.record = {"op": "add", "key": name}
+    return edit
+
+def delete_row_edit(row_key: str):
+    def edit(table):
+        pos = table.find(row_key)
+        if pos is None:
+            raise MetadataError("Row not found.")
+        return list(table.header), table.delete(pos)
+    edit.record = {"op": "delete", "key": row_key}
+    return edit
+
+REPLAY = {
+    "set": lambda rec: set_cell_edit(rec["column"], rec["key"], rec["value"]),
+    "add": lambda rec: add_row_edit(rec["key"]),
+    "delete": lambda rec: delete_row_edit(rec["key"]),
+}
+
+def replay_journal(table, data: bytes):
+    for line in data.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+            REPLAY[rec["op"]](rec)(table)
+        except (MetadataError, KeyError, ValueError):
+            pass
+    return table
+
+#--- OPTIMISTIC CSV STORE ---#
+# Queued edits are applied together on the freshest copy and uploaded once with If-Match;
+# on 412 the whole batch is replayed on the newer blob.
+class MetadataStore:
+    def __init__(self, client: BlobClient, filename: str):
+        self.client = client
+        self.filename = filename
+        self.queue = []
+        self.queue_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.counters = {"edits": 0, "uploads": 0, "conflicts": 0, "failures": 0}
+
+    CACHE_KIND = "table"
+
+    def _snapshot(self):
+        # (shared table, etag, journal name or None, err); the table lives in the blob cache, copy() before editing
+        def parse(r):
+            return MetadataTable.from_rows(parse_csv_rows(r.text)), r.headers.get(JOURNAL_META)
+        value, r, etag = self.client.get_cached(self.filename, self.CACHE_KIND, parse)
+        if value is None:
+            return None, None, None, f"HTTP {r.status_code}"
+        table, journal = value
+        return table, etag, journal, None
+
+    def _cache_value(self, table, headers):
+        return table, None
+
+    def _versioned(self):
+        table, etag, _, err = self._snapshot()
+        return table, etag, err
+
+    def table(self):
+        # (read-only MetadataTable, err) kept warm between requests
+        table, _, _, err = self._snapshot()
+        return table, err
+
+    def read(self):
+        table, err = self.table()
+        return (table.to_rows() if table is not None else None), err
+
+    def apply(self, edit):
+        # (result, err) like read_csv_rows; err is a user-facing message
+        slot = {"done": False, "result": None, "error": None}
+        with self.queue_lock:
+            self.queue.append((edit, slot))
+        with self.flush_lock:
+            if not slot["done"]:
+                if METADATA_BATCH_WINDOW > 0:
+                    time.sleep(METADATA_BATCH_WINDOW)
+                with self.queue_lock:
+                    batch, self.queue = self.queue, []
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    # an edit raised something other than MetadataError: fail every edit still waiting on this batch
+                    self._deliver([(s, None, f"error: {e}") for _, s in batch if not s["done"]])
+                    raise
+        return slot["result"], slot["error"]
+
+    def _flush(self, batch):
+        outcome, _ = self._rewrite(batch)
+        self._deliver(outcome)
+
+    def _rewrite(self, batch, extra_headers=None, load=None):
+        # read-modify-write of the whole CSV -> (outcome, written); load() -> (table, etag, err) lets subclasses fold extra state in first
+        load = load or self._versioned
+        for _ in range(METADATA_PUT_RETRIES + 1):
+            table, etag, err = load()
+            if err or table is None or not table.header:
+                return [(slot, None, "Failed to load metadata.") for _, slot in batch], False
+            table = table.copy()
+            outcome = self._run_edits(batch, table)
+            if batch and all(error for _, _, error in outcome):
+                return outcome, False
+            data = rows_to_csv_bytes(table.to_rows())
+            headers = dict(extra_headers or {})
+            if etag:
+                headers["If-Match"] = etag
+            try:
+                r = self.client.put(self.filename, data, "text/csv", headers=headers)
+            except Exception as e:
+                return [(slot, None, f"error: {e}") for _, slot in batch], False
+            if r.status_code == 412:
+                self._count("conflicts")
+                continue
+            if r.status_code not in (201, 202):
+                return [(slot, None, f"error: HTTP {r.status_code}") for _, slot in batch], False
+            self._count("uploads")
+            self.client.seed_cache(self.filename, self.CACHE_KIND, self._cache_value(table, headers), r, len(data))
+            return outcome, True
+        return [(slot, None, "error: metadata changed too often, try again") for _, slot in batch], False
+
+    def _run_edits(self, batch, table):
+        outcome = []
+        for edit, slot in batch:
+            try:
+                outcome.append((slot, edit(table), None))
+            except MetadataError as e:
+                outcome.append((slot, None, str(e)))
+        return outcome
+
+    def _deliver(self, outcome):
+        for slot, result, error in outcome:
+            slot["result"], slot["error"], slot["done"] = result, error, True
+            self._count("edits" if error is None else "failures")
+
+    def _count(self, name: str):
+        with self.queue_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def stats(self) -> dict:
+        with self.queue_lock:
+            return dict(self.counters, blob=self.filename, mode="snapshot", queued=len(self.queue))
+
+#--- JOURNAL MODE ---#
+# The CSV stays the base snapshot and names its current append-blob journal in blob metadata.
+# Journaled edits append one JSON line each (cost ~ edit size); readers replay the journal over the snapshot.
+# Compaction seals the journal so late appends fail, folds it into a new snapshot that points at a fresh
+# journal, then drops the old one. A writer that hits a sealed journal finishes the compaction itself.
+class JournalMetadataStore(MetadataStore):
+    def __init__(self, client: BlobClient, filename: str):
+        super().__init__(client, filename)
+        self.compact_lock = threading.Lock()
+        self._view = None
+        threading.Thread(target=self._compactor, daemon=True).start()
+
+    CACHE_KIND = "table+journal"
+
+    def _cache_value(self, table, headers):
+        return table, headers.get(JOURNAL_META)
+
+    def _journal(self, journal: str):
+        # (bytes, etag, err); journals are small and revalidated by ETag like any other cached blob
+        data, r, etag = self.client.get_cached(journal, "bytes", lambda resp: resp.content)
+        if data is None:
+            return None, None, f"HTTP {r.status_code}"
+        return data, etag, None
+
+    def _load(self):
+        # (shared table with the journal replayed, journal name, journal length, err); replayed once per version
+        table, etag, journal, err = self._snapshot()
+        if err or table is None or not journal:
+            return table, journal, 0, err
+        data, jetag, jerr = self._journal(journal)
+        if jerr:
+            return None, journal, 0, jerr
+        key, view = (etag, journal, jetag), self._view
+        if view is None or view[0] != key:
+            view = self._view = (key, replay_journal(table.copy(), data), len(data))
+        return view[1], journal, view[2], None
+
+    def table(self):
+        for _ in range(METADATA_PUT_RETRIES + 1):
+            table, journal, _, err = self._load()
+            if not (err and journal):
+                break
+        return table, err
+
+    def _flush(self, batch):
+        if not all(hasattr(edit, "record") for edit, _ in batch):
+            self._deliver(self._compact(batch))
+            return
+        for _ in range(METADATA_PUT_RETRIES + 1):
+            table, journal, length, err = self._load()
+            if err and journal:
+                # journal was compacted away between the snapshot and journal reads
+                self._count("conflicts")
+                continue
+            if err or table is None or not table.header:
+                self._deliver([(slot, None, "Failed to load metadata.") for _, slot in batch])
+                return
+            if not journal:
+                self._deliver(self._compact(batch))
+                return
+            outcome = self._run_edits(batch, table.copy())
+            records = [edit.record for (edit, _), (_, _, error) in zip(batch, outcome) if error is None]
+            if not records:
+                self._deliver(outcome)
+                return
+            body = "".join(json.dumps(rec) + "\n" for rec in records).encode("utf-8")
+            headers = {"x-ms-version": AZURE_API_VERSION, "x-ms-blob-condition-appendpos": str(length)}
+            try:
+                r = self.client.request("PUT", journal, params={"comp": "appendblock"}, headers=headers, data=body)
+            except Exception as e:
+                self._deliver([(slot, None, f"error: {e}") for _, slot in batch])
+                return
+            if r.status_code == 201:
+                self._count("appends")
+                self._deliver(outcome)
+                return
+            if r.status_code == 409:
+                self._compact([], sealed=journal)
+            elif r.status_code not in (404, 412):
+                self._deliver([(slot, None, f"error: HTTP {r.status_code}") for _, slot in batch])
+                return
+            self._count("conflicts")
+        self._deliver([(slot, None, "error: metadata changed too often, try again") for _, slot in batch])
+
+    def _compact(self, batch, sealed=None):
+        # sealed: only finish the compaction that sealed this journal, not one that already moved on
+        with self.compact_lock:
+            if sealed and self._snapshot()[2] != sealed:
+                return []
+            old = {}
+            def load():
+                table, etag, journal, err = self._snapshot()
+                old["journal"] = journal
+                if err or table is None or not journal:
+                    return table, etag, err
+                self.client.request("PUT", journal, params={"comp": "seal"}, headers={"x-ms-version": AZURE_API_VERSION})
+                data, _, jerr = self._journal(journal)
+                if jerr:
+                    return None, None, jerr
+                return replay_journal(table.copy(), data), etag, None
+            new_journal = f"{self.filename}.journal-{uuid.uuid4().hex[:12]}"
+            r = self.client.put(new_journal, b"", "application/x-ndjson",
+                                headers={"x-ms-blob-type": "AppendBlob", "If-None-Match": "*"})
+            if r.status_code != 201:
+                return [(slot, None, f"error: HTTP {r.status_code}") for _, slot in batch]
+            outcome, written = self._rewrite(batch, extra_headers={JOURNAL_META: new_journal}, load=load)
+            if not written:
+                self.client.delete(new_journal)
+                return outcome
+            self._count("compactions")
+            if old.get("journal"):
+                self.client.delete(old["journal"])
+            return outcome
+
+    def _compactor(self):
+        while True:
+            time.sleep(METADATA_COMPACT_INTERVAL)
+            try:
+                _, _, journal, err = self._snapshot()
+                if err or not journal:
+                    continue
+                r = self.client.head(journal)
+                if r.ok and int(r.headers.get("Content-Length") or 0) > METADATA_JOURNAL_MAX_BYTES:
+                    with self.flush_lock:
+                        self._compact([])
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        return dict(super().stats(), mode="journal")
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def metadata_store(client: BlobClient, filename: str) -> MetadataStore:
+    # one store per blob per worker so concurrent requests share its queue
+    pinned = client.pinned()
+    key = pinned.blob_path(filename)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            cls = JournalMetadataStore if METADATA_MODE == "journal" else MetadataStore
+            store = _stores[key] = cls(pinned, filename)
+        return store
+
+def metadata_store_stats() -> list:
+    with _stores_lock:
+        stores = list(_stores.values())
+    return [s.stats() for s in stores]
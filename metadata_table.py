@@ -0,0 +1,254 @@
+import os, re, json, base64, bisect, operator
+import numpy as np
+
+METADATA_PAGE_SIZE = int(os.getenv("METADATA_PAGE_SIZE", "200"))
+METADATA_PAGE_MAX = int(os.getenv("METADATA_PAGE_MAX", "1000"))
+METADATA_CURSOR_TRAIL = int(os.getenv("METADATA_CURSOR_TRAIL", "8"))  # earlier rows a cursor can fall back to
+
+OPS = {">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le, "==": operator.eq,
+       "!=": operator.ne}
+CLAUSE = re.compile(r"^\s*(.*?)\s*(>=|<=|==|!=|>|<)\s*(.*?)\s*$")
+JOINER = re.compile(r"\s+(AND|OR)\s+", re.IGNORECASE)
+NUMBER = re.compile(r"^[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?$")
+
+def _to_float(s: str):
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+#--- FILTER EXPRESSIONS ---#
+# "[column] op value" clauses joined by AND / OR (AND binds tighter), e.g. ">= 18 AND < 65" or "Age > 30 OR Name == bob".
+# A clause without a column applies to the selected one; numbers compare numerically, anything else case-insensitively (== / != only).
+def parse_filter(expr: str, header, default_idx: int):
+    # ([[(col_idx, op, value), ...AND], ...OR], err); (None, None) when expr is a plain value to match
+    parts = JOINER.split(expr)
+    terms = [[]]
+    for i in range(0, len(parts), 2):
+        m = CLAUSE.match(parts[i])
+        if not m or not m.group(3):
+            return None, None
+        name, op, value = m.group(1), m.group(2), m.group(3).strip("'\"")
+        if name and name not in header:
+            return None, f"Invalid column '{name}'."
+        if not NUMBER.match(value) and op not in ("==", "!="):
+            return None, f"'{op}' needs a number."
+        if i and parts[i - 1].upper() == "OR":
+            terms.append([])
+        terms[-1].append((header.index(name) if name else default_idx, op, value))
+    return terms, None
+
+#--- COLUMNAR METADATA ---#
+# One list per column plus a Name -> row position index, built once per blob version and kept in the blob cache.
+# Cached tables are shared between requests, so anything that edits one works on copy().
+class MetadataTable:
+    def __init__(self, header, columns, widths):
+        self.header = header
+        self.columns = columns    # columns[c][pos]; cells past a row's width are None
+        self.widths = widths      # original length of each row, so to_rows() writes back the same CSV
+        self.key_idx = header.index("Name") if "Name" in header else 0
+        self._index = None
+        self._derived = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        header = list(rows[0]) if rows else []
+        body = rows[1:]
+        ncols = max([len(header)] + [len(r) for r in body])
+        columns = [[r[c] if c < len(r) else None for r in body] for c in range(ncols)]
+        return cls(header, columns, [len(r) for r in body])
+
+    def __len__(self):
+        return len(self.widths)
+
+    def copy(self):
+        t = MetadataTable(list(self.header), [list(col) for col in self.columns], list(self.widths))
+        if self._index is not None:
+            t._index = dict(self._index)
+        return t
+
+    def to_rows(self):
+        return [list(self.header)] + [self.row(pos) for pos in range(len(self))]
+
+    def row(self, pos: int):
+        return [col[pos] for col in self.columns[:self.widths[pos]]]
+
+    def names(self):
+        # distinct non-empty Name cells in file order
+        return list(dict.fromkeys(n for n in self.column(self.key_idx) if n))
+
+    def find(self, key: str):
+        # row position of the first row whose stripped Name equals key, or None
+        if self._index is None:
+            index = {}
+            for pos, k in enumerate(self.texts(self.key_idx)):
+                index.setdefault(k, pos)
+            self._index = index
+        return self._index.get(key)
+
+    def column(self, idx: int):
+        return self.columns[idx] if idx < len(self.columns) else [None] * len(self)
+
+    def texts(self, idx: int):
+        # stripped cell strings, "" for empty cells
+        return self._derive("text", idx, lambda: [("" if c is None else str(c).strip()) for c in self.column(idx)])
+
+    def folded(self, idx: int):
+        return self._derive("fold", idx, lambda: [s.lower() for s in self.texts(idx)])
+
+    def folded_array(self, idx: int):
+        return self._derive("fold_arr", idx, lambda: np.array(self.folded(idx), dtype=object))
+
+    def text_array(self, idx: int):
+        return self._derive("text_arr", idx, lambda: np.array(self.texts(idx), dtype=object))
+
+    def numbers(self, idx: int):
+        # (float64 values, valid mask) parsed once per table version; empty and non-numeric cells are invalid
+        def build():
+            parsed = [(_to_float(s) if s else None) for s in self.texts(idx)]
+            valid = np.fromiter((x is not None for x in parsed), dtype=bool, count=len(parsed))
+            values = np.fromiter((x if x is not None else np.nan for x in parsed), dtype=np.float64, count=len(parsed))
+            return values, valid
+        return self._derive("num", idx, build)
+
+    def sorted_numbers(self, idx: int):
+        # (row positions ordered by value, their values) over numeric, non-NaN cells; built on first range use per table version
+        def build():
+            values, valid = self.numbers(idx)
+            keep = np.flatnonzero(valid & ~np.isnan(values))
+            order = keep[np.argsort(values[keep], kind="stable")]
+            return order, values[order]
+        return self._derive("sorted", idx, build)
+
+    def _span(self, idx: int, op: str, num: float):
+        # positions (in value order) whose cell satisfies "op num", by bisecting sorted_numbers; op is not !=
+        order, values = self.sorted_numbers(idx)
+        lo, hi = 0, len(values)
+        if op in (">", ">=", "=="):
+            lo = np.searchsorted(values, num, side="right" if op == ">" else "left")
+        if op in ("<", "<=", "=="):
+            hi = np.searchsorted(values, num, side="left" if op == "<" else "right")
+        return order[lo:hi]
+
+    def _derive(self, kind: str, idx: int, build):
+        key = (kind, idx)
+        value = self._derived.get(key)
+        if value is None:
+            value = self._derived[key] = build()
+        return value
+
+    def query(self, idx: int, expr: str, value: str):
+        # (positions, err) for simple_query: filter expression or case-insensitive expr on column idx, else exact value
+        if expr:
+            terms, err = parse_filter(expr, self.header, idx)
+            if err:
+                return None, err
+            if terms is None:
+                mask = self.folded_array(idx) == expr.lower()
+            elif len(terms) == 1 and len(terms[0]) == 1 and self._indexed(*terms[0][0]):
+                col, op, num = terms[0][0]
+                return np.sort(self._span(col, op, float(num))).tolist(), None
+            else:
+                mask = np.zeros(len(self), dtype=bool)
+                for term in terms:
+                    term_mask = np.ones(len(self), dtype=bool)
+                    for clause in term:
+                        term_mask &= self._clause_mask(*clause)
+                    mask |= term_mask
+        elif value:
+            mask = self.text_array(idx) == value
+        else:
+            return [], None
+        return np.flatnonzero(mask).tolist(), None
+
+    def range(self, idx: int, lo: float, hi: float):
+        # positions (file order) whose numeric cell lies in [lo, hi]: a bisect plus a slice of the sorted index
+        order, values = self.sorted_numbers(idx)
+        span = order[np.searchsorted(values, lo, side="left"):np.searchsorted(values, hi, side="right")]
+        return np.sort(span).tolist()
+
+    def _indexed(self, idx: int, op: str, value: str):
+        return op != "!=" and NUMBER.match(value) is not None
+
+    def _clause_mask(self, idx: int, op: str, value: str):
+        if self._indexed(idx, op, value):
+            mask = np.zeros(len(self), dtype=bool)
+            mask[self._span(idx, op, float(value))] = True
+            return mask
+        if NUMBER.match(value):
+            values, valid = self.numbers(idx)
+            with np.errstate(invalid="ignore"):
+                return valid & OPS[op](values, float(value))
+        folded = self.folded_array(idx)
+        equal = folded == value.lower()
+        return equal if op == "==" else (folded != "") & ~equal
+
+    def page(self, positions, limit: int = None, cursor: str = None):
+        # (positions on this page, next cursor or None, err) over ascending positions; a cursor names the last row
+        # sent by Name and position plus the Names of the METADATA_CURSOR_TRAIL rows sent before it. If that row has
+        # moved it is found by Name; if it was deleted, the page resumes after the newest earlier row that is still
+        # here. Rows added or deleted between pages are then neither skipped nor repeated, unless every row the
+        # cursor names was deleted, when it resumes from the old position
+        limit = min(max(limit or METADATA_PAGE_SIZE, 1), METADATA_PAGE_MAX)
+        start = 0
+        if cursor:
+            try:
+                c = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii") + b"=" * (-len(cursor) % 4)))
+                key, last = str(c["k"]), int(c["p"])
+                trail = [str(k) for k in c.get("b", [])]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return None, None, "Invalid cursor."
+            if not (0 <= last < len(self) and self.texts(self.key_idx)[last] == key):
+                found = next((pos for pos in map(self.find, [key] + trail) if pos is not None), None)
+                last = found if found is not None else last
+            start = bisect.bisect_right(positions, last)
+        chunk = positions[start:start + limit]
+        if start + limit >= len(positions):
+            return chunk, None, None
+        keys = self.texts(self.key_idx)
+        last = chunk[-1]
+        trail = [keys[pos] for pos in reversed(chunk[-1 - METADATA_CURSOR_TRAIL:-1]) if keys[pos]]
+        c = json.dumps({"k": keys[last], "p": last, "b": trail}, separators=(",", ":")).encode("utf-8")
+        return chunk, base64.urlsafe_b64encode(c).decode("ascii").rstrip("="), None
+
+    def set(self, pos: int, idx: int, value):
+        self.columns[idx][pos] = value
+        self.widths[pos] = max(self.widths[pos], idx + 1)
+        self._changed(idx)
+
+    def append(self, row):
+        pos = len(self)
+        for c in range(max(len(row), len(self.columns))):
+            if c == len(self.columns):
+                self.columns.append([None] * pos)
+            self.columns[c].append(row[c] if c < len(row) else None)
+        self.widths.append(len(row))
+        self._derived.clear()
+        if self._index is not None:
+            key = self.columns[self.key_idx][pos] if self.key_idx < len(self.columns) else None
+            self._index.setdefault("" if key is None else str(key).strip(), pos)
+        return pos
+
+    def delete(self, pos: int):
+        row = self.row(pos)
+        for col in self.columns:
+            col.pop(pos)
+        self.widths.pop(pos)
+        self._derived.clear()
+        self._index = None
+        return row
+
+    def add_column(self, name: str) -> int:
+        idx = len(self.header)
+        self.header.append(name)
+        if idx == len(self.columns):
+            self.columns.append([None] * len(self))
+        self.widths = [max(w + 1, idx + 1) for w in self.widths]
+        self._changed(idx)
+        return idx
+
+    def _changed(self, idx: int):
+        for kind in ("text", "fold", "num", "fold_arr", "text_arr", "sorted"):
+            self._derived.pop((kind, idx), None)
+        if idx == self.key_idx:
+            self._index = None
@@ -0,0 +1,139 @@
+import json
+from html import escape
+from urllib.parse import urlencode
+from flask import Response, stream_with_context, request
+
+PREVIEW_STYLE = (
+    "body,table,th,td,div,span,p,li,code,pre,a{color:#fff;}"
+    "table{width:100%;border-collapse:collapse}"
+    "th,td{border:1px solid #444;padding:4px}"
+    "body{background:#111;font-family:Arial,sans-serif;padding:8px}"
+)
+PREVIEW_ROW_BATCH = 200  # table rows per streamed chunk
+
+def _preview_head() -> str:
+    return f"<!doctype html><html><head><meta charset='utf-8'><style>{PREVIEW_STYLE}</style></head><body><div id='payload'>"
+
+def _preview_tail(reload_parent: bool) -> str:
+    html = "</div>"
+    if reload_parent:
+        html += """
+<script>
+try{
+  var payload = document.getElementById('payload').innerHTML;
+  var clean = "<!doctype html><html><head><meta charset='utf-8'><style>""" + \
+                PREVIEW_STYLE + \
+                """</style></head><body>" + payload + "</body></html>";
+  window.parent.sessionStorage.setItem("previewHTML", clean);
+}catch(e){}
+if (window.parent && window.parent !== window) {
+  window.parent.location.reload();
+}
+</script>
+"""
+    return html + "</body></html>"
+
+# this part is to retain preview when updating/ or may be used in other stuff
+def render_preview(inner_html: str, reload_parent: bool = False) -> str:
+    return _preview_head() + inner_html + _preview_tail(reload_parent)
+
+def stream_preview(*chunks, reload_parent: bool = False) -> Response:
+    # chunks are strings or generators of strings, sent as produced between the preview header and footer
+    def generate():
+        yield _preview_head()
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                yield chunk
+            else:
+                yield from chunk
+        yield _preview_tail(reload_parent)
+    return Response(stream_with_context(generate()), mimetype="text/html")
+
+def _cell(c) -> str:
+    return escape(str(c)) if c else ""
+
+def row_html(r) -> str:
+    return "<tr>" + "".join(f"<td style='border:1px solid #333;padding:4px;'>{_cell(c)}</td>" for c in r) + "</tr>"
+
+def table_chunks(header, rows, batch: int = PREVIEW_ROW_BATCH):
+    # escaped <table> markup, PREVIEW_ROW_BATCH rows at a time; rows may be any iterable
+    yield ("<table style='width:100%;border-collapse:collapse;'><thead><tr>"
+           + "".join(f"<th style='border:1px solid #444;padding:4px;'>{_cell(h)}</th>" for h in header)
+           + "</tr></thead><tbody id='rows'>")
+    buf = []
+    for r in rows:
+        buf.append(row_html(r))
+        if len(buf) >= batch:
+            yield "".join(buf)
+            buf = []
+    yield "".join(buf) + "</tbody></table>"
+
+def figure_html(src: str, caption: str, flag_errors: bool = False) -> str:
+    cap, src = escape(caption or ""), escape(src)
+    onerror = (" onerror=\"this.style.display='none';"
+               "var e=document.createElement('div');"
+               "e.style.cssText='color:#f66;font-size:11px;padding:6px;';"
+               "e.textContent='(image failed) ';"
+               "this.parentNode.appendChild(e);\"") if flag_errors else ""
+    return ("<figure style='margin:0;padding:0;text-align:center;background:#000" + (";position:relative;" if flag_errors else "") + "'>"
+            f"<img src='{src}' alt='{cap}' style='max-width:100%;height:140px;object-fit:contain;display:block;'{onerror}>"
+            f"<figcaption style='font-size:12px;padding:4px 0'>{cap}</figcaption>"
+            "</figure>")
+
+GALLERY_OPEN = ("<div style='margin-top:12px'><h4>Pictures</h4>"
+                "<div id='gallery' style='display:grid;grid-template-columns:repeat(auto-fill,minmax(140px,1fr));gap:8px;'>")
+GALLERY_CLOSE = "</div></div>"
+
+def gallery_chunks(figures):
+    # wraps an iterable of figure_html() strings in the Pictures grid; emits nothing when it is empty
+    opened = False
+    for fig in figures:
+        if not opened:
+            opened = True
+            yield GALLERY_OPEN
+        yield fig
+    if opened:
+        yield GALLERY_CLOSE
+
+def load_more_html(url: str, params: dict, cursor: str) -> str:
+    # "Load more" sentinel: when scrolled into view (or clicked) it POSTs params + cursor + fragment=1 to url and
+    # appends the returned {"rows", "figures", "next_cursor"} to #rows / #gallery until no cursor is left
+    if not cursor:
+        return ""
+    data = json.dumps({"url": url, "params": params, "gallery": GALLERY_OPEN + GALLERY_CLOSE}).replace("</", "<\\/")
+    return f"""<div id='more' data-cursor='{escape(cursor)}' style='padding:8px;text-align:center'><button type='button'>Load more</button></div>
+<script>
+(function(){{
+  var cfg = {data}, more = document.getElementById('more'), busy = false;
+  function load(){{
+    if (busy || !more.dataset.cursor) return;
+    busy = true;
+    var body = new URLSearchParams(cfg.params);
+    body.set('cursor', more.dataset.cursor);
+    body.set('fragment', '1');
+    fetch(cfg.url, {{method: 'POST', body: body, credentials: 'same-origin'}}).then(function(r){{ return r.json(); }}).then(function(d){{
+      document.getElementById('rows').insertAdjacentHTML('beforeend', d.rows || '');
+      if (d.figures) {{
+        if (!document.getElementById('gallery')) more.insertAdjacentHTML('beforebegin', cfg.gallery);
+        document.getElementById('gallery').insertAdjacentHTML('beforeend', d.figures);
+      }}
+      more.dataset.cursor = d.next_cursor || '';
+      busy = false;
+      if (!d.next_cursor) more.remove();
+      else if (more.getBoundingClientRect().top < window.innerHeight) load();
+    }}).catch(function(){{ busy = false; }});
+  }}
+  more.querySelector('button').onclick = load;
+  if ('IntersectionObserver' in window) new IntersectionObserver(function(e){{ if (e[0].isIntersecting) load(); }}).observe(more);
+}})();
+</script>"""
+
+def with_page_headers(resp: Response, total: int, next_cursor: str) -> Response:
+    # X-Total-Count always; X-Next-Cursor and a rel="next" Link while more pages remain
+    resp.headers["X-Total-Count"] = str(total)
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+        if request.method == "GET":
+            args = dict(request.args.items(), cursor=next_cursor)
+            resp.headers["Link"] = f'<{request.path}?{urlencode(args)}>; rel="next"'
+    return resp
@@ -0,0 +1,166 @@
+import os, time, threading
+from collections import deque
+from contextlib import contextmanager
+
+SQL_POOL_MIN = int(os.getenv("SQL_POOL_MIN", "1"))
+SQL_POOL_MAX = int(os.getenv("SQL_POOL_MAX", "8"))
+SQL_POOL_MAX_LIFETIME = float(os.getenv("SQL_POOL_MAX_LIFETIME", "1800"))  # seconds before a connection is replaced
+SQL_POOL_TIMEOUT = float(os.getenv("SQL_POOL_TIMEOUT", "30"))              # seconds a checkout waits for a free slot
+
+class PoolTimeout(Exception):
+    pass
+
+#--- CONNECTION POOL ---#
+# Keeps up to max_size open DB-API connections made by connect() so a request borrows one instead of paying login
+# and TLS again. Checkout takes the most recently returned connection (warm, least likely to have been dropped),
+# runs SELECT 1 on it and replaces it if that fails or it is older than max_lifetime; return rolls back whatever the
+# borrower left open. When every slot is busy, checkout waits up to timeout. min_size connections are opened in the
+# background on first use. Wait time and checkouts are counted for stats().
+class ConnectionPool:
+    def __init__(self, name: str, connect, min_size: int = SQL_POOL_MIN, max_size: int = SQL_POOL_MAX,
+                 max_lifetime: float = SQL_POOL_MAX_LIFETIME, timeout: float = SQL_POOL_TIMEOUT):
+        self.name = name
+        self.connect = connect
+        self.min_size = min(min_size, max_size)
+        self.max_size = max(1, max_size)
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.idle = deque()  # (conn, opened at)
+        self.size = 0        # open connections, idle or borrowed
+        self.warmed = False
+        self.cond = threading.Condition()
+        self.counters = {"checkouts": 0, "connects": 0, "connect_failures": 0, "health_failures": 0, "expired": 0,
+                         "timeouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    @contextmanager
+    def connection(self):
+        conn, opened = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn, opened)
+
+    def acquire(self):
+        # (conn, opened at); raises PoolTimeout, or whatever connect() raises
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        self._warm()
+        while True:
+            conn, opened = self._take(deadline)
+            if conn is None:
+                conn, opened = self._open()
+            elif not self._healthy(conn, opened):
+                self._discard(conn)
+                continue
+            wait_ms = (time.perf_counter() - t0) * 1000.0
+            with self.cond:
+                self.counters["checkouts"] += 1
+                self.counters["wait_ms_total"] += wait_ms
+                self.counters["wait_ms_max"] = max(self.counters["wait_ms_max"], wait_ms)
+            return conn, opened
+
+    def release(self, conn, opened: float, broken: bool = False):
+        if not broken:
+            broken = not _rollback(conn)
+        if broken or self._expired(opened):
+            self._discard(conn)
+            return
+        with self.cond:
+            self.idle.append((conn, opened))
+            self.cond.notify()
+
+    def _take(self, deadline: float):
+        # (idle conn, opened at), or (None, None) when a new slot was reserved for the caller to open
+        with self.cond:
+            while True:
+                if self.idle:
+                    return self.idle.pop()
+                if self.size < self.max_size:
+                    self.size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise PoolTimeout(f"no {self.name} connection free after {self.timeout:g}s ({self.max_size} in use)")
+                self.cond.wait(remaining)
+
+    def _open(self):
+        # opens into a slot already reserved by _take
+        try:
+            conn = self.connect()
+        except BaseException:
+            with self.cond:
+                self.size -= 1
+                self.counters["connect_failures"] += 1
+                self.cond.notify()
+            raise
+        with self.cond:
+            self.counters["connects"] += 1
+        return conn, time.monotonic()
+
+    def _healthy(self, conn, opened: float) -> bool:
+        if self._expired(opened):
+            with self.cond:
+                self.counters["expired"] += 1
+            return False
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+                cur.fetchall()
+            finally:
+                cur.close()
+            return True
+        except Exception:
+            with self.cond:
+                self.counters["health_failures"] += 1
+            return False
+
+    def _expired(self, opened: float) -> bool:
+        return self.max_lifetime > 0 and time.monotonic() - opened > self.max_lifetime
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.cond:
+            self.size -= 1
+            self.cond.notify()
+
+    def _warm(self):
+        with self.cond:
+            if self.warmed or self.min_size <= 0:
+                return
+            self.warmed = True
+        threading.Thread(target=self._fill, daemon=True).start()
+
+    def _fill(self):
+        while True:
+            with self.cond:
+                if self.size >= self.min_size:
+                    return
+                self.size += 1
+            try:
+                conn, opened = self._open()
+            except Exception:
+                return  # the next checkout opens its own and reports the error
+            with self.cond:
+                self.idle.appendleft((conn, opened))  # behind the warm ones
+                self.cond.notify()
+
+    def stats(self) -> dict:
+        with self.cond:
+            c = dict(self.counters)
+            c["wait_ms_avg"] = round(c["wait_ms_total"] / c["checkouts"], 3) if c["checkouts"] else 0.0
+            c["wait_ms_total"], c["wait_ms_max"] = round(c["wait_ms_total"], 3), round(c["wait_ms_max"], 3)
+            return dict(c, pool=self.name, size=self.size, idle=len(self.idle), in_use=self.size - len(self.idle),
+                        min_size=self.min_size, max_size=self.max_size)
+
+def _rollback(conn) -> bool:
+    # ends whatever transaction the borrower left open; False when the connection is no longer usable
+    try:
+        conn.rollback()
+        return True
+    except Exception:
+        return False
@@ -0,0 +1,82 @@
+import os, io, csv, sqlite3, operator
+from contextlib import nullcontext
+
+SQLITE_INGEST_CACHE_KB = int(os.getenv("SQLITE_INGEST_CACHE_KB", str(64 * 1024)))
+NULL_IF_EMPTY = "NULLIF(?, '')"
+BULK_PRAGMAS = ("PRAGMA journal_mode = OFF", "PRAGMA synchronous = OFF", "PRAGMA temp_store = MEMORY",
+                f"PRAGMA cache_size = -{SQLITE_INGEST_CACHE_KB}")
+
+#--- BULK CSV INGEST ---#
+# Loads a CSV into an existing table in one transaction: csv.reader feeds executemany through a generator and
+# indexes are built once the rows are in. CSV columns are matched to table columns by header name, so extra feed
+# columns are skipped; a header that does not name every table column is read positionally instead (the first fields
+# in table order, as plain INSERT ... VALUES did). A header naming no table column, or missing the primary key, is
+# rejected with ValueError before anything is written. Typing happens inside SQLite: each value is bound as
+# NULLIF(?, '') and the column's declared affinity stores numeric text as INTEGER / REAL (anything unparseable
+# stays text), which is far cheaper than converting every cell in Python.
+def table_columns(conn: sqlite3.Connection, table: str):
+    # [(name, declared type)] in table order
+    return [(r[1], r[2]) for r in conn.execute(f"PRAGMA table_info({table})")]
+
+def primary_key(conn: sqlite3.Connection, table: str):
+    # [name] of the declared primary key columns, in key order
+    return [r[1] for r in sorted((r for r in conn.execute(f"PRAGMA table_info({table})") if r[5]), key=lambda r: r[5])]
+
+def bulk_pragmas(conn: sqlite3.Connection):
+    # no rollback journal or fsyncs while loading: the database is rebuilt from the feed if a load dies
+    for p in BULK_PRAGMAS:
+        conn.execute(p)
+
+def csv_records(csv_text, columns, required=()):
+    # (table columns filled, generator of value tuples); raises ValueError for a CSV that cannot fill the table
+    reader = csv.reader(io.StringIO(csv_text, newline="") if isinstance(csv_text, str) else csv_text)
+    header = next(reader, [])
+    pos = {name: i for i, name in enumerate(header)}
+    used = [name for name, _ in columns if name in pos]
+    if not used:
+        raise ValueError(f"CSV header names none of the table columns: {header}")
+    missing = [name for name in required if name not in pos]
+    if missing:
+        raise ValueError(f"CSV header is missing key column(s) {missing}")
+    names = [name for name, _ in columns]
+    if len(used) == len(columns):
+        idxs = [pos[name] for name in used]
+    elif len(header) == len(columns) and all(pos[name] == names.index(name) for name in used):
+        # same width and every column it does name sits where the table has it: the rest are read by position
+        used, idxs = names, list(range(len(columns)))
+    else:
+        raise ValueError(f"CSV has {len(header)} columns and names only {used} of the table's {names}")
+    pick = operator.itemgetter(*idxs) if len(idxs) > 1 else (lambda r: (r[idxs[0]],))
+    width = len(header)
+    def rows():
+        for r in reader:
+            if len(r) != width:
+                if not any(r):
+                    continue
+                r = (r + [""] * width)[:width]
+            yield pick(r)
+    return used, rows()
+
+def bulk_load(conn: sqlite3.Connection, table: str, csv_text, indexes=(), verb: str = "INSERT OR IGNORE") -> int:
+    # rows written; indexes are (name, "col[, col]") pairs created after the load
+    bulk_pragmas(conn)
+    names, rows = csv_records(csv_text, table_columns(conn, table), primary_key(conn, table))
+    before = conn.total_changes
+    sql = f"{verb} INTO {table} ({', '.join(names)}) VALUES ({', '.join([NULL_IF_EMPTY] * len(names))})"
+    with conn:
+        conn.executemany(sql, rows)
+        for name, cols in indexes:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})")
+    return conn.total_changes - before
+
+def upsert_csv(conn: sqlite3.Connection, table: str, csv_text, key: str = "id", version: str = "updated") -> int:
+    # rows inserted or changed: new keys are added, existing ones are overwritten only when the feed's version
+    # column is newer, so replaying an overlapping feed window is a no-op
+    names, rows = csv_records(csv_text, table_columns(conn, table), (key,))
+    sets = ", ".join(f"{n} = excluded.{n}" for n in names if n != key)
+    newer = f" WHERE excluded.{version} > {table}.{version} OR {table}.{version} IS NULL" if version in names else ""
+    sql = (f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join([NULL_IF_EMPTY] * len(names))}) "
+           f"ON CONFLICT({key}) DO UPDATE SET {sets}{newer}")
+    with nullcontext() if conn.in_transaction else conn:  # inside a caller's transaction, the caller commits
+        cur = conn.executemany(sql, rows)  # rowcount leaves out rows written by triggers (the R*Tree)
+    return max(cur.rowcount, 0)
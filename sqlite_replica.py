@@ -0,0 +1,247 @@
+import os, time, hashlib, sqlite3, tempfile, threading
+from urllib.parse import quote
+import requests
+from blob_client import BlobClient
+from sqlite_spatial import register_spatial
+
+SQLITE_REPLICA_DIR = os.getenv("SQLITE_REPLICA_DIR", os.path.join(tempfile.gettempdir(), "sqlite-replicas"))
+SQLITE_REPLICA_TTL = float(os.getenv("SQLITE_REPLICA_TTL", "2"))  # seconds a replica is trusted before revalidating
+SQLITE_DOWNLOAD_CHUNK = 1024 * 1024
+SQLITE_FETCH_BATCH = int(os.getenv("SQLITE_FETCH_BATCH", "500"))
+SQLITE_STREAM_RESULTS = os.getenv("SQLITE_STREAM_RESULTS", "false").lower() == "true"
+# serialize()/deserialize() arrived in Python 3.11 and the shared memdb VFS in SQLite 3.36; without them replicas
+# live in SQLITE_REPLICA_DIR and images go through a temp file
+SQLITE_IN_MEMORY = (hasattr(sqlite3.Connection, "deserialize") and sqlite3.sqlite_version_info >= (3, 36)
+                    and os.getenv("SQLITE_IN_MEMORY", "true").lower() == "true")
+
+#--- LOCAL REPLICA ---#
+# One copy of a SQLite blob per worker and ETag, read through one read-only connection per thread. The copy is a
+# shared in-memory database (memdb VFS) filled straight from the downloaded bytes, or an immutable file in
+# SQLITE_REPLICA_DIR on older Pythons. Reads revalidate with If-None-Match at most every SQLITE_REPLICA_TTL seconds,
+# so only a changed blob is downloaded again; writers in this process call mark_stale() after their PUT.
+class SqliteReplica:
+    def __init__(self, client: BlobClient, blob_name: str):
+        self.client = client
+        self.blob_name = blob_name
+        self.uri = None      # what reader connections open
+        self.anchor = None   # connection keeping the in-memory copy alive
+        self.path = None     # file copy, when not in memory
+        self.etag = None
+        self.fresh_until = 0.0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {"downloads": 0, "revalidations": 0, "not_modified": 0, "stale_served": 0}
+
+    def mark_stale(self):
+        with self.lock:
+            self.fresh_until = 0.0
+
+    def _count(self, name: str):
+        self.counters[name] += 1
+
+    def _current(self):
+        # (reader URI, err); downloads only when storage reports a new ETag
+        with self.lock:
+            if self.uri and time.monotonic() < self.fresh_until:
+                return self.uri, None
+            headers = {"If-None-Match": self.etag} if self.uri and self.etag else {}
+            if headers:
+                self._count("revalidations")
+            try:
+                r = self.client.get(self.blob_name, headers=headers, stream=True, timeout=30)
+            except requests.RequestException as e:
+                if self.uri:  # storage unreachable: keep answering from the last good copy
+                    self._count("stale_served")
+                    return self.uri, None
+                return None, f"Download error: {e}"
+            with r:
+                if r.status_code == 304 and self.uri:
+                    self._count("not_modified")
+                elif not r.ok:
+                    return None, f"Failed to download DB blob. HTTP {r.status_code}"
+                else:
+                    try:
+                        uri, anchor, path = self._load(r) if SQLITE_IN_MEMORY else self._store(r)
+                    except (OSError, sqlite3.Error, requests.RequestException) as e:
+                        return None, f"Download error: {e}"
+                    old_anchor, old_path = self.anchor, self.path
+                    self.uri, self.anchor, self.path, self.etag = uri, anchor, path, r.headers.get("ETag")
+                    self._count("downloads")
+                    # threads still reading the old copy keep it alive (open memdb connection / file handle)
+                    if old_anchor is not None:
+                        old_anchor.close()
+                    if old_path:
+                        try:
+                            os.remove(old_path)
+                        except OSError:
+                            pass
+            self.fresh_until = time.monotonic() + SQLITE_REPLICA_TTL
+            return self.uri, None
+
+    def _tag(self, r: requests.Response) -> str:
+        return hashlib.sha1(f"{self.client.blob_path(self.blob_name)} {r.headers.get('ETag')} {time.time()}".encode("utf-8")).hexdigest()[:16]
+
+    def _load(self, r: requests.Response):
+        # (uri, anchor, None): the image is deserialized in memory and copied page by page into a named memdb
+        # database that every thread's connection can open; nothing touches the disk
+        uri = f"file:/sqlite-replica-{os.getpid()}-{self._tag(r)}?vfs=memdb"
+        image = open_database_image(r.content)
+        try:
+            anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            image.backup(anchor)
+        finally:
+            image.close()
+        return uri, anchor, None
+
+    def _store(self, r: requests.Response):
+        # (uri, None, path): fallback that streams the body to a file and renames it into place, so a reader never
+        # sees a partial database
+        os.makedirs(SQLITE_REPLICA_DIR, exist_ok=True)
+        path = os.path.join(SQLITE_REPLICA_DIR, f"{os.getpid()}-{self._tag(r)}.db")
+        fd, tmp = tempfile.mkstemp(dir=SQLITE_REPLICA_DIR, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in r.iter_content(SQLITE_DOWNLOAD_CHUNK):
+                    f.write(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return f"file:{quote(path)}?mode=ro&immutable=1", None, path
+
+    def _open(self, uri: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")  # memdb copies are writable by default
+        register_spatial(conn)
+        return conn
+
+    def connection(self):
+        # (read-only sqlite3 connection for this thread on the current replica, err)
+        uri, err = self._current()
+        if err:
+            return None, err
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and self.local.uri == uri:
+            return conn, None
+        if conn is not None:
+            conn.close()
+        conn = self._open(uri)
+        self.local.conn, self.local.uri = conn, uri
+        return conn, None
+
+    def writable_copy(self):
+        # (in-memory read-write copy of the current replica, the ETag it was made from, err) for read-modify-write
+        _, err = self._current()
+        if err:
+            return None, None, err
+        with self.lock:  # opened under the lock so a concurrent refresh cannot drop the copy first
+            etag = self.etag
+            src = self._open(self.uri)
+        try:
+            dst = sqlite3.connect(":memory:", check_same_thread=False)
+            src.backup(dst)
+        finally:
+            src.close()
+        register_spatial(dst)
+        return dst, etag, None
+
+    def query(self, sql: str, params=()):
+        # (rows, err) for one statement against the replica
+        rows, _, err = self.select(sql, params)
+        return rows, err
+
+    def select(self, sql: str, params=()):
+        # (rows, column names, err) from a single execution
+        conn, err = self.connection()
+        if err:
+            return None, [], err
+        try:
+            cursor = conn.execute(sql, params)
+            try:
+                return cursor.fetchall(), _column_names(cursor), None
+            finally:
+                cursor.close()
+        except sqlite3.Error as e:
+            return None, [], f"SQLite error: {e}"
+
+    def stream(self, sql: str, params=(), batch: int = SQLITE_FETCH_BATCH):
+        # like select(), but rows is an iterator pulling fetchmany(batch) as it is consumed; the first batch is read
+        # here so errors surface before the response starts and an empty result is still falsy ([])
+        conn, err = self.connection()
+        if err:
+            return None, [], err
+        try:
+            cursor = conn.execute(sql, params)
+            first = cursor.fetchmany(batch)
+        except sqlite3.Error as e:
+            return None, [], f"SQLite error: {e}"
+        columns = _column_names(cursor)
+        if len(first) < batch:
+            cursor.close()
+            return first, columns, None
+        def rows():
+            try:
+                chunk = first
+                while chunk:
+                    yield from chunk
+                    chunk = cursor.fetchmany(batch)
+            finally:
+                cursor.close()
+        return rows(), columns, None
+
+    def stats(self) -> dict:
+        return dict(self.counters, etag=self.etag, uri=self.uri, in_memory=self.anchor is not None)
+
+#--- DATABASE IMAGES ---#
+def database_image(conn: sqlite3.Connection) -> bytes:
+    # the bytes of conn's main database as a .db file
+    if hasattr(conn, "serialize"):
+        return conn.serialize()
+    with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
+        temp_db_path = tmpfile.name
+    try:
+        disk_conn = sqlite3.connect(temp_db_path)
+        conn.backup(disk_conn)
+        disk_conn.close()
+        with open(temp_db_path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(temp_db_path)
+
+def open_database_image(data: bytes) -> sqlite3.Connection:
+    # read-write in-memory connection on a copy of the .db bytes
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    if hasattr(conn, "deserialize"):
+        conn.deserialize(data)
+        return conn
+    with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
+        tmpfile.write(data)
+        temp_db_path = tmpfile.name
+    try:
+        disk_conn = sqlite3.connect(temp_db_path)
+        disk_conn.backup(conn)
+        disk_conn.close()
+    finally:
+        os.remove(temp_db_path)
+    return conn
+
+def _column_names(cursor):
+    return [d[0] for d in cursor.description] if cursor.description else []
+
+_replicas = {}
+_replicas_lock = threading.Lock()
+
+def sqlite_replica(client: BlobClient, blob_name: str = "data.db") -> SqliteReplica:
+    key = client.blob_path(blob_name)
+    with _replicas_lock:
+        replica = _replicas.get(key)
+        if replica is None:
+            replica = _replicas[key] = SqliteReplica(client.pinned(), blob_name)
+        return replica
+
+def sqlite_replica_stats() -> dict:
+    with _replicas_lock:
+        return {key: r.stats() for key, r in _replicas.items()}
@@ -0,0 +1,271 @@
+import os, time, sqlite3, threading
+import requests
+from blob_client import BlobClient, AZURE_API_VERSION
+from sqlite_replica import sqlite_replica, database_image
+
+SQLITE_BATCH_WINDOW = float(os.getenv("SQLITE_BATCH_WINDOW", "0.05"))  # seconds a leader waits for more mutations
+SQLITE_LEASE_SECONDS = int(os.getenv("SQLITE_LEASE_SECONDS", "30"))    # 15-60, as storage allows
+SQLITE_LEASE_IDLE = float(os.getenv("SQLITE_LEASE_IDLE", "5"))         # idle seconds before the lease is released
+SQLITE_LEASE_WAIT = float(os.getenv("SQLITE_LEASE_WAIT", "30"))        # how long to wait for another holder
+SQLITE_DELTA_BLOCK = int(os.getenv("SQLITE_DELTA_BLOCK", str(16 * 1024)))  # upload block, rounded to whole pages
+MAX_BLOB_BLOCKS = 50000  # committed blocks storage allows per blob
+
+MISSING_BLOB = "DB blob does not exist."
+
+class WriteError(Exception):
+    pass
+
+#--- WRITE SESSION ---#
+# Mutations are fn(conn) -> result run against one read-write in-memory copy of a SQLite blob that stays open between
+# batches. Callers queue them; the leader waits SQLITE_BATCH_WINDOW for more, runs the batch in one transaction with a
+# savepoint per mutation (a WriteError or SQLite error undoes only that one) and uploads the database once. Writes go
+# under a blob lease, so while it is held no other worker can have changed the blob and the open copy needs no
+# revalidation; after SQLITE_LEASE_IDLE quiet seconds the lease is released, and the next batch compares ETags.
+# The blob is stored as page-aligned blocks named by content hash, so an upload sends only the blocks whose pages
+# changed and commits a block list that reuses the rest.
+class SqliteWriteSession:
+    def __init__(self, client: BlobClient, blob_name: str):
+        self.client = client
+        self.blob_name = blob_name
+        self.conn = None
+        self.etag = None
+        self.lease_id = None
+        self.lease_until = 0.0
+        self.last_write = 0.0
+        self.blocks = (None, None)  # (ETag, committed block ids) of the blob as last written or listed
+        self.queue = []
+        self.queue_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.counters = {"mutations": 0, "failures": 0, "batches": 0, "uploads": 0, "reloads": 0, "leases": 0,
+                         "image_bytes": 0, "sent_bytes": 0}
+        threading.Thread(target=self._reaper, daemon=True).start()
+
+    def apply(self, mutation):
+        # (result, err); err is a user-facing message
+        slot = {"done": False, "result": None, "error": None}
+        with self.queue_lock:
+            self.queue.append((mutation, slot))
+        with self.flush_lock:
+            if not slot["done"]:
+                if SQLITE_BATCH_WINDOW > 0:
+                    time.sleep(SQLITE_BATCH_WINDOW)
+                with self.queue_lock:
+                    batch, self.queue = self.queue, []
+                try:
+                    self._deliver(self._flush(batch))
+                except Exception as e:
+                    # a mutation raised something unexpected: nobody queued behind it may be left waiting on a slot
+                    self._deliver([(s, None, f"error: {e}") for _, s in batch if not s["done"]])
+                    raise
+        return slot["result"], slot["error"]
+
+    def replace(self, data: bytes):
+        # err or None; uploads a whole new database (a rebuild) under the lease and drops the open copy. A missing
+        # blob cannot be leased, so it is created with a conditional upload instead
+        with self.flush_lock:
+            err = self._lease()
+            if err == MISSING_BLOB:
+                created, err = self._create(data)
+                if created or err:
+                    self._drop()
+                    return err
+                err = self._lease()  # another writer created it first: overwrite theirs under the lease
+            if err:
+                return err
+            err = self._upload(data)
+            self._drop()
+            return err
+
+    def _flush(self, batch):
+        # [(slot, result, err)]
+        err = self._lease() or self._prepare()
+        if err:
+            return [(slot, None, err) for _, slot in batch]
+        self._count("batches")
+        conn, before = self.conn, self.conn.total_changes
+        outcome = []
+        conn.execute("BEGIN")
+        try:
+            for mutation, slot in batch:
+                conn.execute("SAVEPOINT mutation")
+                try:
+                    result, error = mutation(conn), None
+                except WriteError as e:
+                    result, error = None, str(e)
+                except sqlite3.Error as e:
+                    result, error = None, f"SQLite error: {e}"
+                if error:
+                    conn.execute("ROLLBACK TO mutation")
+                conn.execute("RELEASE mutation")
+                outcome.append((slot, result, error))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if conn.total_changes == before:
+            conn.execute("ROLLBACK")
+            return outcome
+        conn.execute("COMMIT")
+        err = self._upload(database_image(conn))
+        if err:
+            self._drop()  # the copy holds changes storage never got
+            return [(slot, None, err) for _, slot, _ in outcome]
+        return outcome
+
+    def _upload(self, data: bytes):
+        headers = {"x-ms-lease-id": self.lease_id}
+        etag, committed = self.blocks
+        if etag is None or etag != self.etag:
+            committed = self.client.committed_blocks(self.blob_name, headers) or []
+        try:
+            r, ids, sent = self.client.put_delta(self.blob_name, data, "application/octet-stream",
+                                                 page_aligned(data, SQLITE_DELTA_BLOCK), committed, headers)
+        except requests.RequestException as e:
+            self.blocks = (None, None)
+            return f"DB upload error: {e}"
+        finally:
+            sqlite_replica(self.client, self.blob_name).mark_stale()
+        if r.status_code not in (201, 202):
+            self.blocks = (None, None)
+            if r.status_code == 412:
+                self.lease_id = None
+            return f"DB upload failed: HTTP {r.status_code}"
+        self._uploaded(r, data, ids, sent)
+        return None
+
+    def _create(self, data: bytes):
+        # (created, err); uploads only while the blob still does not exist (If-None-Match: *)
+        try:
+            r, ids, sent = self.client.put_delta(self.blob_name, data, "application/octet-stream",
+                                                 page_aligned(data, SQLITE_DELTA_BLOCK), (), {"If-None-Match": "*"})
+        except requests.RequestException as e:
+            return False, f"DB upload error: {e}"
+        finally:
+            sqlite_replica(self.client, self.blob_name).mark_stale()
+        if r.status_code in (409, 412):
+            return False, None
+        if r.status_code not in (201, 202):
+            return False, f"DB upload failed: HTTP {r.status_code}"
+        self._uploaded(r, data, ids, sent)
+        return True, None
+
+    def _uploaded(self, r: requests.Response, data: bytes, ids, sent: int):
+        self._count("uploads")
+        self._count("image_bytes", len(data))
+        self._count("sent_bytes", sent)
+        self.etag = r.headers.get("ETag")
+        self.blocks = (self.etag, ids)
+        self.last_write = time.monotonic()
+
+    def _prepare(self):
+        # err or None; (re)opens the copy when there is none or the blob changed while the lease was not held
+        if self.conn is not None and self.etag is not None:
+            return None
+        replica = sqlite_replica(self.client, self.blob_name)
+        replica.mark_stale()
+        conn, etag, err = replica.writable_copy()
+        if err:
+            return err
+        self._drop()
+        conn.isolation_level = None  # transactions are managed explicitly in _flush
+        self.conn, self.etag = conn, etag
+        self._count("reloads")
+        return None
+
+    def _drop(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.conn, self.etag = None, None
+
+    def _lease_request(self, action: str, **headers):
+        headers.update({"x-ms-version": AZURE_API_VERSION, "x-ms-lease-action": action})
+        return self.client.request("PUT", self.blob_name, params={"comp": "lease"}, headers=headers)
+
+    def _lease(self):
+        # err or None; renews a held lease once half of it is used, otherwise acquires one (waiting out other holders)
+        now = time.monotonic()
+        if self.lease_id and now < self.lease_until - SQLITE_LEASE_SECONDS / 2:
+            return None
+        try:
+            if self.lease_id and now < self.lease_until:
+                r = self._lease_request("renew", **{"x-ms-lease-id": self.lease_id})
+                if r.status_code == 200:
+                    self.lease_until = now + SQLITE_LEASE_SECONDS
+                    return None
+            self.lease_id = None
+            deadline = now + SQLITE_LEASE_WAIT
+            while True:
+                r = self._lease_request("acquire", **{"x-ms-lease-duration": str(SQLITE_LEASE_SECONDS)})
+                if r.status_code == 201:
+                    break
+                if r.status_code == 404:
+                    return MISSING_BLOB
+                if r.status_code != 409 or time.monotonic() >= deadline:
+                    return f"Failed to lease DB blob. HTTP {r.status_code}"
+                time.sleep(0.2)
+            lease_id = r.headers.get("x-ms-lease-id")
+            if self.conn is not None:  # the copy is still good if nobody wrote while we held no lease
+                head = self.client.head(self.blob_name)
+                if not head.ok or head.headers.get("ETag") != self.etag:
+                    self._drop()
+        except requests.RequestException as e:
+            return f"DB lease error: {e}"
+        self.lease_id, self.lease_until = lease_id, time.monotonic() + SQLITE_LEASE_SECONDS
+        self._count("leases")
+        return None
+
+    def _release(self):
+        lease_id, self.lease_id = self.lease_id, None
+        try:
+            self._lease_request("release", **{"x-ms-lease-id": lease_id})
+        except requests.RequestException:
+            pass  # it expires on its own
+
+    def _reaper(self):
+        while True:
+            time.sleep(1)
+            if not self.flush_lock.acquire(blocking=False):
+                continue
+            try:
+                if self.lease_id and time.monotonic() - self.last_write > SQLITE_LEASE_IDLE:
+                    self._release()
+            finally:
+                self.flush_lock.release()
+
+    def _deliver(self, outcome):
+        for slot, result, error in outcome:
+            slot["result"], slot["error"], slot["done"] = result, error, True
+            self._count("mutations" if error is None else "failures")
+
+    def _count(self, name: str, n: int = 1):
+        with self.queue_lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def stats(self) -> dict:
+        with self.queue_lock:
+            return dict(self.counters, blob=self.blob_name, etag=self.etag, leased=self.lease_id is not None,
+                        queued=len(self.queue))
+
+def page_aligned(image: bytes, size: int) -> int:
+    # size rounded up to whole pages of the SQLite image (page size is bytes 16-17 of the header, 1 meaning 65536),
+    # and grown for very large images so the block list stays within MAX_BLOB_BLOCKS
+    page = int.from_bytes(image[16:18], "big") if len(image) >= 100 else 4096
+    page = 65536 if page == 1 else (page or 4096)
+    size = max(size, -(-len(image) // MAX_BLOB_BLOCKS))
+    return max(page, -(-size // page) * page)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def write_session(client: BlobClient, blob_name: str = "data.db") -> SqliteWriteSession:
+    # one session per blob per worker so concurrent requests share its queue, copy and lease
+    key = client.blob_path(blob_name)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = SqliteWriteSession(client.pinned(), blob_name)
+        return session
+
+def write_session_stats() -> list:
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+    return [s.stats() for s in sessions]
@@ -0,0 +1,71 @@
+import math, sqlite3
+
+EARTH_RADIUS_KM = 6371.0088
+
+#--- SPATIAL INDEX ---#
+# <table>_rtree is an R*Tree over each row's (lat, lon) point keyed by rowid, kept in step with the table by triggers.
+# Area queries take their candidates from it (an index probe instead of a full scan) and then apply the exact test:
+# the box itself, plus great-circle distance for radius queries (R*Tree stores 32-bit floats, rounded outward).
+def rtree_name(table: str) -> str:
+    return f"{table}_rtree"
+
+def build_rtree(conn: sqlite3.Connection, table: str, lat_col: str, lon_col: str):
+    rt = rtree_name(table)
+    point = f"typeof({{r}}.{lat_col}) IN ('real', 'integer') AND typeof({{r}}.{lon_col}) IN ('real', 'integer')"
+    with conn:
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {rt} USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+        conn.execute(f"DELETE FROM {rt}")
+        conn.execute(f"INSERT INTO {rt} SELECT rowid, {lat_col}, {lat_col}, {lon_col}, {lon_col} FROM {table} t "
+                     f"WHERE {point.format(r='t')}")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {rt}_ins AFTER INSERT ON {table} WHEN {point.format(r='NEW')} BEGIN "
+                     f"INSERT INTO {rt} VALUES (NEW.rowid, NEW.{lat_col}, NEW.{lat_col}, NEW.{lon_col}, NEW.{lon_col}); END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {rt}_upd AFTER UPDATE OF {lat_col}, {lon_col} ON {table} BEGIN "
+                     f"DELETE FROM {rt} WHERE id = OLD.rowid; "
+                     f"INSERT INTO {rt} SELECT NEW.rowid, NEW.{lat_col}, NEW.{lat_col}, NEW.{lon_col}, NEW.{lon_col} "
+                     f"WHERE {point.format(r='NEW')}; END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {rt}_del AFTER DELETE ON {table} BEGIN "
+                     f"DELETE FROM {rt} WHERE id = OLD.rowid; END")
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    # great-circle distance, or None when a coordinate is missing / not numeric
+    try:
+        p1, p2 = math.radians(lat1), math.radians(lat2)
+        dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    except TypeError:
+        return None
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def register_spatial(conn: sqlite3.Connection):
+    conn.create_function("haversine_km", 4, haversine_km, deterministic=True)
+
+def radius_boxes(lat: float, lon: float, km: float):
+    # [(lat_lo, lat_hi, lon_lo, lon_hi)] covering the circle; split in two when it crosses the antimeridian
+    r = km / EARTH_RADIUS_KM
+    lat_lo, lat_hi = lat - math.degrees(r), lat + math.degrees(r)
+    if lat_lo <= -90 or lat_hi >= 90:
+        return [(max(lat_lo, -90.0), min(lat_hi, 90.0), -180.0, 180.0)]
+    s = math.sin(r) / math.cos(math.radians(lat))
+    if s >= 1:
+        return [(lat_lo, lat_hi, -180.0, 180.0)]
+    dlon = math.degrees(math.asin(s))
+    lo, hi = lon - dlon, lon + dlon
+    if lo < -180:
+        return [(lat_lo, lat_hi, lo + 360, 180.0), (lat_lo, lat_hi, -180.0, hi)]
+    if hi > 180:
+        return [(lat_lo, lat_hi, lo, 180.0), (lat_lo, lat_hi, -180.0, hi - 360)]
+    return [(lat_lo, lat_hi, lo, hi)]
+
+def box_filter(table: str, lat_col: str, lon_col: str, boxes, indexed: bool = True):
+    # (WHERE fragment, params) for rows inside any of the boxes; candidates come from the R*Tree when indexed
+    exact = " OR ".join(f"({lat_col} BETWEEN ? AND ? AND {lon_col} BETWEEN ? AND ?)" for _ in boxes)
+    params = [v for b in boxes for v in b]
+    if not indexed:
+        return f"({exact})", params
+    probe = " OR ".join("(max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?)" for _ in boxes)
+    return f"{table}.rowid IN (SELECT id FROM {rtree_name(table)} WHERE {probe}) AND ({exact})", params + params
+
+def within_km(table: str, lat_col: str, lon_col: str, lat: float, lon: float, km: float, indexed: bool = True):
+    # (WHERE fragment, params) for rows within km of (lat, lon) along the great circle
+    where, params = box_filter(table, lat_col, lon_col, radius_boxes(lat, lon, km), indexed)
+    return f"{where} AND haversine_km({lat_col}, {lon_col}, ?, ?) <= ?", params + [lat, lon, km]
@@ -0,0 +1,30 @@
+import blob_client
+from blob_client import BlobClient
+
+class _ForbiddenSession:
+    # answers every container LIST with 403
+    def __init__(self):
+        self.lists = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.lists += 1
+        return type("Response", (), {"ok": False, "status_code": 403, "content": b""})()
+
+class HeadCountingClient(BlobClient):
+    def __init__(self, present):
+        super().__init__("list-test", "https://example.invalid/container", "")
+        self.present, self.heads = present, 0
+
+    def blob_exists(self, filename: str) -> bool:
+        self.heads += 1
+        return filename in self.present
+
+def test_failed_listing_is_cached(monkeypatch):
+    session = _ForbiddenSession()
+    monkeypatch.setattr(blob_client, "get_http_session", lambda: session)
+    client = HeadCountingClient({"b.png"})
+    assert client.find_image("a", (".jpg",)) is None
+    assert client.find_image("b", (".jpg", ".png")) == "b.png"
+    assert client.listed_exists("b.png")
+    assert session.lists == 1
+    assert client.heads == 4
@@ -0,0 +1,24 @@
+import base64
+import pytest
+import direct_upload
+
+try:
+    import HW1  # imports app, which needs pyodbc and the system ODBC library
+except ImportError as e:
+    pytest.skip(f"HW1 cannot be imported here: {e}", allow_module_level=True)
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(direct_upload, "DIRECT_UPLOAD", True)
+    monkeypatch.setattr(direct_upload, "STORAGE_ACCOUNT_KEY", base64.b64encode(b"k" * 32).decode("ascii"))
+    monkeypatch.setattr(HW1, "blob_exists", lambda name: False)
+    return HW1.app.test_client()
+
+def test_upload_url_for_csv_targets_metadata_csv(client):
+    r = client.post("/upload_url", data={"kind": "csv"})
+    assert r.status_code == 200
+    ticket = r.get_json()
+    assert ticket["blob"] == "metadata.csv"
+    assert ticket["headers"]["Content-Type"] == "text/csv"
+    assert "/HW1/metadata.csv?" in ticket["url"]
+    assert "kind=csv" in ticket["complete"]
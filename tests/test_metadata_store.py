@@ -0,0 +1,32 @@
+import pytest
+from metadata_store import MetadataStore, add_row_edit
+from metadata_table import MetadataTable
+
+class FixedTableStore(MetadataStore):
+    # reads a fixed table instead of the blob; uploads always succeed
+    def __init__(self, rows):
+        super().__init__(_AcceptingClient(), "metadata.csv")
+        self.table_ = MetadataTable.from_rows(rows)
+
+    def _versioned(self):
+        return self.table_, None, None
+
+class _AcceptingClient:
+    def put(self, *args, **kwargs):
+        return type("Response", (), {"status_code": 201, "headers": {}})()
+
+    def seed_cache(self, *args, **kwargs):
+        pass
+
+def test_unexpected_edit_error_fails_the_whole_batch():
+    store = FixedTableStore([["Name", "Age"], ["ann", "30"]])
+    queued = {"done": False, "result": None, "error": None}
+    store.queue.append((add_row_edit("bob"), queued))  # queued behind the leader, flushed in its batch
+
+    def broken(table):
+        raise TypeError("bad value")
+
+    with pytest.raises(TypeError):
+        store.apply(broken)
+    assert queued["done"] and queued["result"] is None
+    assert queued["error"] == "error: bad value"
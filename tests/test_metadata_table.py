@@ -0,0 +1,36 @@
+from metadata_table import MetadataTable
+
+def _table(n):
+    return MetadataTable.from_rows([["Name", "Num"]] + [[f"r{i}", str(i)] for i in range(n)])
+
+def _names(table, positions):
+    return [table.row(pos)[0] for pos in positions]
+
+def test_page_walks_every_row_once():
+    table, seen, cursor = _table(7), [], None
+    while True:
+        chunk, cursor, err = table.page(list(range(len(table))), 3, cursor)
+        assert err is None
+        seen += _names(table, chunk)
+        if cursor is None:
+            break
+    assert seen == [f"r{i}" for i in range(7)]
+
+def test_page_after_earlier_rows_deleted():
+    table = _table(10)
+    chunk, cursor, _ = table.page(list(range(len(table))), 3)
+    assert _names(table, chunk) == ["r0", "r1", "r2"]
+    table.delete(0)
+    chunk, _, _ = table.page(list(range(len(table))), 3, cursor)
+    assert _names(table, chunk) == ["r3", "r4", "r5"]
+
+def test_page_after_cursor_row_deleted():
+    table = _table(10)
+    chunk, cursor, _ = table.page(list(range(len(table))), 3)
+    table.delete(2)  # the row the cursor names
+    table.delete(1)
+    chunk, _, _ = table.page(list(range(len(table))), 3, cursor)
+    assert _names(table, chunk) == ["r3", "r4", "r5"]
+
+def test_page_rejects_garbled_cursor():
+    assert _table(3).page([0, 1, 2], 2, "not-a-cursor")[2] == "Invalid cursor."
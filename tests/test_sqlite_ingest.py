@@ -0,0 +1,51 @@
+import sqlite3
+import pytest
+from sqlite_ingest import bulk_load, upsert_csv
+
+SCHEMA = "CREATE TABLE data_tab (time INTEGER, lat REAL, long REAL, mag REAL, nst INTEGER, net TEXT, id TEXT PRIMARY KEY)"
+
+def _table():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(SCHEMA)
+    return conn
+
+def _rows(conn):
+    return conn.execute("SELECT time, lat, long, mag, nst, net, id FROM data_tab ORDER BY id").fetchall()
+
+def test_columns_matched_by_header_name():
+    conn = _table()
+    csv_text = "id,net,extra,time,lat,long,mag,nst\na1,ak,x,1700000000,10.5,20.25,3.2,5\na2,nc,y,1700000001,,21,,\n"
+    assert bulk_load(conn, "data_tab", csv_text) == 2
+    assert _rows(conn) == [(1700000000, 10.5, 20.25, 3.2, 5, "ak", "a1"), (1700000001, None, 21, None, None, "nc", "a2")]
+
+def test_partial_header_falls_back_to_positions():
+    conn = _table()
+    csv_text = "time,latitude,longitude,mag,nst,net,id\n1700000000,10.5,20.25,3.2,5,ak,a1\n"
+    assert bulk_load(conn, "data_tab", csv_text) == 1
+    assert _rows(conn) == [(1700000000, 10.5, 20.25, 3.2, 5, "ak", "a1")]
+
+def test_partial_header_of_another_width_is_rejected():
+    conn = _table()
+    with pytest.raises(ValueError):
+        bulk_load(conn, "data_tab", "time,latitude,longitude,mag,nst,net,id,extra\n1700000000,10.5,20.25,3.2,5,ak,a1,x\n")
+    assert _rows(conn) == []
+
+def test_partial_header_out_of_table_order_is_rejected():
+    conn = _table()
+    with pytest.raises(ValueError):
+        bulk_load(conn, "data_tab", "id,latitude,longitude,mag,nst,net,time\na1,10.5,20.25,3.2,5,ak,1700000000\n")
+    assert _rows(conn) == []
+
+def test_header_matching_nothing_is_rejected():
+    conn = _table()
+    with pytest.raises(ValueError):
+        bulk_load(conn, "data_tab", "a,b,c,d,e,f,g\n1,2,3,4,5,6,7\n")
+    assert _rows(conn) == []
+
+def test_header_without_primary_key_is_rejected():
+    conn = _table()
+    with pytest.raises(ValueError):
+        bulk_load(conn, "data_tab", "time,lat,long,mag,nst,net,code\n1,2,3,4,5,ak,a1\n")
+    with pytest.raises(ValueError):
+        upsert_csv(conn, "data_tab", "time,lat,long,mag,nst,net\n1,2,3,4,5,ak\n", version="time")
+    assert _rows(conn) == []
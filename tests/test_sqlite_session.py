@@ -0,0 +1,107 @@
+import re, sqlite3, itertools
+import requests
+from blob_client import BlobClient
+from sqlite_replica import database_image, open_database_image
+from sqlite_session import SqliteWriteSession
+
+_directories = itertools.count(1)
+
+class MemoryBlobClient(BlobClient):
+    # answers the block blob and lease calls the write session makes from an in-memory store; each client gets its
+    # own directory so the per-blob replica registry never hands a test another test's client
+    def __init__(self):
+        super().__init__(f"test-{next(_directories)}", "https://example.invalid/container", "")
+        self.blobs, self.uncommitted, self.calls = {}, {}, []
+        self.etags = itertools.count(1)
+
+    def pinned(self):
+        return self
+
+    def request(self, method, blob_name, timeout=10, **kwargs):
+        params, headers = kwargs.get("params") or {}, kwargs.get("headers") or {}
+        comp = params.get("comp")
+        self.calls.append((method, comp, headers.get("x-ms-lease-action")))
+        blob = self.blobs.get(blob_name)
+        if method == "PUT" and comp == "lease":
+            if blob is None:
+                return _response(404)
+            if headers["x-ms-lease-action"] == "acquire":
+                return _response(201, {"x-ms-lease-id": "lease-1"})
+            return _response(200)
+        if method == "PUT" and comp == "block":
+            self.uncommitted[params["blockid"]] = kwargs["data"]
+            return _response(201)
+        if method == "PUT" and comp == "blocklist":
+            if headers.get("If-None-Match") == "*" and blob is not None:
+                return _response(409)
+            committed = dict(blob["blocks"]) if blob else {}
+            ids = re.findall(r"<(?:Latest|Committed)>([^<]+)<", kwargs["data"].decode("utf-8"))
+            blocks = [(i, self.uncommitted.pop(i, None) or committed[i]) for i in ids]
+            etag = f'"{next(self.etags)}"'
+            self.blobs[blob_name] = {"blocks": blocks, "etag": etag}
+            return _response(201, {"ETag": etag})
+        if method == "GET" and comp == "blocklist":
+            if blob is None:
+                return _response(404)
+            names = "".join(f"<Block><Name>{i}</Name></Block>" for i, _ in blob["blocks"])
+            return _response(200, content=f"<BlockList><CommittedBlocks>{names}</CommittedBlocks></BlockList>".encode())
+        if method in ("GET", "HEAD"):
+            if blob is None:
+                return _response(404)
+            return _response(200, {"ETag": blob["etag"]}, b"".join(d for _, d in blob["blocks"]))
+        raise AssertionError(f"unexpected {method} {comp}")
+
+    def content(self, blob_name):
+        return b"".join(d for _, d in self.blobs[blob_name]["blocks"])
+
+def _response(status, headers=None, content=b""):
+    r = requests.Response()
+    r.status_code, r._content, r._content_consumed = status, content, True
+    r.headers.update(headers or {})
+    return r
+
+def _image(rows):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE data_tab (id TEXT PRIMARY KEY, note TEXT)")
+    conn.executemany("INSERT INTO data_tab VALUES (?, ?)", [(r, r * 40) for r in rows])
+    conn.commit()
+    return database_image(conn)
+
+def _ids(data):
+    return [r[0] for r in open_database_image(data).execute("SELECT id FROM data_tab ORDER BY id")]
+
+def test_replace_creates_missing_blob():
+    client = MemoryBlobClient()
+    session = SqliteWriteSession(client, "data.db")
+    assert session.replace(_image(["a1", "a2"])) is None
+    assert _ids(client.content("data.db")) == ["a1", "a2"]
+    blocklist = [c for c in client.calls if c[1] == "blocklist" and c[0] == "PUT"]
+    assert len(blocklist) == 1
+
+def test_replace_existing_blob_goes_through_lease():
+    client = MemoryBlobClient()
+    session = SqliteWriteSession(client, "data.db")
+    session.replace(_image(["a1"]))
+    client.calls.clear()
+    assert session.replace(_image(["b1", "b2", "b3"])) is None
+    assert ("PUT", "lease", "acquire") in client.calls
+    assert _ids(client.content("data.db")) == ["b1", "b2", "b3"]
+
+def test_apply_uploads_only_changed_blocks():
+    client = MemoryBlobClient()
+    session = SqliteWriteSession(client, "data.db")
+    session.replace(_image([f"r{i:05d}" for i in range(3000)]))
+    before = [i for i, _ in client.blobs["data.db"]["blocks"]]
+    image_bytes, sent_bytes = session.counters["image_bytes"], session.counters["sent_bytes"]
+    client.calls.clear()
+    result, err = session.apply(lambda conn: conn.execute("UPDATE data_tab SET note = 'x' WHERE id = 'r02999'").rowcount)
+    assert (result, err) == (1, None)
+    after = [i for i, _ in client.blobs["data.db"]["blocks"]]
+    sent = session.counters["sent_bytes"] - sent_bytes
+    assert 0 < sent < session.counters["image_bytes"] - image_bytes
+    put_blocks = sum(1 for c in client.calls if c[:2] == ("PUT", "block"))
+    assert 0 < put_blocks < len(after)
+    assert len(set(before) & set(after)) == len(after) - put_blocks
+    assert _ids(client.content("data.db"))[-1] == "r02999"
+    conn = open_database_image(client.content("data.db"))
+    assert conn.execute("SELECT note FROM data_tab WHERE id = 'r02999'").fetchone() == ("x",)
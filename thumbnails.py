@@ -0,0 +1,67 @@
+import os, io
+import requests
+from PIL import Image, ImageOps
+from blob_client import BlobClient
+
+THUMB_DIR = os.getenv("THUMB_DIR", "thumbs")
+THUMB_HEIGHT = int(os.getenv("THUMB_HEIGHT", "140"))  # gallery <img> height
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "80"))
+THUMB_CACHE_CONTROL = os.getenv("THUMB_CACHE_CONTROL", "public, max-age=86400")
+
+#--- THUMBNAILS ---#
+# Resized webp variants live next to the originals as <dir>/thumbs/<file>_<height>.webp. upload_image writes them
+# eagerly; anything uploaded before that (or elsewhere) gets one on first gallery view.
+def thumb_client(client: BlobClient) -> BlobClient:
+    # the thumbs folder gets its own client so its listing is cached apart from the originals'
+    return BlobClient(f"{client.get_dir()}/{THUMB_DIR}", client.container_url, client.sas_token)
+
+def thumb_name(filename: str, height: int = THUMB_HEIGHT) -> str:
+    return f"{filename}_{height}.webp"
+
+def make_thumbnail(data, height: int = THUMB_HEIGHT):
+    # webp bytes scaled down to height (never up), or None when Pillow cannot read the image; data is bytes or a
+    # seekable binary file (an upload's spooled stream)
+    try:
+        with Image.open(data if hasattr(data, "read") else io.BytesIO(data)) as img:
+            img.draft("RGB", (height * 8, height))  # lets JPEG decode at reduced size
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((height * 8, height), Image.LANCZOS)
+            img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+            out = io.BytesIO()
+            img.save(out, "WEBP", quality=THUMB_QUALITY)
+            return out.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+def store_thumbnail(client: BlobClient, filename: str, data, height: int = THUMB_HEIGHT):
+    # writes the thumbnail for filename's bytes (or file) and returns its URL, or None
+    thumb = make_thumbnail(data, height)
+    if thumb is None:
+        return None
+    tc = thumb_client(client)
+    name = thumb_name(filename, height)
+    try:
+        r = tc.put(name, thumb, "image/webp", headers={"x-ms-blob-cache-control": THUMB_CACHE_CONTROL})
+    except requests.RequestException:
+        return None
+    return tc.get_blob_url(name) if r.status_code in (201, 202) else None
+
+def thumbnail_url(client: BlobClient, filename: str, height: int = THUMB_HEIGHT):
+    # URL of filename's thumbnail, generating it from the original the first time; None when that is not possible
+    tc = thumb_client(client)
+    name = thumb_name(filename, height)
+    if tc.listed_exists(name):
+        return tc.get_blob_url(name)
+    try:
+        r = client.get(filename, timeout=30)
+    except requests.RequestException:
+        return None
+    if not r.ok:
+        return None
+    return store_thumbnail(client, filename, r.content, height)
+
+def delete_thumbnail(client: BlobClient, filename: str, height: int = THUMB_HEIGHT):
+    try:
+        thumb_client(client).delete(thumb_name(filename, height))
+    except requests.RequestException:
+        pass